@@ -0,0 +1,251 @@
+"""
+Admission control for the RPC-heavy routes.
+
+Two layers, both per worker process:
+  1) per-client token bucket (X-API-Key if it is one of ADMISSION_API_KEYS,
+     else client IP) -> 429
+  2) priority gate: at most ADMISSION_MAX_CONCURRENT requests doing RPC work,
+     the rest wait in a bounded queue, interactive /prepare-sell ahead of
+     bulk /analyze. A full queue sheds its lowest-priority waiter (or the
+     newcomer, if that is the lowest) -> 503. Waiting longer than
+     ADMISSION_QUEUE_TIMEOUT_SECONDS -> 503.
+
+Every rejection carries a Retry-After hint (seconds).
+
+Limits are per worker: with N uvicorn workers a client gets N x the rate.
+Behind a proxy set ADMISSION_TRUST_FORWARDED=true, otherwise every client
+shares the proxy's IP (only do it when the proxy overwrites X-Forwarded-For).
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import metrics
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_RATE_PER_SECOND = float(os.getenv("ADMISSION_RATE_PER_SECOND", "2"))
+ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "30"))
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "64"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "256"))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_SECONDS", "5"))
+ADMISSION_TRUST_FORWARDED = os.getenv("ADMISSION_TRUST_FORWARDED", "false").lower() == "true"
+# keys that get their own bucket; any other X-API-Key is ignored (else a random
+# header per request would mean a fresh burst per request)
+ADMISSION_API_KEYS = {k.strip() for k in os.getenv("ADMISSION_API_KEYS", "").split(",") if k.strip()}
+ADMISSION_MAX_CLIENTS = 10_000  # tracked buckets before idle ones are pruned
+
+# lower = served first
+ROUTE_PRIORITY = {"prepare-sell": 0, "prepare-sell-batch": 1, "analyze": 2}
+# bucket tokens per request (the batch route can fan out to a full scan)
+ROUTE_COST = {"prepare-sell": 1.0, "prepare-sell-batch": 3.0, "analyze": 1.0}
+
+ADMISSION_DECISIONS = metrics.Counter(
+    "dcp_admission_total", "Admission decisions by route (admitted/rate_limited/shed/queue_timeout)",
+    ("route", "decision"),
+)
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after))
+
+
+# -----------------------
+# Per-client rate
+# -----------------------
+
+class TokenBuckets:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, List[float]] = {}  # client -> [tokens, last refill]
+
+    def take(self, client: str, cost: float = 1.0) -> float:
+        """0 if admitted, else seconds until `cost` tokens are available."""
+        now = time.monotonic()
+        b = self._buckets.get(client)
+        if b is None:
+            if len(self._buckets) >= ADMISSION_MAX_CLIENTS:
+                self._prune(now)
+            b = self._buckets[client] = [self.burst, now]
+        b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+        b[1] = now
+        if b[0] >= cost:
+            b[0] -= cost
+            return 0.0
+        return (cost - b[0]) / self.rate if self.rate > 0 else 60.0
+
+    def _prune(self, now: float) -> None:
+        # a bucket idle long enough to be full again carries no state
+        full_after = self.burst / self.rate if self.rate > 0 else float("inf")
+        for k in [k for k, (_, last) in self._buckets.items() if now - last >= full_after]:
+            del self._buckets[k]
+
+
+# -----------------------
+# Priority gate
+# -----------------------
+
+class PriorityGate:
+    def __init__(self, max_concurrent: int, max_queue: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        self._heap: list = []  # [priority, seq, future]; done futures are dead entries
+        self._queued = 0
+        self._seq = itertools.count()
+        self._avg_hold = 0.5  # EWMA seconds per admitted request, for Retry-After
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def retry_after(self) -> int:
+        return min(60, math.ceil(self._avg_hold * (self._queued + 1) / max(1, self.max_concurrent)))
+
+    def _shed_for(self, priority: int) -> None:
+        """Queue is full: drop the worst waiter if it's worse than us, else reject us."""
+        live = [e for e in self._heap if not e[2].done()]
+        worst = max(live, key=lambda e: (e[0], e[1]), default=None)
+        if worst is None or worst[0] <= priority:
+            raise Rejected(503, "shed", self.retry_after())
+        worst[2].set_exception(Rejected(503, "shed", self.retry_after()))
+        self._queued -= 1
+
+    async def acquire(self, priority: int, timeout: float) -> None:
+        if self.active < self.max_concurrent and self._queued == 0:
+            self.active += 1
+            return
+        if self._queued >= self.max_queue:
+            self._shed_for(priority)
+
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, [priority, next(self._seq), fut])
+        self._queued += 1
+        try:
+            await asyncio.wait({fut}, timeout=timeout)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                self.release(0.0)  # granted just as we were cancelled: hand it on
+            elif not fut.done():
+                fut.cancel()
+                self._queued -= 1
+            raise
+        if not fut.done():
+            fut.cancel()
+            self._queued -= 1
+            raise Rejected(503, "queue_timeout", self.retry_after())
+        fut.result()  # raises Rejected if we were shed
+
+    def release(self, held_seconds: float) -> None:
+        if held_seconds > 0:
+            self._avg_hold = 0.9 * self._avg_hold + 0.1 * held_seconds
+        self.active -= 1
+        while self._heap and self.active < self.max_concurrent:
+            _, _, fut = heapq.heappop(self._heap)
+            if fut.done():
+                continue
+            self._queued -= 1
+            self.active += 1
+            fut.set_result(True)
+
+
+_buckets = TokenBuckets(ADMISSION_RATE_PER_SECOND, ADMISSION_BURST)
+_gate = PriorityGate(ADMISSION_MAX_CONCURRENT, ADMISSION_MAX_QUEUE)
+
+metrics.Gauge("dcp_admission_queue_depth", "Requests waiting for an admission slot", fn=lambda: _gate.queued)
+metrics.Gauge("dcp_admission_active", "Requests holding an admission slot", fn=lambda: _gate.active)
+
+
+def client_key(request) -> str:
+    api_key = request.headers.get("x-api-key")
+    if api_key and api_key in ADMISSION_API_KEYS:
+        return "key:" + api_key
+    if ADMISSION_TRUST_FORWARDED:
+        fwd = request.headers.get("x-forwarded-for", "")
+        if fwd:
+            return "ip:" + fwd.split(",")[0].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
+
+
+@asynccontextmanager
+async def admit(request, route: str):
+    """
+    async with admission.admit(request, "analyze"): ...
+    Raises Rejected (status 429/503, retry_after) instead of entering.
+    """
+    if not ADMISSION_ENABLED:
+        yield
+        return
+
+    wait = _buckets.take(client_key(request), ROUTE_COST.get(route, 1.0))
+    if wait > 0:
+        ADMISSION_DECISIONS.inc(route, "rate_limited")
+        raise Rejected(429, "rate_limited", math.ceil(wait))
+
+    try:
+        await _gate.acquire(ROUTE_PRIORITY.get(route, 9), ADMISSION_QUEUE_TIMEOUT_SECONDS)
+    except Rejected as e:
+        ADMISSION_DECISIONS.inc(route, e.reason)
+        raise
+    ADMISSION_DECISIONS.inc(route, "admitted")
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        _gate.release(time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    # Self-check: ordering, shedding, timeouts and bucket refill
+    async def _check():
+        gate = PriorityGate(max_concurrent=1, max_queue=2)
+        order = []
+
+        async def job(name, prio, hold=0.05):
+            try:
+                await gate.acquire(prio, timeout=1.0)
+            except Rejected as e:
+                order.append(f"{name}:{e.reason}")
+                return
+            order.append(name)
+            await asyncio.sleep(hold)
+            gate.release(hold)
+
+        first = asyncio.ensure_future(job("first", 2))
+        await asyncio.sleep(0)
+        jobs = [asyncio.ensure_future(job("analyze1", 2)), asyncio.ensure_future(job("analyze2", 2))]
+        await asyncio.sleep(0)
+        jobs.append(asyncio.ensure_future(job("sell", 0)))  # queue full: sheds analyze2, jumps the line
+        await asyncio.gather(first, *jobs)
+        assert order == ["first", "analyze2:shed", "sell", "analyze1"], order
+        assert gate.active == 0 and gate.queued == 0
+
+        slow = PriorityGate(max_concurrent=1, max_queue=5)
+        await slow.acquire(0, 1.0)
+        try:
+            await slow.acquire(0, 0.05)
+            raise AssertionError("expected queue_timeout")
+        except Rejected as e:
+            assert e.reason == "queue_timeout" and e.retry_after >= 1
+        slow.release(0.1)
+        assert slow.active == 0 and slow.queued == 0
+
+    asyncio.run(_check())
+
+    b = TokenBuckets(rate=10, burst=2)
+    assert b.take("a") == 0 and b.take("a") == 0
+    assert 0 < b.take("a") <= 0.1
+    assert b.take("b") == 0  # other clients unaffected
+    time.sleep(0.11)
+    assert b.take("a") == 0
+    print("admission: ok")
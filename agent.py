@@ -21,6 +21,7 @@ from dotenv import load_dotenv
 from erc20_abi import ERC20_ABI
 from tokens import TOKENS
 from prices import PRICES
+from task_groups import Task, format_report, run_tasks
 
 
 def coin_flip():
@@ -95,42 +96,57 @@ RPC_URL = os.getenv("RPC_URL")
 PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 CHAIN_ID = int(os.getenv("CHAIN_ID", 143))
 DUST_THRESHOLD_USD = float(os.getenv("DUST_THRESHOLD_USD", 2))
+AGENT_CHAIN_TIMEOUT_SECONDS = float(os.getenv("AGENT_CHAIN_TIMEOUT_SECONDS", "900"))
+AGENT_SOCIAL_TIMEOUT_SECONDS = float(os.getenv("AGENT_SOCIAL_TIMEOUT_SECONDS", "120"))
+AGENT_SIM_TIMEOUT_SECONDS = float(os.getenv("AGENT_SIM_TIMEOUT_SECONDS", "30"))
+# per-task overrides: "clean_dust=600,promotion=60"
+AGENT_TASK_TIMEOUTS = {
+    k.strip(): float(v) for k, v in
+    (part.split("=", 1) for part in os.getenv("AGENT_TASK_TIMEOUTS", "").split(",") if "=" in part)
+}
 
-w3 = Web3(Web3.HTTPProvider(RPC_URL, request_kwargs={"timeout": 20}))
+# the validation middleware asks for eth_chainId on every call/estimate; it never changes
+w3 = Web3(Web3.HTTPProvider(RPC_URL, request_kwargs={"timeout": 20},
+                            cache_allowed_requests=True, cacheable_requests={"eth_chainId"}))
 account = w3.eth.account.from_key(PRIVATE_KEY)
 address = account.address
 
-def run_agent_once():
-    # Run counter (simple, resets when you restart the script)
+# -----------------------
+# Jobs (run_agent_once runs them all in order; scheduler.py fires each on its own trigger)
+# -----------------------
+
+STABLES = {"USDC", "USDT", "USDT0", "AUSD", "DAI", "USD1"}
+
+
+def next_run_count():
+    """Bumps and returns the run counter (simple, resets when you restart the script)."""
     global RUN_COUNT
     try:
         RUN_COUNT += 1
     except NameError:
         RUN_COUNT = 1
+    return RUN_COUNT
 
-    sold_symbols = []
-    did_sell = False
-    sold_symbols = []
-
-    print("\n=== AGENT STARTED ===")
-
-    print("[env] has MOLTBOOK_API_KEY:", "MOLTBOOK_API_KEY" in os.environ)
-    print("[env] MOLTBOOK_API_KEY length:", len(os.getenv("MOLTBOOK_API_KEY","")))
-    print("[env] MOLTBOOK_SUBMOLT:", repr(os.getenv("MOLTBOOK_SUBMOLT","")))
 
+def moltbook_heartbeat():
     try:
         hb = heartbeat()
         print("Moltbook:", (hb or {}).get("status"))
     except Exception as e:
-        print("Moltbook: unreachable (continuing). error:", e)    
-    
-    print("Agent wallet:", address)
-    print("Connected to Monad:", w3.is_connected())
-    print("MON balance:", w3.from_wei(w3.eth.get_balance(address), "ether"))
+        print("Moltbook: unreachable (continuing). error:", e)
+
+
+def clean_dust(tokens=None):
+    """
+    Stage 2 dust scan + Nad.fun sells. `tokens` limits the scan to those
+    contracts (the scheduler passes the ones new Transfer logs mention).
+    Returns the symbols sold.
+    """
+    sold_symbols = []
 
     print("\n--- Dust Analysis (Stage 2 Public) ---")
     try:
-        report = run_stage2_public_dust_scan(address)
+        report = run_stage2_public_dust_scan(address, tokens=tokens)
         dust = report.get("dust", []) or []
 
         print("source:", report.get("source"))
@@ -142,9 +158,6 @@ def run_agent_once():
         if not dust:
             print("No actionable dust found (Stage 2)")
         else:
-            sold_symbols = []
-            did_sell = False
-
             print("Dust found:")
             for d in dust:
                 sym = d.get("symbol", "TOKEN")
@@ -158,7 +171,6 @@ def run_agent_once():
                     continue
 
                 # Stablecoins: keep in report, but don't try Nad.fun swap path
-                STABLES = {"USDC", "USDT", "USDT0", "AUSD", "DAI", "USD1"}
                 if str(sym).upper() in STABLES:
                     print(f"Stablecoin detected (will not Nad.fun swap): {sym}")
                     continue
@@ -178,47 +190,57 @@ def run_agent_once():
                     "mon_value": mon_value,
                 })
 
-                if sold:
-                    did_sell = True
+                # unregistered tokens (PUBLIC_SCAN_UNREGISTERED) are cleaned quietly
+                if sold and d.get("registered", True):
                     sold_symbols.append(sym)
 
     except Exception as e:
         print("[stage2] error:", e)
 
-    # --- Moltbook promotion posts (templates) ---
-    try:
-        PROMOTION_ENABLED = os.getenv("PROMOTION_ENABLED", "true").lower() == "true"
-        PROMOTION_EVERY_N_RUNS = int(os.getenv("PROMOTION_EVERY_N_RUNS", "1"))
-        REPLY_ENABLED = os.getenv("REPLY_ENABLED", "true").lower() == "true"
-        REPLY_EVERY_N_RUNS = int(os.getenv("REPLY_EVERY_N_RUNS", "1"))
-    except Exception:
-        PROMOTION_ENABLED, PROMOTION_EVERY_N_RUNS = True, 1
-        REPLY_ENABLED, REPLY_EVERY_N_RUNS = True, 1
+    return sold_symbols
+
 
+def promotion_post():
     # Posts your launch/progress/stage2 updates from prompts/moltbook_templates.json
-    if POST_TO_MOLTBOOK:
-        try:
-            p = maybe_post_update(client)
-            if p:
-                pid = getattr(p, "id", None) or (p.get("id") if isinstance(p, dict) else None)
-                print("[promotion] template post sent ✅", pid or "")
-            else:
-                print("[promotion] no post sent (skipped or blocked)")
-        except Exception as e:
-            print("[promotion] skipped:", e)
+    if not POST_TO_MOLTBOOK:
+        return
+    try:
+        p = maybe_post_update(client)
+        if p:
+            pid = getattr(p, "id", None) or (p.get("id") if isinstance(p, dict) else None)
+            print("[promotion] template post sent ✅", pid or "")
+        else:
+            print("[promotion] no post sent (skipped or blocked)")
+    except Exception as e:
+        print("[promotion] skipped:", e)
 
+
+def comment_replies():
     # Replies to comments using prompts/moltbook_templates.json -> replies[]
-    if REPLY_ENABLED and POST_TO_MOLTBOOK and (RUN_COUNT % REPLY_EVERY_N_RUNS == 0):
-        try:
-            new_comments = fetch_new_comments(limit=20)
-            if new_comments:
-                maybe_reply_to_comments(client, new_comments)
-                print("[promotion] replied to comments ✅")
-            else:
-                print("[promotion] no new comments")
-        except Exception as e:
-            print("[promotion] reply skipped:", e)
-   
+    if not POST_TO_MOLTBOOK:
+        return
+    try:
+        new_comments = fetch_new_comments(limit=20)
+        if new_comments:
+            maybe_reply_to_comments(client, new_comments)
+            print("[promotion] replied to comments ✅")
+        else:
+            print("[promotion] no new comments")
+    except Exception as e:
+        print("[promotion] reply skipped:", e)
+
+
+def dm_replies():
+    if not POST_TO_MOLTBOOK:
+        return
+    try:
+        reply_to_dms()
+    except Exception as e:
+        print("Moltbook DM reply skipped:", e)
+
+
+def bet_simulation():
+    """Micro-bet + agent market quote. Returns what the run's build log reports."""
     print("\n--- Micro-Bet Simulation ---")
     agents = ["Agent_ALPHA", "Agent_BETA", "Agent_GAMMA", "Agent_DELTA"]
 
@@ -232,7 +254,7 @@ def run_agent_once():
 
     profile = AGENT_PROFILES.get(agent_a, {"likes": ["price", "gas", "launch"]})
     liked_tags = profile["likes"]
-    
+
     preferred = [m for m in markets if m["tag"] in liked_tags]
     picked = random.choice(preferred if preferred else markets)
 
@@ -266,9 +288,17 @@ def run_agent_once():
     print("Fair price:", fair_price)
     print("Agent quotes BUY at:", mm.quote_buy(fair_price))
     print("Agent quotes SELL at:", mm.quote_sell(fair_price))
-    
+
+    return {"bet": bet, "fair_price": fair_price, "buy": mm.quote_buy(fair_price), "sell": mm.quote_sell(fair_price)}
+
+
+def sell_updates(sold_symbols, sim=None, run_count=None):
+    """Moltbook posts about a run that sold something (no-op otherwise)."""
+    did_sell = bool(sold_symbols)
+    run_count = RUN_COUNT if run_count is None else run_count
+
     # Marketing post (only sometimes, only if a real sell happened)
-    if MARKETING_ENABLED and POST_TO_MOLTBOOK and did_sell and (RUN_COUNT % MARKETING_EVERY_N_RUNS == 0):
+    if MARKETING_ENABLED and POST_TO_MOLTBOOK and did_sell and (run_count % MARKETING_EVERY_N_RUNS == 0):
         try:
             msg = build_marketing_post(
                 agent_name="DustCleanerBot",
@@ -278,19 +308,23 @@ def run_agent_once():
             post_build_log("🧹 Dust Cleaner Update", msg)
             print("Marketing post sent ✅")
         except Exception as e:
-            print("Marketing skipped:", e)    
-
-    title = "Monad Agent Run: bet + market quote"
-    content = (
-        f"Wallet: {address}\n"
-        f"MON balance: {w3.from_wei(w3.eth.get_balance(address), 'ether')}\n\n"
-        f"Winner: {bet.winner} | Stake: {bet.stake}\n"
-        f"Question: {bet.question}\n\n"
-        f"TEST/USDC fair: {fair_price}\n"
-        f"BUY: {mm.quote_buy(fair_price)} | SELL: {mm.quote_sell(fair_price)}\n"
-    )
+            print("Marketing skipped:", e)
 
     if did_sell and POST_TO_MOLTBOOK:
+        title = "Monad Agent Run: bet + market quote" if sim else "Monad Agent Run: dust cleaned"
+        content = (
+            f"Wallet: {address}\n"
+            f"MON balance: {w3.from_wei(w3.eth.get_balance(address), 'ether')}\n\n"
+        )
+        if sim:
+            content += (
+                f"Winner: {sim['bet'].winner} | Stake: {sim['bet'].stake}\n"
+                f"Question: {sim['bet'].question}\n\n"
+                f"TEST/USDC fair: {sim['fair_price']}\n"
+                f"BUY: {sim['buy']} | SELL: {sim['sell']}\n"
+            )
+        else:
+            content += f"Sold: {', '.join(sold_symbols)}\n"
         try:
             post_build_log(title, content)
             print("Posted to Moltbook ✅")
@@ -306,31 +340,73 @@ def run_agent_once():
         except Exception as e:
             print("Moltbook marketing skipped:", e)
 
-    # --- Moltbook: DM replies (safe) ---
-    if POST_TO_MOLTBOOK:
-        try:
-            reply_to_dms()
-        except Exception as e:
-            print("Moltbook DM reply skipped:", e)
 
-    # --- Moltbook: template autopost + autoreply (safe) ---
-    # Posting is currently blocked (403). So: REPLY ONLY.
-    if POST_TO_MOLTBOOK:
-        try:
-            # ✅ only comment-replies (no posting)
-            new_comments = fetch_new_comments(limit=20)
-            if new_comments:
-                maybe_reply_to_comments(client, new_comments)
-            else:
-                print("[promotion] no new comments")
-        except Exception as e:
-            print("[promotion] reply skipped:", e)
-    # --- end Moltbook ---
-    
+def wallet_status():
+    print("Agent wallet:", address)
+    print("Connected to Monad:", w3.is_connected())
+    print("MON balance:", w3.from_wei(w3.eth.get_balance(address), "ether"))
+
+
+def run_agent_once():
+    """
+    One full agent run as independent task groups (task_groups.py): on-chain
+    work, Moltbook calls and the bet simulation run side by side, each task
+    with its own timeout, so a slow social API never delays dust cleaning.
+    Returns the per-task report (status + latency), which is also printed.
+    """
+    run_count = next_run_count()
+
+    print("\n=== AGENT STARTED ===")
+
+    print("[env] has MOLTBOOK_API_KEY:", "MOLTBOOK_API_KEY" in os.environ)
+    print("[env] MOLTBOOK_API_KEY length:", len(os.getenv("MOLTBOOK_API_KEY","")))
+    print("[env] MOLTBOOK_SUBMOLT:", repr(os.getenv("MOLTBOOK_SUBMOLT","")))
+
+    try:
+        reply_enabled = os.getenv("REPLY_ENABLED", "true").lower() == "true"
+        reply_every_n_runs = int(os.getenv("REPLY_EVERY_N_RUNS", "1"))
+    except Exception:
+        reply_enabled, reply_every_n_runs = True, 1
+
+    group_timeouts = {"chain": AGENT_CHAIN_TIMEOUT_SECONDS, "social": AGENT_SOCIAL_TIMEOUT_SECONDS,
+                      "sim": AGENT_SIM_TIMEOUT_SECONDS}
+
+    def task(name, group, fn, after=()):
+        return Task(name, group, fn, AGENT_TASK_TIMEOUTS.get(name, group_timeouts[group]), after)
+
+    def updates(results):
+        sell_updates(results.get("clean_dust") or [], results.get("bets"), run_count)
+
+    # groups run side by side; tasks inside a group run one at a time, in this order
+    tasks = [
+        task("wallet_status", "chain", wallet_status),
+        task("clean_dust", "chain", clean_dust),
+        task("heartbeat", "social", moltbook_heartbeat),
+        task("promotion", "social", promotion_post),
+    ]
+    if reply_enabled and (run_count % reply_every_n_runs == 0):
+        tasks.append(task("comment_replies", "social", comment_replies))
+    tasks += [
+        task("bets", "sim", bet_simulation),
+        task("sell_updates", "social", updates, after=("clean_dust", "bets")),
+        task("dm_replies", "social", dm_replies),
+        # Posting is currently blocked (403). So: REPLY ONLY.
+        task("replies_final", "social", comment_replies),
+    ]
+
+    report = run_tasks(tasks)
+    print(format_report(report))
+
     print("\n=== AGENT FINISHED ===")
-    
+    return report
+
+
 if __name__ == "__main__":
     print("🚀 Agent daemon started (24/7 mode)")
+    # AGENT_SCHEDULER=interval brings back the old fixed-sleep loop below
+    if os.getenv("AGENT_SCHEDULER", "events").lower() != "interval":
+        from scheduler import build_agent_scheduler
+        build_agent_scheduler().run_forever()
     while True:
         try:
             run_agent_once()
@@ -4,8 +4,15 @@ import os
 from agent import run_agent_once
 
 SLEEP_SECONDS = int(os.getenv("AGENT_SLEEP_SECONDS", "900"))  # 900 = 15 min
+# events (default): scheduler.py runs cleaning on inbound transfers and social jobs on their own cadences
+# interval: the old run_agent_once + sleep loop
+AGENT_SCHEDULER = os.getenv("AGENT_SCHEDULER", "events").lower()
 
 if __name__ == "__main__":
+    if AGENT_SCHEDULER != "interval":
+        from scheduler import build_agent_scheduler
+        build_agent_scheduler().run_forever()
+
     while True:
         try:
             run_agent_once()
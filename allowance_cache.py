@@ -0,0 +1,176 @@
+"""
+Allowance strategy + persistent allowance cache for the executor.
+
+Without it every sell reads allowance() and, when short, approves exactly the
+sell amount, so the next cleanup of the same token needs another approve.
+
+ALLOWANCE_MODE picks how much an approve grants:
+  exact   the sell amount (default; nothing is left approved after a sell)
+  budget  ALLOWANCE_BUDGET_SELLS x the sell amount, so the next few cleanups
+          of that token need no approve (opt-in: leaves a standing allowance)
+  max     uint256 max (routers then never need another approve)
+ALLOWANCE_ROUTER_MODES overrides it per router: "0xRouterA=max,0xRouterB=exact".
+
+Known allowances are kept per (owner, token, router) in ALLOWANCE_CACHE_FILE
+and only move on receipts: a confirmed sell sets what its approve granted
+(if it had one) and subtracts the amount sold; a reverted sell drops the entry
+so the next run reads the chain again (that is also how a revoke done outside
+this bot gets noticed). When the cached value covers a sell, plan_swap skips
+both the allowance() read and the approve.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+ALLOWANCE_CACHE_FILE = os.getenv("ALLOWANCE_CACHE_FILE", "allowance_cache.json")
+ALLOWANCE_MODE = os.getenv("ALLOWANCE_MODE", "exact").lower()
+ALLOWANCE_BUDGET_SELLS = int(os.getenv("ALLOWANCE_BUDGET_SELLS", "10"))
+
+MAX_UINT256 = 2 ** 256 - 1
+# ERC20s don't decrement an "infinite" approval; anything above this counts as one
+_INFINITE = 2 ** 255
+
+MODES = ("exact", "budget", "max")
+
+
+def _parse_router_modes(raw: str) -> Dict[str, str]:
+    out = {}
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        router, mode = (s.strip().lower() for s in part.split("=", 1))
+        if mode in MODES:
+            out[router] = mode
+    return out
+
+
+ROUTER_MODES = _parse_router_modes(os.getenv("ALLOWANCE_ROUTER_MODES", ""))
+
+_lock = threading.Lock()
+_state: Optional[Dict[str, dict]] = None  # "owner:token:router" -> {"allowance": str, "updated": ts}
+
+
+def mode_for(router: str) -> str:
+    mode = ROUTER_MODES.get(router.lower(), ALLOWANCE_MODE)
+    return mode if mode in MODES else "exact"
+
+
+def approve_amount(router: str, amount_in: int) -> int:
+    """How much to approve when a sell of `amount_in` finds the allowance short."""
+    mode = mode_for(router)
+    if mode == "max":
+        return MAX_UINT256
+    if mode == "budget":
+        return min(MAX_UINT256, int(amount_in) * max(1, ALLOWANCE_BUDGET_SELLS))
+    return int(amount_in)
+
+
+# -----------------------
+# Persistence
+# -----------------------
+
+def _key(owner: str, token: str, router: str) -> str:
+    return f"{owner.lower()}:{token.lower()}:{router.lower()}"
+
+
+def _load() -> Dict[str, dict]:
+    global _state
+    if _state is None:
+        try:
+            with open(ALLOWANCE_CACHE_FILE, "r") as f:
+                _state = json.load(f)
+        except Exception:
+            _state = {}
+    return _state
+
+
+def _save() -> None:
+    tmp = f"{ALLOWANCE_CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(_state, f, indent=2)
+    os.replace(tmp, ALLOWANCE_CACHE_FILE)
+
+
+def _put(owner: str, token: str, router: str, allowance: Optional[int]) -> None:
+    with _lock:
+        state = _load()
+        if allowance is None:
+            if state.pop(_key(owner, token, router), None) is None:
+                return
+        else:
+            state[_key(owner, token, router)] = {"allowance": str(int(allowance)), "updated": int(time.time())}
+        _save()
+
+
+# -----------------------
+# Reads / updates
+# -----------------------
+
+def known(owner: str, token: str, router: str) -> Optional[int]:
+    with _lock:
+        entry = _load().get(_key(owner, token, router))
+    return int(entry["allowance"]) if entry else None
+
+
+def covers(owner: str, token: str, router: str, amount: int) -> bool:
+    have = known(owner, token, router)
+    return have is not None and have >= int(amount)
+
+
+def observe(owner: str, token: str, router: str, allowance: int) -> None:
+    """Record an allowance read from the chain."""
+    _put(owner, token, router, allowance)
+
+
+def on_sell_confirmed(owner: str, token: str, router: str, amount_in: int, approved: Optional[int] = None) -> None:
+    """
+    A sell mined with status 1. `approved` is what its approve granted, if one
+    went out with it (the approve is on the earlier nonce, so it mined too).
+    """
+    have = int(approved) if approved is not None else known(owner, token, router)
+    if have is None:
+        return
+    if have < _INFINITE:
+        have = max(0, have - int(amount_in))
+    _put(owner, token, router, have)
+
+
+def on_sell_failed(owner: str, token: str, router: str) -> None:
+    """A sell reverted: whatever we thought the allowance was, read it again next time."""
+    _put(owner, token, router, None)
+
+
+if __name__ == "__main__":
+    # Self-check against a throwaway file
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as d:
+        ALLOWANCE_CACHE_FILE = os.path.join(d, "allowance_cache.json")
+        o, t, r = "0x" + "aa" * 20, "0x" + "bb" * 20, "0x" + "cc" * 20
+
+        assert not covers(o, t, r, 1)
+        assert approve_amount(r, 100) == 100  # exact unless configured otherwise
+        ALLOWANCE_MODE, ALLOWANCE_BUDGET_SELLS = "budget", 3
+        grant = approve_amount(r, 100)
+        assert grant == 300
+        on_sell_confirmed(o, t, r, 100, approved=grant)
+        assert known(o, t, r) == 200 and covers(o, t, r, 100)
+        on_sell_confirmed(o, t, r, 100)
+        on_sell_confirmed(o, t, r, 100)
+        assert known(o, t, r) == 0 and not covers(o, t, r, 1)
+
+        _state = None  # survives a restart
+        assert known(o, t, r) == 0
+
+        ROUTER_MODES[r] = "max"
+        on_sell_confirmed(o, t, r, 100, approved=approve_amount(r, 100))
+        on_sell_confirmed(o, t, r, 10 ** 30)
+        assert known(o, t, r) == MAX_UINT256
+
+        on_sell_failed(o, t, r)
+        assert known(o, t, r) is None
+        ROUTER_MODES["0x" + "dd" * 20] = "exact"
+        assert approve_amount("0x" + "DD" * 20, 7) == 7
+    print("allowance_cache: ok")
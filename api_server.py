@@ -1,21 +1,80 @@
+import asyncio
 import os
 import time
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import List, Optional, Union
 
-from fastapi.responses import JSONResponse
-from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from web3 import Web3
 
-from erc20_abi import ERC20_ABI
-from nadfun_router_abi import NADFUN_ROUTER_ABI
-from lens_abi import LENS_ABI
+# web3 and the scan/prepare modules are imported lazily (see _warm_up), so
+# importing this module and binding the port stay fast on cold starts.
+import admission
+import metrics
 
 load_dotenv()
 
-app = FastAPI(title="Dust Cleaner Protocol API")
+STARTUP_COMPILE_SNAPSHOT = os.getenv("STARTUP_COMPILE_SNAPSHOT", "true").lower() == "true"
+
+async def _warm_up():
+    """
+    Pay the cold-start costs before the first request instead of inside it:
+    heavy imports, registry snapshot, shared cache, AsyncWeb3 client + its session.
+    """
+    t0 = time.perf_counter()
+    import dust_scanner, sell_prep, cache_warmer  # noqa: F401  (web3, eth_abi, multicall, calldata)
+    import registry_snapshot
+    import shared_cache
+
+    # (re)compile a missing or stale snapshot here, never on the request path;
+    # JSON registries only (no RPC), decimals/symbols fall back to chain reads
+    if STARTUP_COMPILE_SNAPSHOT:
+        registry_snapshot.refresh_snapshot()
+    else:
+        registry_snapshot.load_snapshot()
+    shared_cache.get("warm:status")  # creates the cache file and schema before requests need them
+    shared_cache.write_behind(shared_cache.get, "warm:status")  # opens the writer thread's connection
+
+    aw3, err = _aw3()
+    if aw3 is not None:
+        try:
+            await asyncio.wait_for(aw3.eth.chain_id, timeout=3)  # opens the HTTP session
+        except Exception as e:
+            print("[startup] RPC not reachable yet:", e)
+
+    took = time.perf_counter() - t0
+    metrics.STARTUP_SECONDS.set(took, "warm_up")
+    print(f"[startup] warm-up done in {took:.2f}s")
+
+@asynccontextmanager
+async def lifespan(app):
+    loop_watch = asyncio.ensure_future(metrics.watch_event_loop())
+    await _warm_up()
+
+    # Optional in-process cache warmer (one leader per host, see cache_warmer.py)
+    warmer_stop = None
+    rpc = _get_rpc_url()
+    if rpc and os.getenv("WARM_CACHE_INPROCESS", "false").lower() == "true":
+        import cache_warmer
+        from web3 import Web3
+        warmer_stop = cache_warmer.start_in_background(Web3(Web3.HTTPProvider(rpc, request_kwargs={"timeout": 20})))
+
+    yield
+
+    loop_watch.cancel()
+    if warmer_stop is not None:
+        warmer_stop.set()
+    # close the shared AsyncWeb3 HTTP session on shutdown
+    if _aw3_client is not None:
+        try:
+            await _aw3_client.provider.disconnect()
+        except Exception:
+            pass
+
+app = FastAPI(title="Dust Cleaner Protocol API", lifespan=lifespan)
 
 # ---------- CORS ----------
 cors_origins = os.getenv("CORS_ORIGINS", "")
@@ -29,6 +88,8 @@ if not allowed:
         "https://dust-cleaner-protocol.vercel.app",
     ]
 
+app.add_middleware(metrics.MetricsMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed,
@@ -45,6 +106,11 @@ class PrepareSellReq(BaseModel):
     wallet: str
     token: str  # token contract address
 
+class PrepareSellBatchReq(BaseModel):
+    wallet: str
+    tokens: Union[List[str], str] = "all"  # token list, or "all" = every dust token from /analyze
+    format: str = "items"  # "items" = per-token approve/sell, "wallet_sendCalls" = one EIP-5792 bundle
+
 # ---------- Helpers ----------
 DEADLINE_SECONDS = int(os.getenv("SELL_DEADLINE_SECONDS", "300"))  # 5 minutes
 
@@ -57,119 +123,77 @@ def _get_router_address() -> Optional[str]:
     # NADFUN_ROUTER_ADDRESS=0x....
     return os.getenv("NADFUN_ROUTER_ADDRESS")
 
-def _w3():
+# ---------- Async call path ----------
+ANALYZE_TIMEOUT_SECONDS = float(os.getenv("ANALYZE_TIMEOUT_SECONDS", "25"))
+PREPARE_SELL_TIMEOUT_SECONDS = float(os.getenv("PREPARE_SELL_TIMEOUT_SECONDS", "15"))
+DISCONNECT_POLL_SECONDS = 0.5
+
+_aw3_client = None
+
+def _aw3():
+    """
+    One AsyncWeb3 per worker process (keeps its HTTP connection pool warm).
+    No is_connected() probe: a dead RPC surfaces as an error on the first call.
+    """
+    global _aw3_client
     rpc = _get_rpc_url()
     if not rpc:
         return None, "error_missing_rpc"
-    w3 = Web3(Web3.HTTPProvider(rpc, request_kwargs={"timeout": 20}))
-    if not w3.is_connected():
-        return None, "error_rpc_not_connected"
-    return w3, None
-
-def prepare_sell_calldata_via_lens(wallet, token, amount_raw: int):
+    if _aw3_client is None:
+        from web3 import AsyncWeb3
+        _aw3_client = AsyncWeb3(AsyncWeb3.AsyncHTTPProvider(rpc, request_kwargs={"timeout": 20}))
+        # read-only client: the validation middleware only adds two eth_chainId
+        # round trips to every eth_call
+        _aw3_client.middleware_onion.remove("validation")
+        _aw3_client.middleware_onion.add(metrics.rpc_counting_middleware(), "rpc_counter")
+    return _aw3_client, None
+
+class ClientDisconnected(Exception):
+    pass
+
+async def _run_bounded(request: Request, coro, timeout: float, route: str):
     """
-    Returns calldata for:
-      1) ERC20 approve(router, amount_in)
-      2) router.sell((amount_in, min_out, token, wallet, deadline))
-    Uses NADFUN_LENS to get router + quote.
+    Awaits `coro` once admitted (admission.py) with a deadline covering the
+    queue wait too, cancelling it early if the client disconnects.
+    Raises asyncio.TimeoutError, ClientDisconnected or admission.Rejected.
     """
-    import time
-    from web3 import Web3
-
-    w3, err = _w3()
-    if err or w3 is None:
-        return {
-            "source": err or "error_unknown",
-            "wallet": wallet,
-            "token": token,
-            "notes": ["RPC not available"],
-            "approve": {"to": token, "data": "0x", "value": "0x0"},
-            "sell": {"to": "", "data": "0x", "value": "0x0"},
-        }
-
-    lens_addr = os.getenv("NADFUN_LENS")
-    if not lens_addr:
-        return {
-            "source": "error_missing_lens",
-            "wallet": wallet,
-            "token": token,
-            "notes": ["NADFUN_LENS is not set in .env / Render env vars"],
-            "approve": {"to": token, "data": "0x", "value": "0x0"},
-            "sell": {"to": "", "data": "0x", "value": "0x0"},
-        }
-
-    # config
-    slippage_bps = int(os.getenv("SLIPPAGE_BPS", "200"))  # 2%
-    deadline_seconds = int(os.getenv("SELL_DEADLINE_SECONDS", "300"))  # 5 min
-
-    wallet_cs = Web3.to_checksum_address(wallet)
-    token_cs = Web3.to_checksum_address(token)
-    lens_cs = Web3.to_checksum_address(lens_addr)
-
-    # ABIs from your repo
-    from lens_abi import LENS_ABI
-    from erc20_abi import ERC20_ABI
-    from nadfun_router_abi import NADFUN_ROUTER_ABI
-
-    lens = w3.eth.contract(address=lens_cs, abi=LENS_ABI)
-    erc = w3.eth.contract(address=token_cs, abi=ERC20_ABI)
-
-    # token metadata
-    try:
-        decimals = int(erc.functions.decimals().call())
-    except Exception:
-        decimals = 18
+    async def _admitted():
+        try:
+            async with admission.admit(request, route):
+                return await coro
+        finally:
+            coro.close()  # no-op if it ran; avoids "never awaited" if rejected
 
-    try:
-        symbol = erc.functions.symbol().call()
-    except Exception:
-        symbol = "UNKNOWN"
-
-    # balance
-    bal = int(erc.functions.balanceOf(wallet_cs).call())
-    if bal <= 0:
-        return {
-            "source": "prepare_sell_no_balance",
-            "wallet": wallet,
-            "token": token,
-            "symbol": symbol,
-            "decimals": decimals,
-            "amount_raw": str(bal),
-            "amount_display": 0,
-            "notes": ["No balance found for token in this wallet"],
-            "approve": {"to": token, "data": "0x", "value": "0x0"},
-            "sell": {"to": "", "data": "0x", "value": "0x0"},
-        }
-
-    # quote SELL token -> MON (isBuy=False)
-    router_addr, mon_out = lens.functions.getAmountOut(token_cs, bal, False).call()
-    router_cs = Web3.to_checksum_address(router_addr)
-    mon_out = int(mon_out)
-
-    min_out = mon_out * (10_000 - slippage_bps) // 10_000
-    deadline = int(time.time()) + deadline_seconds
-
-    # calldata approve + sell
-    approve_data = erc.functions.approve(router_cs, bal)._encode_transaction_data()
-
-    router = w3.eth.contract(address=router_cs, abi=NADFUN_ROUTER_ABI)
-    params = (bal, min_out, token_cs, wallet_cs, deadline)
-    sell_data = router.functions.sell(params)._encode_transaction_data()
+    work = asyncio.ensure_future(_admitted())
 
+    async def _watch_disconnect():
+        while not await request.is_disconnected():
+            await asyncio.sleep(DISCONNECT_POLL_SECONDS)
+
+    watch = asyncio.ensure_future(_watch_disconnect())
+    try:
+        done, _ = await asyncio.wait({work, watch}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        if work in done:
+            return work.result()
+        work.cancel()
+        if watch in done:
+            raise ClientDisconnected()
+        raise asyncio.TimeoutError()
+    finally:
+        watch.cancel()
+
+def _rejected(e: admission.Rejected, content: dict):
+    """429/503 with a Retry-After hint; body keeps the route's usual error shape."""
+    return JSONResponse(status_code=e.status, content=content, headers={"Retry-After": str(e.retry_after)})
+
+def _sell_error(source: str, wallet: str, token: str, notes):
     return {
-        "source": "prepare_sell_calldata_via_lens",
+        "source": source,
         "wallet": wallet,
         "token": token,
-        "symbol": symbol,
-        "decimals": decimals,
-        "amount_raw": str(bal),
-        "amount_display": float(bal) / (10 ** decimals),
-        "router": router_cs,
-        "quote_mon_out_raw": str(mon_out),
-        "min_out_raw": str(min_out),
-        "approve": {"to": token_cs, "data": approve_data, "value": "0x0"},
-        "sell": {"to": router_cs, "data": sell_data, "value": "0x0"},
-        "notes": [],
+        "notes": notes,
+        "approve": {"to": token, "data": "0x", "value": "0x0"},
+        "sell": {"to": "", "data": "0x", "value": "0x0"},
     }
 
 # ---------- Routes ----------
@@ -177,180 +201,114 @@ def prepare_sell_calldata_via_lens(wallet, token, amount_raw: int):
 def health():
     return {"ok": True}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    # on the loop on purpose: a scrape must not wait for (or take) a threadpool slot
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.post("/analyze")
-def analyze(req: AnalyzeReq):
+async def analyze(req: AnalyzeReq, request: Request):
     """
     Calls your existing dust scan logic and returns JSON.
+    Runs on the event loop (no threadpool), bounded by ANALYZE_TIMEOUT_SECONDS.
     """
-    from dust_scanner import run_stage2_public_dust_scan
-    report = run_stage2_public_dust_scan(req.wallet)
-    return report
+    from dust_scanner import run_stage2_public_dust_scan_async
 
-@app.post("/prepare-sell")
-def prepare_sell(req: PrepareSellReq):
-    try:
-        # 1) connect web3
-        w3, err = _w3()
-        if err:
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "source": err,
-                    "wallet": req.wallet,
-                    "token": req.token,
-                    "notes": [err],
-                    "approve": {"to": req.token, "data": "0x", "value": "0x0"},
-                    "sell": {"to": "", "data": "0x", "value": "0x0"},
-                },
-            )
-
-        # 2) read token balance for wallet (sell full balance)
-        token = w3.eth.contract(address=Web3.to_checksum_address(req.token), abi=ERC20_ABI)
-        bal = token.functions.balanceOf(Web3.to_checksum_address(req.wallet)).call()
-
-        if bal == 0:
-            return JSONResponse(
-                status_code=200,
-                content={
-                    "source": "error_zero_balance",
-                    "wallet": req.wallet,
-                    "token": req.token,
-                    "notes": ["Token balance is 0, nothing to sell"],
-                    "approve": {"to": req.token, "data": "0x", "value": "0x0"},
-                    "sell": {"to": "", "data": "0x", "value": "0x0"},
-                },
-            )
-
-        # 3) IMPORTANT: pass the amount to your calldata builder
-        # You must update your function to accept amount_raw.
-        out = prepare_sell_calldata_via_lens(req.wallet, req.token, amount_raw=int(bal))
-        return out
+    def _error(source, note):
+        return {"source": source, "wallet": req.wallet, "dust_count": 0, "notes": [note], "dust": []}
 
+    aw3, err = _aw3()
+    if err:
+        return _error(err, "Set MONAD_RPC_URL or RPC_URL in .env")
+
+    try:
+        return await _run_bounded(
+            request, run_stage2_public_dust_scan_async(req.wallet, aw3), ANALYZE_TIMEOUT_SECONDS, "analyze",
+        )
+    except admission.Rejected as e:
+        return _rejected(e, _error(f"error_{e.reason}", f"Retry after {e.retry_after}s"))
+    except asyncio.TimeoutError:
+        return _error("error_timeout", f"Scan exceeded {ANALYZE_TIMEOUT_SECONDS:g}s")
+    except ClientDisconnected:
+        return JSONResponse(status_code=499, content=_error("error_client_disconnected", "Client went away"))
     except Exception as e:
+        return _error("error_analyze", f"{type(e).__name__}: {e}")
+
+@app.post("/prepare-sell")
+async def prepare_sell(req: PrepareSellReq, request: Request):
+    # IMPORTANT: return JSON instead of crashing (no 500)
+    from sell_prep import prepare_sell_single_pass_async
+
+    aw3, err = _aw3()
+    if err:
+        return JSONResponse(status_code=200, content=_sell_error(err, req.wallet, req.token, [err]))
+
+    try:
+        return await _run_bounded(
+            request,
+            prepare_sell_single_pass_async(aw3, req.wallet, req.token),
+            PREPARE_SELL_TIMEOUT_SECONDS,
+            "prepare-sell",
+        )
+    except admission.Rejected as e:
+        return _rejected(e, _sell_error(f"error_{e.reason}", req.wallet, req.token, [f"Retry after {e.retry_after}s"]))
+    except asyncio.TimeoutError:
         return JSONResponse(
             status_code=200,
-            content={
-                "source": "error_prepare_sell",
-                "wallet": req.wallet,
-                "token": req.token,
-                "notes": [str(e)],
-                "approve": {"to": req.token, "data": "0x", "value": "0x0"},
-                "sell": {"to": "", "data": "0x", "value": "0x0"},
-            },
+            content=_sell_error("error_timeout", req.wallet, req.token, [f"Prepare exceeded {PREPARE_SELL_TIMEOUT_SECONDS:g}s"]),
         )
-
-        # IMPORTANT: return JSON instead of crashing (no 500)
+    except ClientDisconnected:
+        return JSONResponse(
+            status_code=499,
+            content=_sell_error("error_client_disconnected", req.wallet, req.token, ["Client went away"]),
+        )
+    except Exception as e:
         return JSONResponse(
             status_code=200,
-            content={
-                "source": "error_prepare_sell",
-                "wallet": req.wallet,
-                "token": req.token,
-                "notes": [str(e)],
-                "approve": {"to": req.token, "data": "0x", "value": "0x0"},
-                "sell": {"to": "", "data": "0x", "value": "0x0"},
-            },
+            content=_sell_error("error_prepare_sell", req.wallet, req.token, [str(e)]),
         )
 
-    lens_addr = os.getenv("NADFUN_LENS")
-    if not lens_addr:
-        return {
-            "source": "error_missing_lens",
-            "wallet": req.wallet,
-            "token": req.token,
-            "notes": ["NADFUN_LENS is not set in .env / Render env vars"],
-            "approve": {"to": req.token, "data": "0x", "value": "0x0"},
-            "sell": {"to": "", "data": "0x", "value": "0x0"},
-        }
-
-    SLIPPAGE_BPS = int(os.getenv("SLIPPAGE_BPS", "200"))  # 2%
-    SWAP_FRACTION = float(os.getenv("SWAP_FRACTION", "1.0"))  # 1.0 = sell full balance
-    deadline = int(time.time()) + DEADLINE_SECONDS
-
-    wallet = Web3.to_checksum_address(req.wallet)
-    token = Web3.to_checksum_address(req.token)
-    lens = w3.eth.contract(address=Web3.to_checksum_address(lens_addr), abi=LENS_ABI)
-
-    erc = w3.eth.contract(address=token, abi=ERC20_ABI)
-
-    notes = []
-
-    # display fields (best effort)
-    try:
-        symbol = erc.functions.symbol().call()
-        if isinstance(symbol, bytes):
-            symbol = symbol.decode("utf-8", errors="ignore")
-    except Exception:
-        symbol = "TOKEN"
-        notes.append("symbol() failed, using TOKEN")
+@app.post("/prepare-sell-batch")
+async def prepare_sell_batch(req: PrepareSellBatchReq, request: Request):
+    """
+    approve/sell calldata for many tokens in one response (ordered by MON out).
+    tokens="all" runs the dust scan first and prepares every dust token.
+    format="wallet_sendCalls" returns the whole cleanup as one EIP-5792 call
+    bundle (one wallet prompt) instead of per-token items.
+    """
+    from dust_scanner import run_stage2_public_dust_scan_async
+    from sell_prep import build_send_calls_bundle, prepare_sells_batch_async
+
+    def _error(source, notes):
+        return {"source": source, "wallet": req.wallet, "count": 0, "items": [], "skipped": [], "notes": notes}
+
+    if req.format not in ("items", "wallet_sendCalls"):
+        return _error("error_bad_request", ['format must be "items" or "wallet_sendCalls"'])
+
+    aw3, err = _aw3()
+    if err:
+        return _error(err, [err])
+
+    async def _run():
+        tokens = req.tokens
+        if isinstance(tokens, str):
+            if tokens.lower() != "all":
+                return _error("error_bad_request", ['tokens must be a list of addresses or "all"'])
+            report = await run_stage2_public_dust_scan_async(req.wallet, aw3)
+            tokens = [d.get("token") or d.get("contract") for d in report.get("dust", [])]
+            tokens = [t for t in tokens if t]
+        batch = await prepare_sells_batch_async(aw3, req.wallet, tokens)
+        if req.format == "wallet_sendCalls":
+            return build_send_calls_bundle(batch)
+        return batch
 
     try:
-        decimals = int(erc.functions.decimals().call())
-    except Exception:
-        decimals = 18
-        notes.append("decimals() failed, default 18")
-
-    # amount_in = balance * fraction
-    bal = int(erc.functions.balanceOf(wallet).call())
-    if bal <= 0:
-        return {
-            "source": "error_zero_balance",
-            "wallet": wallet,
-            "token": token,
-            "symbol": symbol,
-            "decimals": decimals,
-            "amount_raw": "0",
-            "amount_display": 0.0,
-            "notes": ["Token balance is 0"],
-            "approve": {"to": token, "data": "0x", "value": "0x0"},
-            "sell": {"to": "", "data": "0x", "value": "0x0"},
-        }
-
-    # Sell full balance
-    amount_in = bal
-
-    # Quote: token -> MON (isBuy=False)
-    router_addr, mon_out = lens.functions.getAmountOut(token, amount_in, False).call()
-    mon_out = int(mon_out)
-
-    if mon_out <= 0:
-        return {
-            "source": "error_no_mon_output",
-            "wallet": wallet,
-            "token": token,
-            "symbol": symbol,
-            "decimals": decimals,
-            "amount_raw": str(amount_in),
-            "amount_display": float(amount_in / (10 ** decimals)),
-            "notes": ["No MON output from quote"],
-            "approve": {"to": token, "data": "0x", "value": "0x0"},
-            "sell": {"to": "", "data": "0x", "value": "0x0"},
-        }
-
-    amount_out_min = mon_out * (10_000 - SLIPPAGE_BPS) // 10_000
-
-    router = Web3.to_checksum_address(router_addr)
-    router_c = w3.eth.contract(address=router, abi=NADFUN_ROUTER_ABI)
-
-    # Build calldata (no signing) — compatible with older Web3.py
-    approve_data = erc.functions.approve(router, amount_in)._encode_transaction_data()
-    params = (amount_in, amount_out_min, token, wallet, deadline)
-    sell_data = router_c.functions.sell(params)._encode_transaction_data()
-    
-    amount_display = amount_in / (10 ** decimals) if decimals else float(amount_in)
-
-    return {
-        "source": "prepare_sell_calldata_via_lens",
-        "wallet": wallet,
-        "token": token,
-        "symbol": symbol,
-        "decimals": decimals,
-        "amount_raw": str(amount_in),
-        "amount_display": float(amount_display),
-        "router": router,
-        "quote_mon_out_raw": str(mon_out),
-        "min_out_raw": str(amount_out_min),
-        "approve": {"to": token, "data": approve_data, "value": "0x0"},
-        "sell": {"to": router, "data": sell_data, "value": "0x0"},
-        "notes": notes,
-    }
+        return await _run_bounded(request, _run(), PREPARE_SELL_TIMEOUT_SECONDS, "prepare-sell-batch")
+    except admission.Rejected as e:
+        return _rejected(e, _error(f"error_{e.reason}", [f"Retry after {e.retry_after}s"]))
+    except asyncio.TimeoutError:
+        return _error("error_timeout", [f"Prepare exceeded {PREPARE_SELL_TIMEOUT_SECONDS:g}s"])
+    except ClientDisconnected:
+        return JSONResponse(status_code=499, content=_error("error_client_disconnected", ["Client went away"]))
+    except Exception as e:
+        return _error("error_prepare_sell", [str(e)])
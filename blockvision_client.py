@@ -3,12 +3,8 @@ import os
 import time
 import json
 import requests
-from dotenv import load_dotenv
-
-load_dotenv()
 
 BASE = "https://api.blockvision.org/v2/monad"
-API_KEY = os.getenv("BLOCKVISION_API_KEY")
 
 CACHE_FILE = "blockvision_cache.json"
 
@@ -32,11 +28,13 @@ def _load_cache():
 
 
 def get_wallet_tokens(wallet: str):
-    if not API_KEY:
+    # read per call: the entrypoint's load_dotenv() may run after this module is imported
+    api_key = os.getenv("BLOCKVISION_API_KEY")
+    if not api_key:
         raise ValueError("Missing BLOCKVISION_API_KEY in .env")
 
     url = f"{BASE}/account/tokens"
-    headers = {"X-API-KEY": API_KEY}
+    headers = {"X-API-KEY": api_key}
     params = {"address": wallet}
 
     # Retry up to 3 times
@@ -1,14 +1,34 @@
 import os
 import json
-from typing import Set
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Set
 from dotenv import load_dotenv
 from web3 import Web3
 
 from token_discovery import discover_token_contracts_incremental
-from stage2_public_clean import _quote_token_to_mon
-from liquidity_checker import can_swap_simulation
+from multicall import aggregate3, decimals_call, lens_sell_quote_call, decode_uint, decode_amount_out
 
 REG_PATH = "public_registry.json"
+VERDICTS_PATH = "registry_verdicts.json"
+
+# Re-check schedule: good tokens rarely go bad, bad tokens sometimes get liquidity later
+RECHECK_OK_SECONDS = int(os.getenv("VERDICT_RECHECK_OK_SECONDS", str(7 * 24 * 3600)))
+RECHECK_FAIL_SECONDS = int(os.getenv("VERDICT_RECHECK_FAIL_SECONDS", str(24 * 3600)))
+
+# Registered tokens that fail a re-check are kept unless dropping is switched on,
+# and even then only after this many failed re-checks in a row (an RPC or Lens
+# hiccup must not empty the registry)
+REGISTRY_DROP_FAILED = os.getenv("REGISTRY_DROP_FAILED", "false").lower() == "true"
+REGISTRY_DROP_AFTER_FAILS = int(os.getenv("REGISTRY_DROP_AFTER_FAILS", "3"))
+
+VALIDATE_BATCH_SIZE = int(os.getenv("VALIDATE_BATCH_SIZE", "200"))
+VALIDATE_WORKERS = int(os.getenv("VALIDATE_WORKERS", "8"))
+
+# fixed 1e15 wei probe (same as the old second _quote_token_to_mon check)
+FIXED_PROBE_AMOUNT = 1000000000000000
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
 
 
 def load_registry() -> Set[str]:
@@ -26,6 +46,113 @@ def save_registry(tokens: Set[str]):
     print("Saved", len(tokens), "tokens to", REG_PATH)
 
 
+def load_verdicts() -> Dict[str, dict]:
+    """
+    Cached validation results:
+      { "0xToken": {"ok": bool, "reason": str, "checked_at": unix_ts, "fails": int} }
+    "fails" counts failed checks in a row (0 once one passes).
+    """
+    try:
+        with open(VERDICTS_PATH, "r") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def save_verdicts(verdicts: Dict[str, dict]):
+    # write-then-rename so a crash never leaves a half-written cache
+    tmp = VERDICTS_PATH + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(verdicts, f, indent=2, sort_keys=True)
+    os.replace(tmp, VERDICTS_PATH)
+
+
+def verdict_is_due(verdict, now: int) -> bool:
+    if not isinstance(verdict, dict):
+        return True
+    age = now - int(verdict.get("checked_at", 0) or 0)
+    max_age = RECHECK_OK_SECONDS if verdict.get("ok") else RECHECK_FAIL_SECONDS
+    return age >= max_age
+
+
+def _validate_chunk(w3, lens: str, tokens: List[str], block: int) -> Dict[str, dict]:
+    """
+    Same checks as can_swap_simulation + the 1e15 probe quote, but batched:
+      round 1: decimals() for every token (one multicall)
+      round 2: 0.001-token probe + 1e15 probe for every token (one multicall)
+    Raises on RPC errors so the caller records no verdict for this chunk.
+    """
+    now = int(time.time())
+    verdicts: Dict[str, dict] = {}
+
+    dec_results = aggregate3(w3, [decimals_call(t) for t in tokens], block_identifier=block)
+
+    probe_calls = []
+    probed: List[str] = []
+    for token, res in zip(tokens, dec_results):
+        decimals = decode_uint(res)
+        if decimals is None or decimals > 255:
+            verdicts[token] = {"ok": False, "reason": "no_decimals", "checked_at": now}
+            continue
+        # Probe = 0.001 token (or 1 unit if decimals < 3)
+        amount_in = 10 ** (decimals - 3) if decimals >= 3 else 1
+        probe_calls.append(lens_sell_quote_call(lens, token, amount_in))
+        probe_calls.append(lens_sell_quote_call(lens, token, FIXED_PROBE_AMOUNT))
+        probed.append(token)
+
+    quote_results = aggregate3(w3, probe_calls, block_identifier=block)
+
+    for i, token in enumerate(probed):
+        small = decode_amount_out(quote_results[2 * i])
+        fixed = decode_amount_out(quote_results[2 * i + 1])
+        if not small or small[1] <= 0:
+            verdicts[token] = {"ok": False, "reason": "no_liquidity", "checked_at": now}
+        elif not fixed or fixed[1] <= 0:
+            verdicts[token] = {"ok": False, "reason": "no_quote", "checked_at": now}
+        else:
+            verdicts[token] = {"ok": True, "reason": "ok", "checked_at": now}
+
+    return verdicts
+
+
+def validate_tokens(w3, tokens: List[str], verdicts: Dict[str, dict]) -> Dict[str, dict]:
+    """
+    Validates `tokens` in multicall batches, VALIDATE_WORKERS batches at a time.
+    New verdicts are merged into `verdicts` (and checkpointed) as batches finish.
+    """
+    lens = os.getenv("NADFUN_LENS", "").strip()
+    if not lens:
+        raise RuntimeError("NADFUN_LENS missing in .env")
+
+    # pin every batch to the same block so results are comparable
+    block = w3.eth.block_number
+
+    chunks = [tokens[i:i + VALIDATE_BATCH_SIZE] for i in range(0, len(tokens), VALIDATE_BATCH_SIZE)]
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, VALIDATE_WORKERS)) as pool:
+        futures = {pool.submit(_validate_chunk, w3, lens, chunk, block): chunk for chunk in chunks}
+        for fut in as_completed(futures):
+            done += 1
+            try:
+                fresh = fut.result()
+            except Exception as e:
+                # RPC failure: leave these tokens without a fresh verdict, retry next run
+                print(f"Validation batch failed ({len(futures[fut])} tokens):", e)
+                continue
+            for token, v in fresh.items():
+                prev = verdicts.get(token)
+                fails = int(prev.get("fails", 0) or 0) if isinstance(prev, dict) else 0
+                v["fails"] = 0 if v["ok"] else fails + 1
+                verdicts[token] = v
+            if done % 10 == 0:
+                save_verdicts(verdicts)
+            print(f"Validated batch {done}/{len(chunks)}")
+
+    save_verdicts(verdicts)
+    return verdicts
+
+
 def main():
     load_dotenv(dotenv_path=".env", override=True)
 
@@ -74,33 +201,41 @@ def main():
 
     print("Total discovered:", len(discovered))
 
-    added = 0
-
-    for token in discovered:
-        if token in registry:
-            continue
-
-        try:
-            if not can_swap_simulation(w3, token):
-                continue
+    # Only (re)validate tokens whose cached verdict is missing or expired
+    now = int(time.time())
+    verdicts = load_verdicts()
+    universe = (discovered | registry) - {ZERO_ADDRESS}
+    due = sorted(t for t in universe if verdict_is_due(verdicts.get(t), now))
+    print(f"Validating {len(due)} tokens ({len(universe) - len(due)} cached verdicts still fresh)")
 
-            # test small quote (1e15 wei probe)
-            test_amount = 1000000000000000
-            out = _quote_token_to_mon(w3, token, test_amount)
+    if due:
+        validate_tokens(w3, due, verdicts)
 
-            if not out or int(out) <= 0:
-                continue
+    added = 0
+    dropped = 0
+    kept = 0
 
+    for token in universe:
+        v = verdicts.get(token)
+        if not isinstance(v, dict):
+            continue
+        if v.get("ok") and token not in registry:
             registry.add(token)
             added += 1
-
-        except Exception:
-            continue
+        elif not v.get("ok") and token in registry:
+            if REGISTRY_DROP_FAILED and int(v.get("fails", 0) or 0) >= REGISTRY_DROP_AFTER_FAILS:
+                registry.discard(token)
+                dropped += 1
+            else:
+                kept += 1
 
     print("Added after filtering:", added)
+    print("Dropped after re-check:", dropped)
+    if kept:
+        print(f"Kept {kept} registered tokens that failed re-check "
+              f"(REGISTRY_DROP_FAILED=true drops them after {REGISTRY_DROP_AFTER_FAILS} failures in a row)")
     save_registry(registry)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,233 @@
+"""
+Background warmer for wallet-independent token data:
+  - liquidity verdict (Lens sell quote for a 0.001-token probe > 0)
+  - unit price (Lens sell quote for exactly 1 whole token, in MON wei)
+
+Tokens are refreshed in priority order (how often /analyze saw them held),
+on new blocks but no more than once per WARM_MIN_INTERVAL_SECONDS.
+
+Run it inside api_server (WARM_CACHE_INPROCESS=true) or on its own:
+    python cache_warmer.py
+Either way the results land in the shared cache (shared_cache.py), which
+every worker reads; hold counts from every worker land there too.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import metrics
+import shared_cache
+
+WARM_LOCK_FILE = os.getenv("WARM_LOCK_FILE", "cache_warmer.lock")
+WARM_MIN_INTERVAL_SECONDS = float(os.getenv("WARM_MIN_INTERVAL_SECONDS", "30"))
+WARM_POLL_SECONDS = float(os.getenv("WARM_POLL_SECONDS", "2"))
+WARM_MAX_TOKENS = int(os.getenv("WARM_MAX_TOKENS", "2000"))
+WARM_MAX_AGE_SECONDS = float(os.getenv("WARM_MAX_AGE_SECONDS", "300"))  # older than this = don't trust
+
+
+# -----------------------
+# Request-path API
+# -----------------------
+
+def get_token(token: str) -> Optional[dict]:
+    """
+    Warmed data for one token, or None if we have nothing usable:
+      {"liquid", "router", "unit_mon_out", "decimals", "block", "age_seconds"}
+    """
+    entry = shared_cache.get(f"warm:{token.lower()}")
+    # the shared-cache TTL already drops entries older than WARM_MAX_AGE_SECONDS
+    if not entry:
+        metrics.cache_event("warm_token", False)
+        return None
+    metrics.cache_event("warm_token", True)
+    out = dict(entry)
+    out["age_seconds"] = round(time.time() - entry.get("updated_at", 0), 1)
+    return out
+
+
+def get_tokens(tokens: Iterable[str]) -> Dict[str, dict]:
+    """get_token for many tokens in one shared-cache read; tokens with nothing usable are left out."""
+    tokens = list(tokens)
+    hits = shared_cache.get_many(f"warm:{t.lower()}" for t in tokens)
+    out = {}
+    now = time.time()
+    for t in tokens:
+        entry = hits.get(f"warm:{t.lower()}")
+        metrics.cache_event("warm_token", bool(entry))
+        if entry:
+            out[t] = dict(entry, age_seconds=round(now - entry.get("updated_at", 0), 1))
+    return out
+
+
+def status() -> dict:
+    """Cache-level staleness, for responses."""
+    st = shared_cache.get("warm:status") or {}
+    updated = st.get("updated_at", 0)
+    return {
+        "block": st.get("block"),
+        "age_seconds": round(time.time() - updated, 1) if updated else None,
+        "tokens": st.get("tokens", 0),
+    }
+
+
+def record_holdings(tokens: Iterable[str], background: bool = False) -> None:
+    """
+    Called with the tokens a scanned wallet holds; drives refresh priority.
+    background=True queues the write (shared_cache.write_behind), for event-loop callers.
+    """
+    keys = [f"holds:{t.lower()}" for t in tokens]
+    if background:
+        shared_cache.write_behind(shared_cache.incr_many, keys)
+    else:
+        shared_cache.incr_many(keys)
+
+
+# -----------------------
+# Warming
+# -----------------------
+
+def _candidates() -> List[str]:
+    """Registry tokens, most-held first."""
+    from registry_snapshot import load_snapshot
+
+    snap = load_snapshot()
+    if snap is not None:
+        tokens = list(snap.addresses())
+    else:
+        try:
+            with open("verified_contracts.json", "r") as f:
+                data = json.load(f)
+            tokens = [a.lower() for a in (data.keys() if isinstance(data, dict) else data)
+                      if isinstance(a, str) and a.startswith("0x") and len(a) == 42]
+        except Exception:
+            tokens = []
+
+    counts = shared_cache.counters("holds:")
+    # never-seen tokens still get warmed, after the popular ones
+    tokens.sort(key=lambda t: -counts.get(t, 0))
+    return tokens[:WARM_MAX_TOKENS]
+
+
+def refresh_once(w3, tokens: Optional[List[str]] = None) -> int:
+    """
+    One warming pass: decimals, then probe + unit quotes, in multicall batches
+    at one block. Returns how many tokens were refreshed.
+    """
+    from web3 import Web3
+    from curve_model import quote_sells
+    from multicall import aggregate3, decimals_call, decode_uint
+    from registry_snapshot import load_snapshot
+
+    lens = os.getenv("NADFUN_LENS", "").strip()
+    if not lens:
+        return 0
+
+    tokens = tokens if tokens is not None else _candidates()
+    if not tokens:
+        return 0
+    tokens = [Web3.to_checksum_address(t) for t in tokens]
+
+    block = w3.eth.block_number
+    snap = load_snapshot()
+
+    # decimals: snapshot, then shared cache, chain only for the rest
+    decimals: Dict[str, Optional[int]] = {}
+    shared = shared_cache.get_many(f"meta:{t.lower()}" for t in tokens)
+    missing = []
+    for t in tokens:
+        meta = snap.get(t) if snap is not None else None
+        if meta and meta.get("decimals") is not None:
+            decimals[t] = meta["decimals"]
+        elif f"meta:{t.lower()}" in shared:
+            decimals[t] = shared[f"meta:{t.lower()}"]["decimals"]
+        else:
+            missing.append(t)
+    with metrics.stage("metadata"):
+        for t, res in zip(missing, aggregate3(w3, [decimals_call(t) for t in missing], block_identifier=block)):
+            decimals[t] = decode_uint(res)
+
+    priced = [t for t in tokens if decimals.get(t) is not None and decimals[t] <= 77]
+    pairs = []
+    for t in priced:
+        d = decimals[t]
+        pairs.append((t, 10 ** (d - 3) if d >= 3 else 1))  # liquidity probe
+        pairs.append((t, 10 ** d))                          # 1 whole token
+    with metrics.stage("liquidity"):
+        # curve tokens: one state read each instead of two Lens quotes (curve_model)
+        results = quote_sells(w3, lens, pairs, block=block)
+
+    now = time.time()
+    fresh = []
+    for i, t in enumerate(priced):
+        probe = results[2 * i]
+        unit = results[2 * i + 1]
+        liquid = bool(probe and probe[1] > 0)
+        fresh.append((f"warm:{t.lower()}", {
+            "liquid": liquid,
+            "router": (unit or probe or (None, 0))[0],
+            "unit_mon_out": str(unit[1]) if liquid and unit else "0",
+            "decimals": decimals[t],
+            "block": block,
+            "updated_at": now,
+        }, WARM_MAX_AGE_SECONDS, block))
+    fresh.append(("warm:status", {"block": block, "updated_at": now, "tokens": len(fresh)}, 24 * 3600, block))
+    shared_cache.set_many(fresh)
+    return len(fresh) - 1
+
+
+def run_forever(w3, stop: Optional[threading.Event] = None) -> None:
+    """Refresh on new blocks, rate-limited to WARM_MIN_INTERVAL_SECONDS."""
+    from registry_snapshot import refresh_snapshot
+
+    stop = stop or threading.Event()
+    last_block = None
+    last_run = 0.0
+    while not stop.is_set():
+        try:
+            refresh_snapshot(w3=w3)  # recompiles after build_registry rewrote the JSON
+            block = w3.eth.block_number
+            if block != last_block and time.time() - last_run >= WARM_MIN_INTERVAL_SECONDS:
+                t0 = time.time()
+                n = refresh_once(w3)
+                last_block, last_run = block, time.time()
+                print(f"[warmer] refreshed {n} tokens at block {block} in {last_run - t0:.2f}s")
+        except Exception as e:
+            print("[warmer] refresh failed:", e)
+        stop.wait(WARM_POLL_SECONDS)
+
+
+_leader_lock = None
+
+
+def start_in_background(w3) -> Optional[threading.Event]:
+    """
+    Daemon thread for in-process mode; set() the returned event to stop it.
+    With several uvicorn workers only the one holding the lock file warms,
+    the others just read the shared cache. Returns None when not the leader.
+    """
+    global _leader_lock
+    f = open(WARM_LOCK_FILE, "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    _leader_lock = f  # held for the life of the process
+
+    stop = threading.Event()
+    threading.Thread(target=run_forever, args=(w3, stop), name="cache-warmer", daemon=True).start()
+    return stop
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from web3 import Web3
+
+    load_dotenv(dotenv_path=".env", override=True)
+    rpc = os.getenv("RPC_URL") or os.getenv("MONAD_RPC_URL")
+    if not rpc:
+        raise RuntimeError("RPC_URL missing in .env")
+    run_forever(Web3(Web3.HTTPProvider(rpc, request_kwargs={"timeout": 20})))
@@ -0,0 +1,77 @@
+"""
+Hand-rolled calldata for the two fixed write calls we build on every request:
+
+  ERC20.approve(address spender, uint256 amount)
+  NadfunRouter.sell((uint256 amountIn, uint256 amountOutMin, address token, address to, uint256 deadline))
+
+Both are all-static ABI types, so the encoding is just the selector followed by
+32-byte words (the sell tuple is static, so it is inlined with no offset).
+Must stay byte-identical to web3's `_encode_transaction_data()`; run
+`python calldata.py` to cross-check against web3.
+"""
+
+APPROVE_SELECTOR = bytes.fromhex("095ea7b3")  # approve(address,uint256)
+SELL_SELECTOR = bytes.fromhex("5de3085d")     # sell((uint256,uint256,address,address,uint256))
+
+_MAX_UINT256 = (1 << 256) - 1
+_ADDRESS_PAD = bytes(12)
+
+
+def _uint_word(value: int) -> bytes:
+    value = int(value)
+    if value < 0 or value > _MAX_UINT256:
+        raise ValueError(f"uint256 out of range: {value}")
+    return value.to_bytes(32, "big")
+
+
+def _address_word(addr: str) -> bytes:
+    if not isinstance(addr, str) or len(addr) != 42 or not addr.startswith(("0x", "0X")):
+        raise ValueError(f"invalid address: {addr!r}")
+    return _ADDRESS_PAD + bytes.fromhex(addr[2:])
+
+
+def encode_approve(spender: str, amount: int) -> str:
+    return "0x" + (APPROVE_SELECTOR + _address_word(spender) + _uint_word(amount)).hex()
+
+
+def encode_sell(amount_in: int, amount_out_min: int, token: str, to: str, deadline: int) -> str:
+    return "0x" + (
+        SELL_SELECTOR
+        + _uint_word(amount_in)
+        + _uint_word(amount_out_min)
+        + _address_word(token)
+        + _address_word(to)
+        + _uint_word(deadline)
+    ).hex()
+
+
+if __name__ == "__main__":
+    # Byte-for-byte cross-check against web3's encoder
+    import random
+
+    from web3 import Web3
+
+    from erc20_abi import ERC20_ABI
+    from nadfun_router_abi import NADFUN_ROUTER_ABI
+
+    w3 = Web3()
+    rnd = random.Random(143)
+
+    def _addr():
+        return Web3.to_checksum_address("0x" + rnd.randbytes(20).hex())
+
+    edge = [0, 1, 2 ** 128, _MAX_UINT256]
+    for i in range(1000):
+        token, router, wallet = _addr(), _addr(), _addr()
+        amt = edge[i] if i < len(edge) else rnd.getrandbits(rnd.choice([8, 64, 128, 256]))
+        min_out = rnd.getrandbits(200)
+        deadline = rnd.getrandbits(40)
+
+        erc = w3.eth.contract(address=token, abi=ERC20_ABI)
+        rtr = w3.eth.contract(address=router, abi=NADFUN_ROUTER_ABI)
+
+        assert encode_approve(router, amt) == erc.functions.approve(router, amt)._encode_transaction_data()
+        assert encode_sell(amt, min_out, token, wallet, deadline) == \
+            rtr.functions.sell((amt, min_out, token, wallet, deadline))._encode_transaction_data()
+
+    print("calldata: 1000 approve/sell encodings match web3")
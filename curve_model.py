@@ -0,0 +1,265 @@
+"""
+Offline quotes for Nad.fun bonding-curve tokens.
+
+A curve token's sell price follows from the curve state alone, so instead of
+asking the Lens for every (token, amount) we read each token's reserves once
+per block (one Multicall for all of them, pinned to a block) and compute
+getAmountOut-equivalent results in-process, for any number of amounts.
+
+Assumptions about the deployed curve (all env-configurable; check them
+against the contract before trusting the numbers):
+  - NADFUN_CURVE_ADDRESS answers CURVE_STATE_SIG (default curves(address))
+    with the uint words named in CURVE_STATE_FIELDS; virtualMonReserve,
+    virtualTokenReserve and (optionally) k / realMonReserve are read by name
+  - a sell is constant product on the virtual reserves,
+        out = vMon - ceil(k / (vTok + amountIn)),  k = vMon * vTok if not stored
+    capped by realMonReserve, and CURVE_SELL_FEE_BPS of it goes to fees
+  - CURVE_GRADUATED_SIG(address) returns a bool (empty = don't ask)
+
+Nothing is taken on faith: every token is cross-checked against the Lens (one
+probe amount, in the same Multicall as the state read) before its first model
+quote and then every CURVE_CROSSCHECK_BLOCKS blocks. A token whose model is
+off by more than CURVE_MAX_DRIFT_BPS, that has graduated, or that the Lens
+routes somewhere other than NADFUN_CURVE_ROUTER keeps using the Lens.
+
+    quote_sells(w3, lens, [(token, amount), ...])  # model where trusted, Lens for the rest
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from eth_abi import encode
+from eth_utils import keccak
+from web3 import Web3
+
+from multicall import aggregate3, block_number_call, decode_amount_out, decode_uint, lens_sell_quote_call
+
+NADFUN_CURVE_ADDRESS = os.getenv("NADFUN_CURVE_ADDRESS", "").strip()
+NADFUN_CURVE_ROUTER = os.getenv("NADFUN_CURVE_ROUTER", "").strip()
+CURVE_STATE_SIG = os.getenv("CURVE_STATE_SIG", "curves(address)")
+CURVE_STATE_FIELDS = [f.strip() for f in os.getenv(
+    "CURVE_STATE_FIELDS",
+    "realMonReserve,realTokenReserve,virtualMonReserve,virtualTokenReserve,k,"
+    "targetTokenAmount,initVirtualMonReserve,initVirtualTokenReserve",
+).split(",") if f.strip()]
+CURVE_GRADUATED_SIG = os.getenv("CURVE_GRADUATED_SIG", "isGraduated(address)").strip()
+CURVE_SELL_FEE_BPS = int(os.getenv("CURVE_SELL_FEE_BPS", "100"))
+CURVE_STATE_MAX_AGE_SECONDS = float(os.getenv("CURVE_STATE_MAX_AGE_SECONDS", "0.4"))  # ~one Monad block
+CURVE_CROSSCHECK_BLOCKS = int(os.getenv("CURVE_CROSSCHECK_BLOCKS", "50"))
+CURVE_MAX_DRIFT_BPS = int(os.getenv("CURVE_MAX_DRIFT_BPS", "50"))
+CURVE_PROBE_AMOUNT = int(os.getenv("CURVE_PROBE_AMOUNT", str(10 ** 18)))
+
+
+def _selector(sig: str) -> bytes:
+    return keccak(text=sig)[:4]
+
+
+# -----------------------
+# Curve math
+# -----------------------
+
+def sell_out(state: Dict[str, int], amount_in: int, fee_bps: Optional[int] = None) -> int:
+    """MON (wei) out for selling `amount_in` tokens into the curve, after fees."""
+    fee_bps = CURVE_SELL_FEE_BPS if fee_bps is None else fee_bps
+    v_mon, v_tok = state["virtualMonReserve"], state["virtualTokenReserve"]
+    amount_in = int(amount_in)
+    if amount_in <= 0 or v_mon <= 0 or v_tok <= 0:
+        return 0
+    k = state.get("k") or v_mon * v_tok
+    new_mon = -(-k // (v_tok + amount_in))  # rounded up: the curve keeps the dust
+    gross = max(0, v_mon - new_mon)
+    if "realMonReserve" in state:
+        gross = min(gross, state["realMonReserve"])
+    return gross - (gross * fee_bps + 9_999) // 10_000
+
+
+def decode_state(data: bytes) -> Optional[Dict[str, int]]:
+    """CURVE_STATE_SIG return data -> {field: value}; None if it isn't a live curve."""
+    n = len(CURVE_STATE_FIELDS)
+    if len(data) < 32 * n:
+        return None
+    words = [int.from_bytes(data[32 * i:32 * i + 32], "big") for i in range(n)]
+    state = dict(zip(CURVE_STATE_FIELDS, words))
+    if not state.get("virtualMonReserve") or not state.get("virtualTokenReserve"):
+        return None  # unknown token: the curve returns zeros
+    return state
+
+
+# -----------------------
+# Quoter
+# -----------------------
+
+class CurveQuoter:
+    def __init__(self, w3, lens: str, curve: str = NADFUN_CURVE_ADDRESS):
+        self.w3 = w3
+        self.lens = Web3.to_checksum_address(lens)
+        self.curve = Web3.to_checksum_address(curve)
+        self.block: Optional[int] = None
+        self.reads = 0  # state multicalls
+        self.crosschecks = 0
+        self._tokens: Dict[str, dict] = {}  # token (lower) -> {"state", "graduated", "trusted", ...}
+        self._lock = threading.Lock()
+
+    def _due(self, t: dict, block: Optional[int]) -> bool:
+        if t.get("checked_block") is None:
+            return True
+        return block is None or block - t["checked_block"] >= CURVE_CROSSCHECK_BLOCKS
+
+    def _stale(self, token: str, block: Any) -> bool:
+        t = self._tokens.get(token)
+        if t is None:
+            return True
+        if t["graduated"]:
+            return False  # graduation is one-way: no more curve reads for it
+        if isinstance(block, int):
+            return t["block"] != block
+        return time.monotonic() - t["read_at"] > CURVE_STATE_MAX_AGE_SECONDS
+
+    def refresh(self, tokens: Sequence[str], block: Any = "latest") -> Optional[int]:
+        """
+        Reads curve state for `tokens` not already read at `block` (or within
+        CURVE_STATE_MAX_AGE_SECONDS for "latest"): one Multicall carrying the
+        block number, the state and graduation flag per token, and a Lens
+        probe for tokens due a cross-check.
+        """
+        with self._lock:
+            todo = sorted({t.lower() for t in tokens if self._stale(t.lower(), block)})
+            if not todo:
+                return self.block
+
+            state_sel = _selector(CURVE_STATE_SIG)
+            grad_sel = _selector(CURVE_GRADUATED_SIG) if CURVE_GRADUATED_SIG else None
+            calls = [block_number_call()]
+            layout = []  # per token: (state index, graduated index, probe amount or None)
+            for token in todo:
+                prev = self._tokens.get(token)
+                arg = encode(["address"], [token])
+                i_state = len(calls)
+                calls.append((self.curve, state_sel + arg))
+                i_grad = None
+                if grad_sel is not None:
+                    i_grad = len(calls)
+                    calls.append((self.curve, grad_sel + arg))
+                probe = None
+                if prev is None or self._due(prev, self.block):
+                    probe = CURVE_PROBE_AMOUNT
+                    calls.append(lens_sell_quote_call(self.lens, token, probe))
+                layout.append((i_state, i_grad, probe))
+
+            res = aggregate3(self.w3, calls, block_identifier=block)
+            self.reads += 1
+            at = decode_uint(res[0])
+            self.block = at if at is not None else self.block
+            now = time.monotonic()
+
+            for token, (i_state, i_grad, probe) in zip(todo, layout):
+                prev = self._tokens.get(token) or {}
+                ok, data = res[i_state]
+                t = {
+                    "state": decode_state(data) if ok else None,
+                    "graduated": bool(i_grad is not None and decode_uint(res[i_grad])),
+                    "trusted": prev.get("trusted", False),
+                    "router": prev.get("router") or (Web3.to_checksum_address(NADFUN_CURVE_ROUTER) if NADFUN_CURVE_ROUTER else None),
+                    "checked_block": prev.get("checked_block"),
+                    "drift_bps": prev.get("drift_bps"),
+                    "block": self.block,
+                    "read_at": now,
+                }
+                if probe is not None:
+                    self._crosscheck(token, t, probe, decode_amount_out(res[i_state + 1 + (i_grad is not None)]))
+                self._tokens[token] = t
+            return self.block
+
+    def _crosscheck(self, token: str, t: dict, probe: int, lens_quote: Optional[Tuple[str, int]]) -> None:
+        self.crosschecks += 1
+        t["checked_block"] = self.block
+        if lens_quote is None or t["state"] is None or t["graduated"]:
+            t["trusted"] = False
+            return
+        router, lens_out = lens_quote
+        if NADFUN_CURVE_ROUTER and router.lower() != NADFUN_CURVE_ROUTER.lower():
+            t["graduated"] = True  # the Lens already routes it to a DEX pool
+            t["trusted"] = False
+            return
+        t["router"] = router
+        model = sell_out(t["state"], probe)
+        t["drift_bps"] = abs(model - lens_out) * 10_000 // max(1, lens_out)
+        trusted = t["drift_bps"] <= CURVE_MAX_DRIFT_BPS
+        if trusted != t["trusted"] and not trusted:
+            print(f"Curve model off by {t['drift_bps']} bps for {token} (model {model}, Lens {lens_out}); using the Lens")
+        t["trusted"] = trusted
+
+    def quote(self, token: str, amount_in: int) -> Optional[Tuple[str, int]]:
+        """(router, MON out) from the model; None if this token has to go to the Lens."""
+        t = self._tokens.get(token.lower())
+        if t is None or t["state"] is None or t["graduated"] or not t["trusted"] or t["router"] is None:
+            return None
+        return t["router"], sell_out(t["state"], amount_in)
+
+    def quote_many(self, pairs: Sequence[Tuple[str, int]], block: Any = "latest") -> List[Optional[Tuple[str, int]]]:
+        """Like a Lens multicall over `pairs`, but only tokens the model can't price cost a sub-call."""
+        self.refresh([t for t, _ in pairs], block)
+        out: List[Optional[Tuple[str, int]]] = [self.quote(t, a) for t, a in pairs]
+        misses = [i for i, q in enumerate(out) if q is None]
+        if misses:
+            res = aggregate3(self.w3, [lens_sell_quote_call(self.lens, *pairs[i]) for i in misses], block_identifier=block)
+            for i, r in zip(misses, res):
+                out[i] = decode_amount_out(r)
+        return out
+
+    def status(self) -> dict:
+        with self._lock:
+            tokens = list(self._tokens.values())
+        return {
+            "block": self.block,
+            "tokens": len(tokens),
+            "modelled": sum(1 for t in tokens if t["state"] and t["trusted"] and not t["graduated"]),
+            "graduated": sum(1 for t in tokens if t["graduated"]),
+            "reads": self.reads,
+            "crosschecks": self.crosschecks,
+        }
+
+
+_quoters: Dict[str, CurveQuoter] = {}
+_quoters_lock = threading.Lock()
+
+
+def get_curve_quoter(w3, lens: str) -> Optional[CurveQuoter]:
+    """Per-endpoint quoter; None when NADFUN_CURVE_ADDRESS isn't set (everything goes to the Lens)."""
+    if not NADFUN_CURVE_ADDRESS:
+        return None
+    key = f"{getattr(w3.provider, 'endpoint_uri', None) or id(w3.provider)}:{lens.lower()}"
+    with _quoters_lock:
+        q = _quoters.get(key)
+        if q is None:
+            q = _quoters[key] = CurveQuoter(w3, lens)
+        return q
+
+
+def quote_sells(w3, lens: str, pairs: Sequence[Tuple[str, int]], block: Any = "latest") -> List[Optional[Tuple[str, int]]]:
+    """(router, MON out) per (token, amount), or None where the Lens had no quote."""
+    q = get_curve_quoter(w3, lens)
+    if q is not None:
+        return q.quote_many(pairs, block)
+    if not pairs:
+        return []
+    return [decode_amount_out(r) for r in aggregate3(w3, [lens_sell_quote_call(lens, t, a) for t, a in pairs], block_identifier=block)]
+
+
+if __name__ == "__main__":
+    # Self-check of the curve math against a direct constant-product computation
+    st = {"virtualMonReserve": 10 ** 22, "virtualTokenReserve": 10 ** 27, "realMonReserve": 10 ** 21}
+    st["k"] = st["virtualMonReserve"] * st["virtualTokenReserve"]
+    a = 10 ** 24
+    gross = 10 ** 22 - 10 ** 49 // (10 ** 27 + a) - 1
+    assert sell_out(st, a, fee_bps=0) == gross, (sell_out(st, a, fee_bps=0), gross)
+    assert sell_out(st, a) == gross - (gross + 99) // 100
+    assert sell_out(st, 2 * a) < 2 * sell_out(st, a)  # concave
+    assert sell_out(st, 10 ** 40) <= st["realMonReserve"]  # can't pay out more than it holds
+    assert sell_out(st, 0) == 0
+
+    words = [st.get(f, 0) for f in CURVE_STATE_FIELDS]
+    assert decode_state(b"".join(w.to_bytes(32, "big") for w in words))["k"] == st["k"]
+    assert decode_state(b"\x00" * 32 * len(CURVE_STATE_FIELDS)) is None
+    print("curve_model: ok")
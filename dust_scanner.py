@@ -1,17 +1,14 @@
 import json
 import os
 
-from blockvision_client import get_wallet_tokens
-from web3 import Web3
-from erc20_abi import ERC20_ABI
-from coingecko_client import (
-    get_platform_id_by_chain_id,
-    verify_contract_on_platform,
-    token_price_usd,
-)
-from token_discovery import discover_token_contracts_incremental
+# Heavy clients (web3, requests-based APIs) are imported inside the functions
+# that need them, so importing this module stays cheap for api_server.
 
 VERIFY_CACHE_FILE = "verified_contracts.json"
+# Targeted scans only look at registry tokens; "true" also scans (and lets the
+# agent sell) other tokens it is pointed at, e.g. airdrops. Their symbols are
+# never posted.
+PUBLIC_SCAN_UNREGISTERED = os.getenv("PUBLIC_SCAN_UNREGISTERED", "false").lower() == "true"
 
 def _load_verified_cache():
     if os.path.exists(VERIFY_CACHE_FILE):
@@ -26,9 +23,6 @@ def _save_verified_cache(data):
     with open(VERIFY_CACHE_FILE, "w") as f:
         json.dump(data, f, indent=2)
 
-from blockvision_client import get_wallet_tokens
-from coingecko_client import get_platform_id_by_chain_id, verify_contract_on_platform
-
 def scan_dust_verified(w3, wallet, chain_id, dust_threshold_usd):
     """
     Dust detection using wallet token API + cache fallback.
@@ -39,6 +33,8 @@ def scan_dust_verified(w3, wallet, chain_id, dust_threshold_usd):
     - stablecoins ARE dust only if < 0.999 (already handled by threshold)
     """
 
+    from blockvision_client import get_wallet_tokens
+
     # Try live API first; if it fails, fall back to cache (blockvision_client already does this)
     resp = get_wallet_tokens(wallet)
 
@@ -95,17 +91,85 @@ def scan_dust_verified(w3, wallet, chain_id, dust_threshold_usd):
 
     return dust
 
-def run_stage2_public_dust_scan(wallet: str) -> dict:
+def _load_scan_candidates(wallet: str, max_candidates: int, only=None):
+    """
+    Registry candidates for the public scan.
+    Prefers the compiled mmap snapshot (shared by all workers); falls back to JSON.
+    `only` (addresses) narrows the candidates to those of them in the registry
+    (no max_candidates cap then).
+    Returns (candidates, lookup_meta, notes, error_report). error_report is None on success.
+    """
+    import json
+    from web3 import Web3
+    from registry_snapshot import load_snapshot
+
+    notes = []
+    snap = load_snapshot()
+
+    if snap is not None:
+        if only is not None:
+            candidates = sorted({Web3.to_checksum_address(t) for t in only if t in snap}, key=str.lower)
+        else:
+            candidates = list(snap.addresses(limit=max_candidates))
+        lookup_meta = snap.get
+        notes.append(f"Registry snapshot: {len(snap)} tokens")
+    else:
+        registry = {}
+        try:
+            with open("verified_contracts.json", "r") as f:
+                data = json.load(f)
+
+            # Your current format: dict where keys are addresses and values are metadata
+            if isinstance(data, dict):
+                registry = data
+            elif isinstance(data, list):
+                # Allow list format too, in case you switch later
+                registry = {addr: {} for addr in data if isinstance(addr, str)}
+            else:
+                registry = {}
+
+        except Exception as e:
+            return [], None, notes, {
+                "source": "error_missing_registry",
+                "wallet": wallet,
+                "dust_count": 0,
+                "notes": [f"Could not load verified_contracts.json: {type(e).__name__}: {e}"],
+                "dust": [],
+            }
+
+        candidates = [a for a in registry.keys() if isinstance(a, str) and a.startswith("0x") and len(a) == 42]
+        candidates.sort(key=str.lower)  # same order as the snapshot (raw address bytes)
+        if only is not None:
+            known = {a.lower() for a in candidates}
+            candidates = sorted({Web3.to_checksum_address(t) for t in only if t.lower() in known}, key=str.lower)
+        else:
+            candidates = candidates[:max_candidates]
+
+        def lookup_meta(addr):
+            return registry.get(addr) or registry.get(addr.lower()) or registry.get(Web3.to_checksum_address(addr))
+
+    notes.append(f"Public registry candidates: {len(candidates)}")
+    if candidates:
+        notes.append(f"Candidates sample: {candidates[:3]}")
+
+    return candidates, lookup_meta, notes, None
+
+
+def run_stage2_public_dust_scan(wallet: str, tokens=None) -> dict:
     """
     Stage 2 public dust scan for API/UI.
-    Source of token candidates: verified_contracts.json (dict keys are addresses).
+    Source of token candidates: registry.snap (compiled by registry_snapshot.py),
+    falling back to verified_contracts.json (dict keys are addresses).
+    `tokens` narrows the scan to those of them in the registry (e.g. tokens
+    that just arrived, from Transfer logs). Others are dropped unless
+    PUBLIC_SCAN_UNREGISTERED=true; their items then carry "registered": False.
     Registry optimization:
       - Use registry "symbol" if provided
       - Always fetch decimals from chain (since you want symbol-only registry)
     Read-only: DOES NOT send any transactions.
     """
 
-    import os, json
+    import os
     from web3 import Web3
     from erc20_abi import ERC20_ABI
 
@@ -130,39 +194,20 @@ def run_stage2_public_dust_scan(wallet: str) -> dict:
         }
 
     # ---- Load registry ----
-    notes = []
-    registry = {}
-    try:
-        with open("verified_contracts.json", "r") as f:
-            data = json.load(f)
-
-        # Your current format: dict where keys are addresses and values are metadata
-        if isinstance(data, dict):
-            registry = data
-        elif isinstance(data, list):
-            # Allow list format too, in case you switch later
-            registry = {addr: {} for addr in data if isinstance(addr, str)}
-        else:
-            registry = {}
-
-    except Exception as e:
-        return {
-            "source": "error_missing_registry",
-            "wallet": wallet,
-            "dust_count": 0,
-            "notes": [f"Could not load verified_contracts.json: {type(e).__name__}: {e}"],
-            "dust": [],
-        }
-
-    candidates = [a for a in registry.keys() if isinstance(a, str) and a.startswith("0x") and len(a) == 42]
-    candidates.sort()
-
     max_candidates = int(os.getenv("PUBLIC_SCAN_MAX_CANDIDATES", "200"))
-    candidates = candidates[:max_candidates]
-
-    notes.append(f"Public registry candidates: {len(candidates)}")
-    if candidates:
-        notes.append(f"Candidates sample: {candidates[:3]}")
+    candidates, lookup_meta, notes, error = _load_scan_candidates(wallet, max_candidates, only=tokens)
+    if error:
+        return error
+    unregistered = set()
+    if tokens is not None:
+        wanted = {Web3.to_checksum_address(t) for t in tokens}
+        outside = wanted - set(candidates)
+        if PUBLIC_SCAN_UNREGISTERED:
+            unregistered = outside
+            candidates = sorted(set(candidates) | outside)
+        notes.append(f"Targeted scan: {len(candidates)} tokens"
+                     + (f" ({len(outside)} not in the registry, {'kept' if unregistered else 'skipped'})"
+                        if outside else ""))
 
     wallet_cs = Web3.to_checksum_address(wallet)
     dust = []
@@ -170,7 +215,7 @@ def run_stage2_public_dust_scan(wallet: str) -> dict:
     for token in candidates:
         try:
             token_cs = Web3.to_checksum_address(token)
-            meta = registry.get(token) or registry.get(token.lower()) or registry.get(token_cs) or {}
+            meta = lookup_meta(token) or {}
             if not isinstance(meta, dict):
                 meta = {}
 
@@ -180,11 +225,13 @@ def run_stage2_public_dust_scan(wallet: str) -> dict:
             if raw_bal == 0:
                 continue
 
-            # Always fetch decimals from chain (symbol-only registry)
-            try:
-                dec = c.functions.decimals().call()
-            except Exception:
-                dec = 18
+            # Fetch decimals from chain unless the snapshot already knows them
+            dec = meta.get("decimals")
+            if dec is None:
+                try:
+                    dec = c.functions.decimals().call()
+                except Exception:
+                    dec = 18
 
             # Use registry symbol if available, otherwise fallback to on-chain symbol()
             sym = meta.get("symbol")
@@ -203,12 +250,15 @@ def run_stage2_public_dust_scan(wallet: str) -> dict:
 
             amount = raw_bal / (10 ** dec_i)
 
-            dust.append({
+            item = {
                 "symbol": str(sym),
                 "amount": float(amount),
                 "mon_value": None,
                 "token": token_cs,
-            })
+            }
+            if token_cs in unregistered:
+                item["registered"] = False
+            dust.append(item)
 
             if used_registry_symbol:
                 notes.append(f"BALCHECK {token_cs} raw_bal={raw_bal} dec={dec_i} (registry_symbol)")
@@ -227,3 +277,117 @@ def run_stage2_public_dust_scan(wallet: str) -> dict:
         "dust": dust,
     }
 
+
+
+async def run_stage2_public_dust_scan_async(wallet: str, aw3) -> dict:
+    """
+    Async twin of run_stage2_public_dust_scan for the API (same report shape).
+    Balances for every candidate go out as multicall batches pinned to one block,
+    then decimals/symbol only for tokens the wallet actually holds.
+    Read-only: DOES NOT send any transactions.
+    """
+    import asyncio
+    import os
+    from web3 import Web3
+    import metrics
+    import cache_warmer
+    import shared_cache
+    from multicall import (
+        aggregate3_async, balance_of_call, decimals_call, symbol_call, decode_uint, decode_symbol,
+    )
+
+    max_candidates = int(os.getenv("PUBLIC_SCAN_MAX_CANDIDATES", "200"))
+    with metrics.stage("registry_load"):
+        candidates, lookup_meta, notes, error = _load_scan_candidates(wallet, max_candidates)
+    if error:
+        return error
+
+    wallet_cs = Web3.to_checksum_address(wallet)
+    tokens = [Web3.to_checksum_address(t) for t in candidates]
+
+    with metrics.stage("balance"):
+        block = await aw3.eth.block_number
+        balances = await aggregate3_async(aw3, [balance_of_call(t, wallet_cs) for t in tokens], block_identifier=block)
+
+    held = []
+    for token, res in zip(tokens, balances):
+        raw_bal = decode_uint(res)
+        if not raw_bal:
+            # zero balance, or non-ERC20 that reverted
+            continue
+        meta = lookup_meta(token) or {}
+        if not isinstance(meta, dict):
+            meta = {}
+        held.append((token, raw_bal, meta))
+
+    # then the shared cache (any worker's earlier on-chain read), then one more
+    # batch for whatever metadata is still missing. SQLite stays off the event
+    # loop: reads go through a worker thread, writes are queued (write_behind).
+    shared = await asyncio.to_thread(shared_cache.get_many, [
+        f"meta:{t.lower()}" for t, _, m in held if m.get("decimals") is None or m.get("symbol") is None
+    ])
+    with metrics.stage("liquidity"):  # liquid / unit price from the warmer
+        warm_tokens = await asyncio.to_thread(cache_warmer.get_tokens, [t for t, _, _ in held])
+    meta_calls = []
+    for token, _, meta in held:
+        if meta.get("decimals") is None or meta.get("symbol") is None:
+            if f"meta:{token.lower()}" in shared:
+                continue
+            meta_calls += [decimals_call(token), symbol_call(token)]
+    with metrics.stage("metadata"):
+        meta_results = iter(await aggregate3_async(aw3, meta_calls, block_identifier=block))
+
+    dust = []
+    fresh_meta = []
+    for token_cs, raw_bal, meta in held:
+        dec = meta.get("decimals")
+        sym = meta.get("symbol")
+        used_registry_symbol = sym is not None
+        if dec is None or sym is None:
+            chain = shared.get(f"meta:{token_cs.lower()}")
+            if chain is None:
+                chain = {"decimals": decode_uint(next(meta_results)), "symbol": decode_symbol(next(meta_results))}
+                if chain["decimals"] is not None and chain["decimals"] <= 255 and chain["symbol"] is not None:
+                    fresh_meta.append((f"meta:{token_cs.lower()}", chain, shared_cache.META_TTL_SECONDS, None))
+            dec = dec if dec is not None else chain["decimals"]
+            sym = sym if sym is not None else (chain["symbol"] or "TOKEN")
+        dec_i = dec if dec is not None and dec <= 255 else 18
+
+        amount = raw_bal / (10 ** dec_i)
+
+        item = {
+            "symbol": str(sym),
+            "amount": float(amount),
+            "mon_value": None,
+            "token": token_cs,
+        }
+
+        # Value from the background warmer (unit price x amount), never a live quote here
+        warm = warm_tokens.get(token_cs)
+        if warm is not None:
+            item["liquid"] = warm["liquid"]
+            item["price_age_seconds"] = warm["age_seconds"]
+            if warm["liquid"]:
+                item["mon_value"] = float(amount) * int(warm["unit_mon_out"]) / 1e18
+                item["mon_value_source"] = "warm_cache_estimate"
+
+        dust.append(item)
+
+        if used_registry_symbol:
+            notes.append(f"BALCHECK {token_cs} raw_bal={raw_bal} dec={dec_i} (registry_symbol)")
+        else:
+            notes.append(f"BALCHECK {token_cs} raw_bal={raw_bal} dec={dec_i} (onchain_symbol)")
+
+    if fresh_meta:
+        shared_cache.write_behind(shared_cache.set_many, fresh_meta)
+    cache_warmer.record_holdings([t for t, _, _ in held], background=True)
+    warm_status = await asyncio.to_thread(cache_warmer.status)
+
+    return {
+        "source": "public_registry_balanceof_fallback",
+        "wallet": wallet,
+        "dust_count": len(dust),
+        "notes": notes,
+        "warm_cache": warm_status,
+        "dust": dust,
+    }
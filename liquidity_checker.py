@@ -3,6 +3,7 @@ from web3 import Web3
 from dotenv import load_dotenv
 from lens_abi import LENS_ABI
 from erc20_abi import ERC20_ABI
+import shared_cache
 
 load_dotenv()
 
@@ -24,8 +25,13 @@ def can_swap_simulation(w3, token_in):
         lens = w3.eth.contract(address=Web3.to_checksum_address(LENS), abi=LENS_ABI)
 
         # Probe a tiny amount based on decimals
-        erc = w3.eth.contract(address=token_in, abi=ERC20_ABI)
-        decimals = erc.functions.decimals().call()
+        # decimals never change: reuse any process's earlier read
+        meta = shared_cache.get(f"meta:{token_in.lower()}")
+        if meta is not None:
+            decimals = int(meta["decimals"])
+        else:
+            erc = w3.eth.contract(address=token_in, abi=ERC20_ABI)
+            decimals = erc.functions.decimals().call()
 
         # Probe = 0.001 token (or 1 unit if decimals < 3)
         amount_in = 10 ** (decimals - 3) if decimals >= 3 else 1
@@ -0,0 +1,361 @@
+"""
+Load test for api_server against the local stub chain (stub_chain.py).
+
+Starts the stub RPC in its own process, launches api_server under uvicorn pointed at
+it, drives a closed-loop mix of /analyze and /prepare-sell requests, then
+reports throughput, p50/p95/p99 latency, error rate and RPC amplification
+(JSON-RPC requests the server sent per HTTP request it answered).
+
+    python loadtest.py                                   # one run
+    LOADTEST_SWEEP=1,2,4,8,16,32,64 python loadtest.py   # find the knee
+
+Config (env):
+  LOADTEST_CONCURRENCY       clients in flight (default 16)
+  LOADTEST_DURATION_SECONDS  measured seconds per run (default 20)
+  LOADTEST_WARMUP_SECONDS    unmeasured lead-in per run (default 3)
+  LOADTEST_MIX               route weights, e.g. "analyze=3,prepare-sell=1,prepare-sell-batch=0"
+  LOADTEST_WALLETS           distinct wallets (default 500)
+  LOADTEST_HOT_SHARE         share of requests that go to 10 "hot" wallets (default 0.2)
+  LOADTEST_WORKERS           uvicorn workers (default 1)
+  LOADTEST_SWEEP             comma-separated concurrency levels; enables sweep mode
+  LOADTEST_KNEE_GAIN         sweep: throughput gain below which we call the knee (default 0.10)
+  LOADTEST_TARGET_URL        hit an already-running server instead (no RPC amplification then)
+  STUB_RPC_LATENCY_MS        simulated RPC round trip (default 0; ~30-80 is realistic)
+"""
+import asyncio
+import hashlib
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from stub_chain import STUB_RPC_LATENCY_MS, stub_balance
+
+LOADTEST_CONCURRENCY = int(os.getenv("LOADTEST_CONCURRENCY", "16"))
+LOADTEST_DURATION_SECONDS = float(os.getenv("LOADTEST_DURATION_SECONDS", "20"))
+LOADTEST_WARMUP_SECONDS = float(os.getenv("LOADTEST_WARMUP_SECONDS", "3"))
+LOADTEST_MIX = os.getenv("LOADTEST_MIX", "analyze=3,prepare-sell=1")
+LOADTEST_WALLETS = int(os.getenv("LOADTEST_WALLETS", "500"))
+LOADTEST_HOT_SHARE = float(os.getenv("LOADTEST_HOT_SHARE", "0.2"))
+LOADTEST_WORKERS = int(os.getenv("LOADTEST_WORKERS", "1"))
+LOADTEST_SWEEP = os.getenv("LOADTEST_SWEEP", "")
+LOADTEST_KNEE_GAIN = float(os.getenv("LOADTEST_KNEE_GAIN", "0.10"))
+LOADTEST_TARGET_URL = os.getenv("LOADTEST_TARGET_URL", "")
+REQUEST_TIMEOUT_SECONDS = 30.0
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# -----------------------
+# Workload
+# -----------------------
+
+def _parse_mix(raw: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in raw.split(","):
+        if "=" not in part:
+            continue
+        name, w = part.split("=", 1)
+        if float(w) > 0:
+            mix.append((name.strip(), float(w)))
+    if not mix:
+        raise ValueError(f"LOADTEST_MIX has no positive weights: {raw!r}")
+    return mix
+
+
+def _wallets(n: int) -> List[str]:
+    return ["0x" + hashlib.sha256(f"loadtest-wallet-{i}".encode()).hexdigest()[:40] for i in range(n)]
+
+
+def _held_tokens(wallet: str, candidates: List[str]) -> List[str]:
+    return [t for t in candidates if stub_balance(t, wallet) > 0]
+
+
+class Workload:
+    def __init__(self, candidates: List[str], seed: int = 143):
+        self.rnd = random.Random(seed)
+        self.mix = _parse_mix(LOADTEST_MIX)
+        self.wallets = _wallets(LOADTEST_WALLETS)
+        self.hot = self.wallets[:10]
+        self.candidates = candidates
+        self._held: Dict[str, List[str]] = {}
+
+    def _wallet(self) -> str:
+        if self.rnd.random() < LOADTEST_HOT_SHARE:
+            return self.rnd.choice(self.hot)
+        return self.rnd.choice(self.wallets)
+
+    def _token_for(self, wallet: str) -> str:
+        held = self._held.get(wallet)
+        if held is None:
+            held = self._held[wallet] = _held_tokens(wallet, self.candidates)
+        # mostly tokens the wallet holds; some zero-balance ones, like real traffic
+        if held and self.rnd.random() < 0.9:
+            return self.rnd.choice(held)
+        return self.rnd.choice(self.candidates)
+
+    def next(self) -> Tuple[str, str, dict]:
+        """(label, path, json body)"""
+        route = self.rnd.choices([m for m, _ in self.mix], weights=[w for _, w in self.mix])[0]
+        wallet = self._wallet()
+        if route == "analyze":
+            return route, "/analyze", {"wallet": wallet}
+        if route == "prepare-sell":
+            return route, "/prepare-sell", {"wallet": wallet, "token": self._token_for(wallet)}
+        if route == "prepare-sell-batch":
+            return route, "/prepare-sell-batch", {"wallet": wallet, "tokens": "all"}
+        raise ValueError(f"unknown route in LOADTEST_MIX: {route}")
+
+
+# -----------------------
+# Server under test
+# -----------------------
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_healthy(proc: subprocess.Popen, url: str, what: str) -> None:
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{what} exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"{what} did not come up in 30s")
+
+
+def start_stub_chain() -> Tuple[subprocess.Popen, str]:
+    """Own process, so its GIL doesn't compete with the load driver's."""
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, "stub_chain.py")],
+                            env=dict(os.environ, STUB_PORT=str(port)), stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    _wait_healthy(proc, url, "stub chain")
+    return proc, url
+
+
+def _rpc_stats(rpc_url: Optional[str]) -> Optional[Dict[str, int]]:
+    return httpx.get(rpc_url, timeout=5).json() if rpc_url else None
+
+
+def start_server(rpc_url: str, workdir: str) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "RPC_URL": rpc_url,
+        "NADFUN_LENS": "0x" + "1e" * 20,
+        "NADFUN_ROUTERS": "0x" + "7a" * 20,
+        # keep the run's caches out of the repo and out of each other's way
+        "SHARED_CACHE_FILE": os.path.join(workdir, "shared_cache.db"),
+        "WARM_LOCK_FILE": os.path.join(workdir, "cache_warmer.lock"),
+        "REGISTRY_SNAPSHOT_FILE": os.path.join(workdir, "registry.snap"),
+    })
+    # all load comes from one IP: measure capacity, not the per-client limiter
+    # (ADMISSION_ENABLED=true in the environment turns it back on)
+    env.setdefault("ADMISSION_ENABLED", "false")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api_server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(LOADTEST_WORKERS), "--log-level", "warning"],
+        cwd=HERE, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    _wait_healthy(proc, url + "/health", "api_server")
+    return proc, url
+
+
+# -----------------------
+# Driver
+# -----------------------
+
+def _classify(resp: httpx.Response) -> Optional[str]:
+    """None = success, otherwise an error label."""
+    if resp.status_code != 200:
+        return f"http_{resp.status_code}"
+    try:
+        source = resp.json().get("source", "")
+    except ValueError:
+        return "bad_json"
+    # zero balance / no output are valid answers, not failures
+    if source.startswith("error_") and source not in ("error_zero_balance", "error_no_mon_output"):
+        return source
+    return None
+
+
+async def _client_loop(client: httpx.AsyncClient, base: str, workload: Workload,
+                       measure_from: float, stop_at: float, samples: list) -> None:
+    while True:
+        t0 = time.perf_counter()
+        if t0 >= stop_at:
+            return
+        label, path, body = workload.next()
+        try:
+            resp = await client.post(base + path, json=body)
+            err = _classify(resp)
+        except httpx.TimeoutException:
+            err = "timeout"
+        except httpx.HTTPError as e:
+            err = type(e).__name__
+        t1 = time.perf_counter()
+        if t0 >= measure_from:
+            samples.append((label, t1 - t0, err))
+
+
+def _pct(sorted_vals: List[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(p / 100 * len(sorted_vals))) - 1))
+    return sorted_vals[i]
+
+
+def _summarize(samples: list, elapsed: float, rpc: Optional[Dict[str, int]]) -> dict:
+    def block(rows):
+        lat = sorted(r[1] for r in rows)
+        errors: Dict[str, int] = {}
+        for r in rows:
+            if r[2]:
+                errors[r[2]] = errors.get(r[2], 0) + 1
+        return {
+            "requests": len(rows),
+            "rps": len(rows) / elapsed if elapsed > 0 else 0.0,
+            "p50_ms": _pct(lat, 50) * 1000,
+            "p95_ms": _pct(lat, 95) * 1000,
+            "p99_ms": _pct(lat, 99) * 1000,
+            "error_rate": sum(errors.values()) / len(rows) if rows else 0.0,
+            "errors": errors,
+        }
+
+    out = {"total": block(samples), "routes": {}}
+    for label in sorted({s[0] for s in samples}):
+        out["routes"][label] = block([s for s in samples if s[0] == label])
+    if rpc is not None and samples:
+        out["rpc_per_request"] = rpc.get("requests", 0) / len(samples)
+        out["eth_calls_per_request"] = (rpc.get("multicall_subcalls", 0) + rpc.get("plain_calls", 0)) / len(samples)
+    return out
+
+
+async def run_once(base: str, workload: Workload, concurrency: int, rpc_url: Optional[str]) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT_SECONDS, limits=limits) as client:
+        start = time.perf_counter()
+        measure_from = start + LOADTEST_WARMUP_SECONDS
+        stop_at = measure_from + LOADTEST_DURATION_SECONDS
+        samples: list = []
+
+        async def _snapshot_at(t):
+            await asyncio.sleep(max(0.0, t - time.perf_counter()))
+            return await asyncio.to_thread(_rpc_stats, rpc_url)
+
+        snap_task = asyncio.ensure_future(_snapshot_at(measure_from))
+        await asyncio.gather(*[
+            _client_loop(client, base, workload, measure_from, stop_at, samples) for _ in range(concurrency)
+        ])
+        before = await snap_task
+        elapsed = time.perf_counter() - measure_from
+
+    rpc = None
+    if rpc_url:
+        after = _rpc_stats(rpc_url)
+        rpc = {k: after.get(k, 0) - before.get(k, 0) for k in after}
+    return _summarize(samples, elapsed, rpc)
+
+
+# -----------------------
+# Reporting
+# -----------------------
+
+def _print_run(concurrency: int, s: dict) -> None:
+    t = s["total"]
+    print(f"\nconcurrency={concurrency}  requests={t['requests']}  throughput={t['rps']:.1f} req/s  "
+          f"errors={t['error_rate']:.2%}")
+    if "rpc_per_request" in s:
+        print(f"RPC amplification: {s['rpc_per_request']:.2f} JSON-RPC requests, "
+              f"{s['eth_calls_per_request']:.1f} contract calls per HTTP request")
+    print(f"  {'route':<20}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for label, r in list(s["routes"].items()) + [("ALL", t)]:
+        print(f"  {label:<20}{r['rps']:>9.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['error_rate']:>9.2%}")
+        if r["errors"]:
+            print(f"  {'':<20}{r['errors']}")
+
+
+def find_knee(results: List[Tuple[int, dict]]) -> Optional[int]:
+    """
+    Last concurrency level that still bought real throughput: after it, the
+    next level adds less than LOADTEST_KNEE_GAIN req/s (relative) while p95 climbs.
+    """
+    for (c, cur), (_, nxt) in zip(results, results[1:]):
+        gain = (nxt["total"]["rps"] - cur["total"]["rps"]) / max(cur["total"]["rps"], 1e-9)
+        if gain < LOADTEST_KNEE_GAIN and nxt["total"]["p95_ms"] > cur["total"]["p95_ms"]:
+            return c
+    return None
+
+
+def main() -> None:
+    from dust_scanner import _load_scan_candidates
+
+    os.chdir(HERE)  # registry files are read relative to the repo
+    candidates, _, _, error = _load_scan_candidates("0x" + "00" * 20, 200)
+    if error or not candidates:
+        raise RuntimeError("No registry candidates (verified_contracts.json / public_registry.json)")
+    workload = Workload(candidates)
+
+    stub = proc = None
+    rpc_url = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            if LOADTEST_TARGET_URL:
+                base = LOADTEST_TARGET_URL.rstrip("/")
+            else:
+                stub, rpc_url = start_stub_chain()
+                proc, base = start_server(rpc_url, workdir)
+            print(f"Target {base}  workers={LOADTEST_WORKERS}  mix={LOADTEST_MIX}  "
+                  f"wallets={LOADTEST_WALLETS}  stub_latency_ms={STUB_RPC_LATENCY_MS if rpc_url else 'n/a'}")
+
+            levels = [int(x) for x in LOADTEST_SWEEP.split(",") if x.strip()] or [LOADTEST_CONCURRENCY]
+            results = []
+            for c in levels:
+                s = asyncio.run(run_once(base, workload, c, rpc_url))
+                _print_run(c, s)
+                results.append((c, s))
+
+            if len(results) > 1:
+                print("\nSweep:")
+                print(f"  {'conc':>6}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+                for c, s in results:
+                    t = s["total"]
+                    print(f"  {c:>6}{t['rps']:>9.1f}{t['p50_ms']:>10.1f}{t['p95_ms']:>10.1f}{t['p99_ms']:>10.1f}"
+                          f"{t['error_rate']:>9.2%}")
+                knee = find_knee(results)
+                if knee is None:
+                    print("No knee found: throughput still scaling at the highest level, extend LOADTEST_SWEEP")
+                else:
+                    best = dict(results)[knee]["total"]
+                    print(f"Knee at concurrency={knee}: ~{best['rps']:.1f} req/s sustainable, "
+                          f"p95 {best['p95_ms']:.0f} ms")
+        finally:
+            for p in (proc, stub):
+                if p is None:
+                    continue
+                p.terminate()
+                try:
+                    p.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+
+
+if __name__ == "__main__":
+    main()
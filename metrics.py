@@ -0,0 +1,250 @@
+"""
+Tiny Prometheus-style metrics (no client library needed).
+
+Everything is an in-process dict of counters guarded by one short lock per
+metric, cheap enough to leave on in production. render() copies each metric
+under its lock and formats outside it. Each uvicorn worker exposes
+its own numbers on /metrics; aggregate across workers in Prometheus.
+"""
+import asyncio
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+LabelKey = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250)
+
+_registry: List["_Metric"] = []
+
+
+def _fmt_labels(names: Tuple[str, ...], values: LabelKey, extra: str = "") -> str:
+    parts = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, *label_values: str, n: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def render(self):
+        out = super().render()
+        with self._lock:
+            values = list(self._values.items())
+        for key, v in sorted(values):
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return out
+
+
+class Gauge(_Metric):
+    """Either set() directly or backed by a callback evaluated at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=(), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, doc, labels)
+        self._values: Dict[LabelKey, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def add(self, n: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def render(self):
+        out = super().render()
+        if self._fn is not None:
+            try:
+                out.append(f"{self.name} {float(self._fn())}")
+            except Exception:
+                pass
+        with self._lock:
+            values = list(self._values.items())
+        for key, v in sorted(values):
+            out.append(f"{self.name}{_fmt_labels(self.labels, key)} {v}")
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        # per label set: [bucket counts..., +Inf count], sum
+        self._values: Dict[LabelKey, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            row = self._values.get(label_values)
+            if row is None:
+                row = self._values[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            row[0][i] += 1
+            row[1][0] += value
+
+    def render(self):
+        out = super().render()
+        with self._lock:
+            rows = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in sorted(rows):
+            acc = 0
+            for b, c in zip(self.buckets, counts):
+                acc += c
+                le = 'le="%s"' % b
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {acc}")
+            acc += counts[-1]
+            le = 'le="+Inf"'
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labels, key, le)} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labels, key)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labels, key)} {acc}")
+        return out
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in _registry:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------
+# The metrics we export
+# -----------------------
+
+HTTP_REQUESTS = Counter("dcp_http_requests_total", "HTTP requests by route and status", ("route", "status"))
+HTTP_LATENCY = Histogram("dcp_http_request_seconds", "HTTP request latency by route", ("route",))
+HTTP_INFLIGHT = Gauge("dcp_http_inflight_requests", "Requests currently being served")
+STAGE_LATENCY = Histogram("dcp_stage_seconds", "Scan/prepare stage latency", ("stage",))
+RPC_CALLS = Counter("dcp_rpc_calls_total", "JSON-RPC requests sent, by method", ("method",))
+RPC_PER_REQUEST = Histogram("dcp_rpc_calls_per_request", "JSON-RPC requests per HTTP request", ("route",), COUNT_BUCKETS)
+CACHE_REQUESTS = Counter("dcp_cache_requests_total", "Cache lookups by cache and result (hit/miss)", ("cache", "result"))
+STARTUP_SECONDS = Gauge("dcp_startup_seconds", "Cold-start phases of this worker", ("phase",))
+LOOP_LAG = Histogram("dcp_event_loop_lag_seconds", "How late the event loop wakes up a sleeping task")
+
+
+def _threadpool_in_use() -> float:
+    # anyio's default limiter backs FastAPI's sync routes / run_in_threadpool
+    from anyio.to_thread import current_default_thread_limiter
+    return current_default_thread_limiter().borrowed_tokens
+
+
+THREADPOOL_IN_USE = Gauge("dcp_threadpool_busy_threads", "Busy threads in the anyio worker pool", fn=_threadpool_in_use)
+
+
+# -----------------------
+# Helpers
+# -----------------------
+
+_rpc_counter: contextvars.ContextVar = contextvars.ContextVar("dcp_rpc_counter", default=None)
+
+
+@contextmanager
+def stage(name: str):
+    """with metrics.stage("quote"): ... (works around awaits too)"""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - t0, name)
+
+
+def cache_event(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache, "hit" if hit else "miss")
+
+
+def count_rpc(method: str) -> None:
+    RPC_CALLS.inc(method)
+    holder = _rpc_counter.get()
+    if holder is not None:
+        holder[0] += 1
+
+
+def rpc_counting_middleware():
+    """web3 middleware class that feeds count_rpc (imported lazily to keep web3 optional here)."""
+    from web3.middleware import Web3Middleware
+
+    class RpcCountingMiddleware(Web3Middleware):
+        def wrap_make_request(self, make_request):
+            def middleware(method, params):
+                count_rpc(str(method))
+                return make_request(method, params)
+            return middleware
+
+        async def async_wrap_make_request(self, make_request):
+            async def middleware(method, params):
+                count_rpc(str(method))
+                return await make_request(method, params)
+            return middleware
+
+    return RpcCountingMiddleware
+
+
+async def watch_event_loop(interval: float = 0.25) -> None:
+    """Background task: records how late the loop wakes us (saturation signal)."""
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.perf_counter() - t0 - interval))
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (BaseHTTPMiddleware would break disconnect detection)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = ["500"]
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        holder = [0]
+        token = _rpc_counter.set(holder)
+        HTTP_INFLIGHT.add(1)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            label = getattr(route, "path", None) or "unmatched"
+            HTTP_INFLIGHT.add(-1)
+            HTTP_REQUESTS.inc(label, status[0])
+            HTTP_LATENCY.observe(time.perf_counter() - t0, label)
+            RPC_PER_REQUEST.observe(holder[0], label)
+            _rpc_counter.reset(token)
@@ -10,17 +10,28 @@ def _get_base() -> str:
         raise RuntimeError("MONADSCAN_API_URL is not set in .env")
     return base.rstrip("/")
 
-def discover_token_contracts_monadscan(wallet: str, max_pages: int = 5, page_size: int = 200) -> List[str]:
+class DiscoveryError(RuntimeError):
+    """Neither API gave a complete answer (429, HTTP error, bad response)."""
+
+
+def discover_token_contracts_monadscan(wallet: str, max_pages: int = 5, page_size: int = 200,
+                                       raise_on_error: bool = False) -> List[str]:
     """
     Discover ERC-20 token contracts from MonadScan.
 
     Strategy:
     1) Try Blockscout-style v2 API (usually NO API KEY needed)
     2) If MONADSCAN_API_KEY is set, also try Etherscan-style API as fallback
+
+    Errors are swallowed (you get whatever was found, maybe []) unless
+    raise_on_error=True: then DiscoveryError is raised when neither API
+    answered in full, so callers can tell "no tokens" from "couldn't ask".
     """
     wallet = wallet.strip()
     base = _get_base()
     found: Set[str] = set()
+    ok = False
+    last_error = "no API answered"
 
     # ----------------------------
     # 1) Blockscout v2 API (best)
@@ -57,12 +68,13 @@ def discover_token_contracts_monadscan(wallet: str, max_pages: int = 5, page_siz
                 params = {**params, **npp}
             pages += 1
 
+        ok = True
         if found:
             return sorted(found)
 
-    except Exception:
+    except Exception as e:
         # If v2 isn't supported, we'll try etherscan-style next (if key exists)
-        pass
+        last_error = f"v2: {type(e).__name__}: {e}"
 
     # ---------------------------------------
     # 2) Etherscan-style API (needs API key)
@@ -70,9 +82,12 @@ def discover_token_contracts_monadscan(wallet: str, max_pages: int = 5, page_siz
     key = (os.getenv("MONADSCAN_API_KEY", "") or "").strip()
     if not key:
         # No key and v2 failed => return empty rather than crash
+        if not ok and raise_on_error:
+            raise DiscoveryError(last_error)
         return sorted(found)
 
     # Etherscan-style base is usually ".../api"
+    es_ok = False
     try:
         url = f"{base}/api"
         for page in range(1, max_pages + 1):
@@ -93,15 +108,23 @@ def discover_token_contracts_monadscan(wallet: str, max_pages: int = 5, page_siz
             result = data.get("result", [])
 
             if status != "1" or not isinstance(result, list) or len(result) == 0:
+                # status "0" is also how rate limits ("Max rate limit reached") come back
+                if status == "1" or "no transactions found" in str(data.get("message", "")).lower():
+                    es_ok = True
+                else:
+                    es_ok, last_error = False, f"tokentx: {data.get('message')} {str(result)[:100]}"
                 break
+            es_ok = True
 
             for row in result:
                 ca = (row.get("contractAddress") or "").strip()
                 if ca.startswith("0x") and len(ca) == 42:
                     found.add(ca)
 
-    except Exception:
-        pass
+    except Exception as e:
+        es_ok, last_error = False, f"tokentx: {type(e).__name__}: {e}"
 
+    if not (ok or es_ok) and raise_on_error:
+        raise DiscoveryError(last_error)
     return sorted(found)
 
@@ -0,0 +1,129 @@
+import asyncio
+import os
+from typing import Any, List, Optional, Sequence, Tuple
+
+from eth_abi import decode, encode
+from web3 import Web3
+
+from multicall_abi import MULTICALL3_ABI
+
+# Multicall3 lives at the same address on every EVM chain (Monad included)
+MULTICALL3_ADDRESS = os.getenv("MULTICALL3_ADDRESS", "0xcA11bde05977b3631167028862bE2a173976CA11")
+
+# How many sub-calls go into one eth_call (keeps us under RPC gas / payload caps)
+MULTICALL_BATCH_SIZE = int(os.getenv("MULTICALL_BATCH_SIZE", "200"))
+
+# Precomputed 4-byte selectors (first 4 bytes of keccak(signature))
+SEL_DECIMALS = bytes.fromhex("313ce567")       # decimals()
+SEL_SYMBOL = bytes.fromhex("95d89b41")         # symbol()
+SEL_BALANCE_OF = bytes.fromhex("70a08231")     # balanceOf(address)
+SEL_ALLOWANCE = bytes.fromhex("dd62ed3e")      # allowance(address,address)
+SEL_GET_AMOUNT_OUT = bytes.fromhex("f2d65617") # getAmountOut(address,uint256,bool)
+SEL_GET_BLOCK_NUMBER = bytes.fromhex("42cbb15c") # Multicall3.getBlockNumber()
+
+Call = Tuple[str, bytes]             # (target, calldata)
+Result = Tuple[bool, bytes]          # (success, returndata)
+
+
+# -----------------------
+# Sub-call encoders
+# -----------------------
+
+def decimals_call(token: str) -> Call:
+    return (token, SEL_DECIMALS)
+
+def symbol_call(token: str) -> Call:
+    return (token, SEL_SYMBOL)
+
+def balance_of_call(token: str, wallet: str) -> Call:
+    return (token, SEL_BALANCE_OF + encode(["address"], [wallet]))
+
+def allowance_call(token: str, owner: str, spender: str) -> Call:
+    return (token, SEL_ALLOWANCE + encode(["address", "address"], [owner, spender]))
+
+def block_number_call() -> Call:
+    """Put this in a batch to learn which block the batch was executed at."""
+    return (MULTICALL3_ADDRESS, SEL_GET_BLOCK_NUMBER)
+
+def lens_sell_quote_call(lens: str, token: str, amount_in: int) -> Call:
+    """Lens.getAmountOut(token, amountIn, isBuy=False) -> token -> MON quote."""
+    return (lens, SEL_GET_AMOUNT_OUT + encode(["address", "uint256", "bool"], [token, int(amount_in), False]))
+
+
+# -----------------------
+# Result decoders (None when the sub-call failed / returned garbage)
+# -----------------------
+
+def decode_uint(res: Result) -> Optional[int]:
+    ok, data = res
+    if not ok or len(data) < 32:
+        return None
+    return int.from_bytes(data[:32], "big")
+
+def decode_symbol(res: Result) -> Optional[str]:
+    """symbol() is usually `string`, but some old tokens return bytes32."""
+    ok, data = res
+    if not ok or not data:
+        return None
+    try:
+        return str(decode(["string"], data)[0])
+    except Exception:
+        pass
+    if len(data) == 32:
+        return data.rstrip(b"\x00").decode("utf-8", errors="ignore") or None
+    return None
+
+def decode_amount_out(res: Result) -> Optional[Tuple[str, int]]:
+    """Lens.getAmountOut -> (router, amountOut)."""
+    ok, data = res
+    if not ok or len(data) < 64:
+        return None
+    try:
+        router, out = decode(["address", "uint256"], data)
+        return Web3.to_checksum_address(router), int(out)
+    except Exception:
+        return None
+
+
+# -----------------------
+# aggregate3
+# -----------------------
+
+def _chunks(calls: Sequence[Call], size: int) -> List[Sequence[Call]]:
+    size = max(1, int(size))
+    return [calls[i:i + size] for i in range(0, len(calls), size)]
+
+def _as_struct(calls: Sequence[Call]) -> List[Tuple[str, bool, bytes]]:
+    # allowFailure=True: one bad token must never break the whole batch
+    return [(Web3.to_checksum_address(t), True, data) for t, data in calls]
+
+def aggregate3(w3, calls: Sequence[Call], block_identifier: Any = "latest", batch_size: Optional[int] = None) -> List[Result]:
+    """
+    Runs `calls` through Multicall3.aggregate3 (one eth_call per batch).
+    Returns one (success, returndata) per call, in order.
+    Raises if the RPC itself fails, so callers can tell "RPC down" from "token reverted".
+    """
+    if not calls:
+        return []
+    mc = w3.eth.contract(address=Web3.to_checksum_address(MULTICALL3_ADDRESS), abi=MULTICALL3_ABI)
+    out: List[Result] = []
+    for chunk in _chunks(calls, batch_size or MULTICALL_BATCH_SIZE):
+        rows = mc.functions.aggregate3(_as_struct(chunk)).call(block_identifier=block_identifier)
+        out.extend((bool(ok), bytes(data)) for ok, data in rows)
+    return out
+
+
+async def aggregate3_async(aw3, calls: Sequence[Call], block_identifier: Any = "latest", batch_size: Optional[int] = None) -> List[Result]:
+    """AsyncWeb3 twin of aggregate3(); batches are sent concurrently."""
+    if not calls:
+        return []
+    mc = aw3.eth.contract(address=Web3.to_checksum_address(MULTICALL3_ADDRESS), abi=MULTICALL3_ABI)
+    chunks = _chunks(calls, batch_size or MULTICALL_BATCH_SIZE)
+    batches = await asyncio.gather(*[
+        mc.functions.aggregate3(_as_struct(chunk)).call(block_identifier=block_identifier)
+        for chunk in chunks
+    ])
+    out: List[Result] = []
+    for rows in batches:
+        out.extend((bool(ok), bytes(data)) for ok, data in rows)
+    return out
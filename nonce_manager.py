@@ -0,0 +1,171 @@
+"""
+Local nonce manager: lets us send approve + sell back to back without waiting
+for the approve to confirm.
+
+Seeded once from get_transaction_count(address, "pending"), then hands out
+consecutive nonces locally. Handles:
+  - a send that fails before reaching the mempool: the nonce is given back
+    (or, if later nonces are already out, filled with a 0-value self-transfer
+    so they aren't stuck behind the gap)
+  - "nonce too low" and friends: resync from the chain
+  - a tx that doesn't confirm: replace() re-sends the same nonce with a
+    bumped gas price
+
+One manager per address per process. Don't run two processes sending from the
+same key at the same time.
+"""
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+REPLACEMENT_BUMP = 1.125  # nodes want >= +10% to accept a same-nonce replacement
+
+_NONCE_ERRORS = ("nonce too low", "nonce too high", "replacement transaction underpriced", "invalid nonce")
+
+
+def _err_text(e: Exception) -> str:
+    return str(getattr(e, "args", [e])[0] if getattr(e, "args", None) else e).lower()
+
+
+class NonceManager:
+    def __init__(self, w3, address: str):
+        self.w3 = w3
+        self.address = address
+        self._lock = threading.Lock()
+        self._next: Optional[int] = None
+        self._gaps: List[int] = []
+        self._sent: Dict[int, dict] = {}  # nonce -> {"tx", "hash", "sent_at"}
+
+    # -----------------------
+    # Allocation
+    # -----------------------
+
+    def sync(self) -> int:
+        with self._lock:
+            self._next = self.w3.eth.get_transaction_count(self.address, "pending")
+            self._gaps = []
+            return self._next
+
+    def next_nonce(self) -> int:
+        with self._lock:
+            if self._next is None:
+                self._next = self.w3.eth.get_transaction_count(self.address, "pending")
+            if self._gaps:
+                return self._gaps.pop(0)
+            n = self._next
+            self._next += 1
+            return n
+
+    def _release(self, nonce: int) -> bool:
+        """Give a never-broadcast nonce back. Returns True if it left a gap."""
+        with self._lock:
+            if self._next is not None and nonce == self._next - 1:
+                self._next -= 1
+                return False
+            self._gaps.append(nonce)
+            self._gaps.sort()
+            return True
+
+    # -----------------------
+    # Sending
+    # -----------------------
+
+    def _broadcast(self, account, tx: dict, on_signed: Optional[Callable[[int, object], None]] = None):
+        signed = account.sign_transaction(tx)
+        if on_signed is not None:
+            on_signed(tx["nonce"], signed.hash)  # e.g. journal the hash before it can reach the mempool
+        try:
+            return self.w3.eth.send_raw_transaction(signed.raw_transaction)
+        except Exception as e:
+            if "already known" in _err_text(e):
+                return signed.hash  # the node has it already: that's a success
+            raise
+
+    def send(self, account, tx: dict, on_signed: Optional[Callable[[int, object], None]] = None) -> Tuple[int, object]:
+        """
+        Assigns a nonce, signs and broadcasts `tx`. Returns (nonce, tx_hash).
+        on_signed(nonce, hash) runs between signing and broadcasting.
+        """
+        nonce = self.next_nonce()
+        tx = dict(tx, nonce=nonce)
+        try:
+            tx_hash = self._broadcast(account, tx, on_signed)
+        except Exception as e:
+            if any(m in _err_text(e) for m in _NONCE_ERRORS):
+                print(f"Nonce {nonce} rejected ({e}); resyncing from chain")
+                self.sync()
+            elif self._release(nonce):
+                self._fill_gap(account, nonce, tx.get("gasPrice"))
+            raise
+        with self._lock:
+            self._sent[nonce] = {"tx": tx, "hash": tx_hash, "sent_at": time.time()}
+        return nonce, tx_hash
+
+    def _fill_gap(self, account, nonce: int, gas_price: Optional[int]) -> None:
+        """Later nonces are already out: burn this one with a no-op so they can mine."""
+        with self._lock:
+            if nonce not in self._gaps:
+                return
+            self._gaps.remove(nonce)
+        noop = {
+            "from": account.address,
+            "to": account.address,
+            "value": 0,
+            "gas": 21_000,
+            "gasPrice": gas_price or self.w3.eth.gas_price,
+            "nonce": nonce,
+            "chainId": self.w3.eth.chain_id,
+        }
+        try:
+            tx_hash = self._broadcast(account, noop)
+        except Exception as e:
+            print(f"Could not fill nonce gap {nonce} ({e}); resyncing from chain")
+            self.sync()
+            return
+        with self._lock:
+            self._sent[nonce] = {"tx": noop, "hash": tx_hash, "sent_at": time.time()}
+        print(f"Filled nonce gap {nonce} with a no-op: {tx_hash.hex()}")
+
+    # -----------------------
+    # Stuck transactions
+    # -----------------------
+
+    def unconfirmed(self) -> List[int]:
+        """Our sent nonces the chain hasn't included yet, oldest first."""
+        mined = self.w3.eth.get_transaction_count(self.address, "latest")
+        with self._lock:
+            for n in [n for n in self._sent if n < mined]:
+                del self._sent[n]
+            return sorted(self._sent)
+
+    def replace(self, account, nonce: int, gas_price: Optional[int] = None) -> object:
+        """Re-send the tx at `nonce` with a higher gas price. Returns the new hash."""
+        with self._lock:
+            entry = self._sent.get(nonce)
+        if entry is None:
+            raise KeyError(f"nonce {nonce} was not sent by this manager")
+        old = entry["tx"]
+        bumped = int(old.get("gasPrice", 0) * REPLACEMENT_BUMP) + 1
+        tx = dict(old, gasPrice=max(bumped, gas_price or 0, self.w3.eth.gas_price))
+        tx_hash = self._broadcast(account, tx)
+        with self._lock:
+            self._sent[nonce] = {"tx": tx, "hash": tx_hash, "sent_at": time.time()}
+        print(f"Replaced nonce {nonce} at gasPrice={tx['gasPrice']}: {tx_hash.hex()}")
+        return tx_hash
+
+    def hash_of(self, nonce: int):
+        with self._lock:
+            entry = self._sent.get(nonce)
+        return entry["hash"] if entry else None
+
+
+_managers: Dict[str, NonceManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_nonce_manager(w3, address: str) -> NonceManager:
+    with _managers_lock:
+        nm = _managers.get(address.lower())
+        if nm is None:
+            nm = _managers[address.lower()] = NonceManager(w3, address)
+        return nm
@@ -0,0 +1,238 @@
+"""
+Pre-flight for planned sells: simulate every router.sell with eth_call, in one
+JSON-RPC batch, before anything is broadcast.
+
+Per plan the batch carries:
+  - Lens.getAmountOut for the planned amount (fresh quote)
+  - router.sell(...) from our wallet
+  - if the plan still needs its approve: the sell runs with an eth_call state
+    override that sets allowance[wallet][router] (OpenZeppelin layout, mapping
+    at PREFLIGHT_ALLOWANCE_SLOT), plus an allowance() read under the same
+    override to prove the slot guess was right
+
+Outcomes:
+  - the sell reverts                 -> dropped (stale quote, fee-on-transfer,
+                                        paused curve, ...)
+  - ... and the plan skipped its
+    approve                         -> allowance() is read again first: if it
+                                        is short (stale allowance_cache entry),
+                                        the cache is corrected and the plan gets
+                                        its approve and one more simulation
+  - the quote moved by more than
+    PREFLIGHT_DRIFT_BPS             -> amount_out_min is re-derived from the new
+                                        quote (same slippage) and the sell is
+                                        simulated once more
+  - the Lens now picks another router,
+    or quotes nothing               -> dropped (the next run re-plans it)
+  - the node rejects overrides, or the
+    slot guess was wrong            -> kept unverified (can't simulate a sell
+                                        behind an approve that isn't mined yet)
+"""
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from eth_abi import decode, encode
+from eth_utils import keccak
+
+import allowance_cache
+from calldata import encode_sell
+
+PREFLIGHT_ENABLED = os.getenv("PREFLIGHT_ENABLED", "true").lower() == "true"
+PREFLIGHT_STATE_OVERRIDES = os.getenv("PREFLIGHT_STATE_OVERRIDES", "true").lower() == "true"
+PREFLIGHT_ALLOWANCE_SLOT = int(os.getenv("PREFLIGHT_ALLOWANCE_SLOT", "1"))
+PREFLIGHT_DRIFT_BPS = int(os.getenv("PREFLIGHT_DRIFT_BPS", "100"))
+
+LENS_GET_AMOUNT_OUT = bytes.fromhex("f2d65617")  # getAmountOut(address,uint256,bool)
+ALLOWANCE_SELECTOR = bytes.fromhex("dd62ed3e")   # allowance(address,address)
+_SIM_ALLOWANCE = 2 ** 256 - 1
+
+_overrides_supported = PREFLIGHT_STATE_OVERRIDES
+
+
+def allowance_storage_key(owner: str, spender: str, slot: int = PREFLIGHT_ALLOWANCE_SLOT) -> str:
+    """Storage key of allowance[owner][spender] for a Solidity mapping(address => mapping(address => uint)) at `slot`."""
+    inner = keccak(encode(["address", "uint256"], [owner, slot]))
+    return "0x" + keccak(encode(["address", "bytes32"], [spender, inner])).hex()
+
+
+def _allowance_override(plan: Dict[str, Any], owner: str) -> dict:
+    key = allowance_storage_key(owner, plan["router"])
+    return {plan["token"]: {"stateDiff": {key: "0x" + _SIM_ALLOWANCE.to_bytes(32, "big").hex()}}}
+
+
+def _is_revert(err: dict) -> bool:
+    msg = str(err.get("message", "")).lower()
+    return err.get("code") == 3 or "revert" in msg
+
+
+# -----------------------
+# Batch
+# -----------------------
+
+def _sim_calls(plans: List[Dict[str, Any]], owner: str, lens: str, with_quote: bool) -> Tuple[list, list]:
+    """(batch requests, per plan {"quote": i, "sell": i or None, "allowance": i, "override": bool})"""
+    reqs, slots = [], []
+    for p in plans:
+        idx: Dict[str, Any] = {"override": False}
+        if with_quote:
+            data = LENS_GET_AMOUNT_OUT + encode(["address", "uint256", "bool"], [p["token"], p["amount_in"], False])
+            idx["quote"] = len(reqs)
+            reqs.append(("eth_call", [{"to": lens, "data": "0x" + data.hex()}, "latest"]))
+
+        sell = {"from": owner, "to": p["router"],
+                "data": encode_sell(p["amount_in"], p["amount_out_min"], p["token"], owner, p["deadline"])}
+        idx["sell"] = len(reqs)
+        if p["approve_needed"] and not _overrides_supported:
+            idx["sell"] = None  # would only revert on the missing allowance
+        elif p["approve_needed"]:
+            over = _allowance_override(p, owner)
+            idx["override"] = True
+            idx["allowance"] = len(reqs) + 1
+            check = ALLOWANCE_SELECTOR + encode(["address", "address"], [owner, p["router"]])
+            reqs.append(("eth_call", [sell, "latest", over]))
+            reqs.append(("eth_call", [{"to": p["token"], "data": "0x" + check.hex()}, "latest", over]))
+        else:
+            reqs.append(("eth_call", [sell, "latest"]))
+        slots.append(idx)
+    return reqs, slots
+
+
+def _run_batch(w3, reqs: list) -> list:
+    resp = w3.provider.make_batch_request(reqs)
+    if not isinstance(resp, list):
+        raise RuntimeError((resp.get("error") or {}).get("message", "batch request failed"))
+    return resp
+
+
+def _sell_verdict(resp: list, idx: dict) -> Tuple[str, Optional[str]]:
+    """("ok" | "revert" | "unverified", detail)"""
+    global _overrides_supported
+    if idx["sell"] is None:
+        return "unverified", "approve not mined yet and no state overrides"
+    sell = resp[idx["sell"]]
+    if "error" not in sell:
+        return "ok", None
+    err = sell["error"]
+    if not _is_revert(err):
+        if idx["override"]:
+            print(f"Preflight: node rejected eth_call state overrides ({err.get('message')}); sells behind an approve go unsimulated")
+            _overrides_supported = False
+        return "unverified", str(err.get("message"))
+    if idx["override"]:
+        check = resp[idx["allowance"]]
+        got = int(check.get("result") or "0x0", 16) if "error" not in check else None
+        if got != _SIM_ALLOWANCE:
+            return "unverified", "allowance slot guess did not take"
+    return "revert", str(err.get("message"))
+
+
+def _recheck_allowances(w3, owner: str, suspect: List[Tuple[Dict[str, Any], str]],
+                        dropped: List[Tuple[Dict[str, Any], str]]) -> List[Dict[str, Any]]:
+    """
+    Sells planned without an approve that still revert: read allowance() again
+    (one batch) and put the chain's answer in allowance_cache. Plans that were
+    short get their approve and are returned for another simulation; the rest
+    are added to `dropped`.
+    """
+    reqs = []
+    for p, _ in suspect:
+        data = ALLOWANCE_SELECTOR + encode(["address", "address"], [owner, p["router"]])
+        reqs.append(("eth_call", [{"to": p["token"], "data": "0x" + data.hex()}, "latest"]))
+    try:
+        resp = _run_batch(w3, reqs)
+    except Exception as e:
+        print(f"Preflight allowance re-read skipped: {e}")
+        resp = [{"error": {"message": str(e)}}] * len(suspect)
+
+    retry = []
+    for (p, detail), r in zip(suspect, resp):
+        if "error" in r:
+            allowance_cache.on_sell_failed(owner, p["token"], p["router"])  # read it again next run
+            dropped.append((p, f"simulated sell reverts: {detail}"))
+            continue
+        have = int(r.get("result") or "0x0", 16)
+        allowance_cache.observe(owner, p["token"], p["router"], have)
+        if have >= p["amount_in"]:
+            dropped.append((p, f"simulated sell reverts: {detail}"))
+            continue
+        print(f"Preflight: cached allowance for {p['symbol']} was stale ({have} < {p['amount_in']}); adding the approve")
+        p["approve_needed"] = True
+        p["approve_amount"] = allowance_cache.approve_amount(p["router"], p["amount_in"])
+        retry.append(p)
+    return retry
+
+
+# -----------------------
+# Entry point
+# -----------------------
+
+def check(w3, account, plans: List[Dict[str, Any]], lens: str) -> Tuple[List[Dict[str, Any]], List[Tuple[Dict[str, Any], str]]]:
+    """
+    Simulates `plans` (from swap_executor.plan_swap). Returns (plans to send,
+    [(dropped plan, reason)]). Kept plans may have a re-derived quote; plans
+    that couldn't be simulated get plan["preflight"] = "unverified".
+    """
+    if not PREFLIGHT_ENABLED or not plans:
+        return plans, []
+    owner = account.address
+    reqs, slots = _sim_calls(plans, owner, lens, with_quote=True)
+    try:
+        resp = _run_batch(w3, reqs)
+    except Exception as e:
+        print(f"Preflight skipped: {e}")
+        return plans, []
+
+    keep, dropped, requote, suspect = [], [], [], []
+    for p, idx in zip(plans, slots):
+        q = resp[idx["quote"]]
+        if "error" in q:
+            dropped.append((p, f"quote failed: {q['error'].get('message')}"))
+            continue
+        router, mon_out = decode(["address", "uint256"], bytes.fromhex(q["result"][2:]))
+        if router.lower() != p["router"].lower():
+            dropped.append((p, f"Lens now routes via {router}"))
+            continue
+        if mon_out <= 0:
+            dropped.append((p, "no MON output"))
+            continue
+
+        drift_bps = abs(mon_out - p["mon_out"]) * 10_000 // max(1, p["mon_out"])
+        if drift_bps > PREFLIGHT_DRIFT_BPS:
+            # same slippage as planned, on the fresh quote
+            p["amount_out_min"] = mon_out * p["amount_out_min"] // p["mon_out"]
+            p["mon_out"] = mon_out
+            requote.append(p)
+            continue
+
+        verdict, detail = _sell_verdict(resp, idx)
+        if verdict == "revert":
+            if not p["approve_needed"]:
+                suspect.append((p, detail))  # maybe a stale cached allowance
+                continue
+            dropped.append((p, f"simulated sell reverts: {detail}"))
+            continue
+        p["preflight"] = verdict
+        keep.append(p)
+
+    if suspect:
+        requote += _recheck_allowances(w3, owner, suspect, dropped)
+
+    if requote:
+        print(f"Preflight: re-simulating {len(requote)} sell(s) (quote drift > {PREFLIGHT_DRIFT_BPS} bps or approve added)")
+        reqs, slots = _sim_calls(requote, owner, lens, with_quote=False)
+        try:
+            resp = _run_batch(w3, reqs)
+        except Exception as e:
+            print(f"Preflight re-check skipped: {e}")
+            resp = None
+        for p, idx in zip(requote, slots):
+            verdict, detail = _sell_verdict(resp, idx) if resp is not None else ("unverified", None)
+            if verdict == "revert":
+                dropped.append((p, f"simulated sell reverts on re-check: {detail}"))
+                continue
+            p["preflight"] = verdict
+            keep.append(p)
+
+    for p, reason in dropped:
+        print(f"Preflight dropped {p['symbol']}: {reason}")
+    return keep, dropped
@@ -0,0 +1,189 @@
+"""
+Block-driven receipt tracking: many in-flight txs cost about one poll per block.
+
+Instead of one wait_for_transaction_receipt() loop per hash, waiters register
+a hash and get a Future. One eth_blockNumber poll per RECEIPT_POLL_SECONDS;
+only when the block moves are receipts fetched, for every pending hash at once:
+  batch  one JSON-RPC batch of eth_getTransactionReceipt (default, works anywhere)
+  block  eth_getBlockReceipts for each new block (RECEIPT_MODE=block; falls
+         back to batch the first time the node refuses it)
+Newly registered hashes always go through one batch round, since they may
+have been mined in a block we already looked at.
+
+Polling is driven either by the caller (poll(), e.g. the stage2 pipeline's
+loop) or by a daemon thread that runs while someone is blocked in wait().
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Iterable, Optional, Set
+
+from web3.datastructures import AttributeDict
+
+RECEIPT_POLL_SECONDS = float(os.getenv("RECEIPT_POLL_SECONDS", "0.4"))
+RECEIPT_MODE = os.getenv("RECEIPT_MODE", "batch").lower()
+RECEIPT_MAX_BLOCK_GAP = int(os.getenv("RECEIPT_MAX_BLOCK_GAP", "8"))  # more new blocks than this: batch instead
+
+_QUANTITIES = ("blockNumber", "status", "gasUsed", "cumulativeGasUsed", "effectiveGasPrice", "transactionIndex", "type")
+
+
+def _hex(tx_hash) -> str:
+    if isinstance(tx_hash, (bytes, bytearray)):
+        return "0x" + bytes(tx_hash).hex()
+    return str(tx_hash).lower()
+
+
+def _format(raw: dict) -> AttributeDict:
+    """Raw JSON receipt -> what w3.eth.get_transaction_receipt returns, for the fields we read."""
+    out = dict(raw)
+    for k in _QUANTITIES:
+        if isinstance(out.get(k), str):
+            out[k] = int(out[k], 16)
+    return AttributeDict(out)
+
+
+class ReceiptTracker:
+    def __init__(self, w3, poll_seconds: float = RECEIPT_POLL_SECONDS, mode: str = RECEIPT_MODE):
+        self.w3 = w3
+        self.poll_seconds = poll_seconds
+        self.mode = mode
+        self.block: Optional[int] = None
+        self.polls = 0  # eth_blockNumber calls
+        self.fetches = 0  # receipt round trips
+        self._pending: Dict[str, Future] = {}
+        self._fresh: Set[str] = set()
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._last_poll = 0.0
+        self._waiters = 0
+        self._thread: Optional[threading.Thread] = None
+
+    # -----------------------
+    # Waiters
+    # -----------------------
+
+    def track(self, tx_hash) -> Future:
+        """Future resolved with the receipt once the tx is mined (same future if already tracked)."""
+        h = _hex(tx_hash)
+        with self._lock:
+            fut = self._pending.get(h)
+            if fut is None:
+                fut = self._pending[h] = Future()
+                self._fresh.add(h)
+        return fut
+
+    def forget(self, tx_hash) -> None:
+        """Stop tracking (e.g. the hash was replaced by a gas bump)."""
+        h = _hex(tx_hash)
+        with self._lock:
+            fut = self._pending.pop(h, None)
+            self._fresh.discard(h)
+        if fut is not None:
+            fut.cancel()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def wait(self, tx_hash, timeout: float):
+        """Blocks for the receipt; raises TimeoutError."""
+        fut = self.track(tx_hash)
+        with self._lock:
+            self._waiters += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="receipt-tracker", daemon=True)
+                self._thread.start()
+        try:
+            return fut.result(timeout=timeout)
+        finally:
+            with self._lock:
+                self._waiters -= 1
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if self._waiters <= 0:
+                    self._thread = None
+                    return
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Receipt poll failed: {e}")
+            time.sleep(self.poll_seconds)
+
+    # -----------------------
+    # Polling
+    # -----------------------
+
+    def poll(self) -> int:
+        """One eth_blockNumber (at most once per poll_seconds); on a new block, fetch receipts."""
+        with self._poll_lock:
+            now = time.monotonic()
+            if self.block is not None and now - self._last_poll < self.poll_seconds:
+                return self.block
+            self._last_poll = now
+            block = int(self.w3.eth.block_number)
+            self.polls += 1
+            if block != self.block:
+                prev, self.block = self.block, block
+                self._fetch(prev, block)
+            return block
+
+    def _fetch(self, prev: Optional[int], block: int) -> None:
+        with self._lock:
+            pending = set(self._pending)
+            fresh, self._fresh = self._fresh, set()
+        if not pending:
+            return
+
+        found: Dict[str, dict] = {}
+        batch_for: Iterable[str] = pending
+        if self.mode == "block" and prev is not None and block - prev <= RECEIPT_MAX_BLOCK_GAP:
+            try:
+                for n in range(prev + 1, block + 1):
+                    for r in self._block_receipts(n):
+                        h = _hex(r["transactionHash"])
+                        if h in pending:
+                            found[h] = r
+                batch_for = fresh
+            except Exception as e:
+                print(f"eth_getBlockReceipts unavailable ({e}); using batched receipt lookups")
+                self.mode = "batch"
+        missing = [h for h in batch_for if h not in found]
+        if missing:
+            found.update(self._batch_receipts(missing))
+
+        with self._lock:
+            for h, raw in found.items():
+                fut = self._pending.pop(h, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(_format(raw))
+
+    def _block_receipts(self, number: int) -> list:
+        self.fetches += 1
+        resp = self.w3.provider.make_request("eth_getBlockReceipts", [hex(number)])
+        if "error" in resp:
+            raise RuntimeError(resp["error"].get("message", resp["error"]))
+        return resp.get("result") or []
+
+    def _batch_receipts(self, hashes) -> Dict[str, dict]:
+        self.fetches += 1
+        resp = self.w3.provider.make_batch_request([("eth_getTransactionReceipt", [h]) for h in hashes])
+        if not isinstance(resp, list):  # the whole batch was refused
+            raise RuntimeError((resp.get("error") or {}).get("message", "batch request failed"))
+        return {h: r["result"] for h, r in zip(hashes, resp) if r.get("result")}
+
+
+_trackers: Dict[str, ReceiptTracker] = {}
+_trackers_lock = threading.Lock()
+
+
+def get_receipt_tracker(w3) -> ReceiptTracker:
+    key = getattr(w3.provider, "endpoint_uri", None) or str(id(w3.provider))
+    with _trackers_lock:
+        t = _trackers.get(key)
+        if t is None:
+            t = _trackers[key] = ReceiptTracker(w3)
+        return t
+
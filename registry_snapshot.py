@@ -0,0 +1,361 @@
+"""
+Compact, read-only registry snapshot shared by every process via mmap.
+
+File layout (all integers little-endian):
+
+  header   32 bytes   magic "DCRS", version u16, reserved u16, count u32,
+                      decimals_off u32, symoff_off u32, blob_off u32, blob_len u32, 4 pad
+  addrs    count*20   raw 20-byte addresses, sorted ascending
+  decimals count*1    u8 per token, 255 = unknown
+  symoffs  (count+1)*4  u32 offsets into blob; symbol i = blob[symoffs[i]:symoffs[i+1]]
+  blob     blob_len   utf-8 symbols (empty = unknown)
+
+Build it from verified_contracts.json + public_registry.json with:
+    python registry_snapshot.py
+
+load_snapshot() is the request-path read: the cached mmap, nothing else.
+refresh_snapshot() (api_server warm-up, cache_warmer) recompiles the snapshot
+when either JSON file is newer (decimals/symbols the old snapshot had are
+kept); REGISTRY_SNAPSHOT_RECOMPILE=false leaves a stale one as it is.
+"""
+import fcntl
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import metrics
+
+SNAPSHOT_FILE = os.getenv("REGISTRY_SNAPSHOT_FILE", "registry.snap")
+VERIFIED_FILE = "verified_contracts.json"
+PUBLIC_REGISTRY_FILE = "public_registry.json"
+
+MAGIC = b"DCRS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIIII4x")
+ADDR_LEN = 20
+UNKNOWN_DECIMALS = 255
+
+REGISTRY_SNAPSHOT_RECOMPILE = os.getenv("REGISTRY_SNAPSHOT_RECOMPILE", "true").lower() == "true"
+# a replaced snapshot's mmap is closed this long after the swap (requests may still be reading it)
+REGISTRY_SNAPSHOT_CLOSE_GRACE_SECONDS = float(os.getenv("REGISTRY_SNAPSHOT_CLOSE_GRACE_SECONDS", "60"))
+# how often load_snapshot() re-stats the snapshot file to pick up one another process recompiled
+REGISTRY_SNAPSHOT_CHECK_SECONDS = float(os.getenv("REGISTRY_SNAPSHOT_CHECK_SECONDS", "30"))
+
+
+def _addr_bytes(addr: str) -> Optional[bytes]:
+    if not isinstance(addr, str) or not addr.startswith("0x") or len(addr) != 42:
+        return None
+    try:
+        return bytes.fromhex(addr[2:])
+    except ValueError:
+        return None
+
+
+class RegistrySnapshot:
+    """Binary-search lookups over a memory-mapped snapshot file (no per-token Python objects)."""
+
+    def __init__(self, path: str = SNAPSHOT_FILE):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, dec_off, symoff_off, blob_off, blob_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self._mm.close()
+            raise ValueError(f"{path} is not a v{VERSION} registry snapshot")
+        self.count = count
+        self._dec_off = dec_off
+        self._symoff_off = symoff_off
+        self._blob_off = blob_off
+        self._blob_len = blob_len
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, addr) -> bool:
+        return self.index_of(addr) >= 0
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _addr_at(self, i: int) -> bytes:
+        start = HEADER.size + i * ADDR_LEN
+        return self._mm[start:start + ADDR_LEN]
+
+    def index_of(self, addr: str) -> int:
+        key = _addr_bytes(addr)
+        if key is None:
+            return -1
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._addr_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count and self._addr_at(lo) == key:
+            return lo
+        return -1
+
+    def address_at(self, i: int) -> str:
+        """Lower-case hex; callers checksum only the few they actually use."""
+        return "0x" + self._addr_at(i).hex()
+
+    def decimals_at(self, i: int) -> Optional[int]:
+        d = self._mm[self._dec_off + i]
+        return None if d == UNKNOWN_DECIMALS else d
+
+    def symbol_at(self, i: int) -> Optional[str]:
+        a, b = struct.unpack_from("<II", self._mm, self._symoff_off + i * 4)
+        if a == b:
+            return None
+        return self._mm[self._blob_off + a:self._blob_off + b].decode("utf-8", errors="ignore")
+
+    def get(self, addr: str) -> Optional[Dict[str, object]]:
+        """{"symbol": str|None, "decimals": int|None} or None when not in the registry."""
+        i = self.index_of(addr)
+        if i < 0:
+            return None
+        return {"symbol": self.symbol_at(i), "decimals": self.decimals_at(i)}
+
+    def addresses(self, limit: Optional[int] = None) -> Iterator[str]:
+        n = self.count if limit is None else min(self.count, max(0, limit))
+        for i in range(n):
+            yield self.address_at(i)
+
+
+# -----------------------
+# Per-process cache (reloads when the compiler replaces the file)
+# -----------------------
+
+_loaded: Dict[str, Tuple[float, float, RegistrySnapshot]] = {}  # path -> (file mtime, checked at, snapshot)
+_retired: List[Tuple[float, RegistrySnapshot]] = []  # (replaced at, snapshot) waiting to be closed
+_load_lock = threading.Lock()
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _sources_mtime() -> float:
+    return max(_mtime(VERIFIED_FILE) or 0.0, _mtime(PUBLIC_REGISTRY_FILE) or 0.0)
+
+
+def _close_retired(now: float) -> None:
+    while _retired and now - _retired[0][0] >= REGISTRY_SNAPSHOT_CLOSE_GRACE_SECONDS:
+        _retired.pop(0)[1].close()
+
+
+def load_snapshot(path: str = SNAPSHOT_FILE, recheck: bool = False) -> Optional[RegistrySnapshot]:
+    """
+    The current snapshot, or None (missing or unreadable). Cheap enough for
+    every request: never looks at the JSON sources or compiles, and only
+    re-stats the snapshot file every REGISTRY_SNAPSHOT_CHECK_SECONDS
+    (or with recheck=True).
+    """
+    now = time.time()
+    cached = _loaded.get(path)
+    if cached and not recheck and now - cached[1] < REGISTRY_SNAPSHOT_CHECK_SECONDS:
+        metrics.cache_event("registry_snapshot", True)
+        return cached[2]
+    with _load_lock:
+        cached = _loaded.get(path)
+        mtime = _mtime(path)
+        if mtime is None:
+            return None
+        if cached and cached[0] == mtime:
+            _loaded[path] = (mtime, now, cached[2])
+            metrics.cache_event("registry_snapshot", True)
+            return cached[2]
+        metrics.cache_event("registry_snapshot", False)
+        try:
+            snap = RegistrySnapshot(path)
+        except Exception:
+            return None
+        if cached:
+            _retired.append((now, cached[2]))
+        _close_retired(now)
+        _loaded[path] = (mtime, now, snap)
+        return snap
+
+
+def _needs_compile(path: str) -> bool:
+    mtime = _mtime(path)
+    if mtime is None:
+        return True
+    return REGISTRY_SNAPSHOT_RECOMPILE and _sources_mtime() > mtime
+
+
+def refresh_snapshot(path: str = SNAPSHOT_FILE, w3=None) -> Optional[RegistrySnapshot]:
+    """
+    Compiles the snapshot if it is missing or older than the JSON registries,
+    then loads it. Stats the sources, so it belongs in warm-up and the cache
+    warmer, not on the request path. One process compiles at a time; the
+    others keep serving the file they have until it is replaced.
+    """
+    if _needs_compile(path):
+        try:
+            with open(f"{path}.lock", "w") as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return load_snapshot(path)  # another worker is compiling it
+                if _needs_compile(path):  # it may have finished just before we got the lock
+                    compile_snapshot(path, w3=w3)
+        except Exception as e:
+            print("Snapshot recompile failed, keeping the current one:", e)
+    return load_snapshot(path, recheck=True)
+
+
+# -----------------------
+# Compiler
+# -----------------------
+
+def _collect_sources(verified_path: str, public_path: str) -> Dict[bytes, Dict[str, object]]:
+    entries: Dict[bytes, Dict[str, object]] = {}
+
+    try:
+        with open(verified_path, "r") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            for addr, meta in data.items():
+                key = _addr_bytes(addr)
+                if key is None:
+                    continue
+                meta = meta if isinstance(meta, dict) else {}
+                entries[key] = {"symbol": meta.get("symbol"), "decimals": meta.get("decimals")}
+        elif isinstance(data, list):
+            for addr in data:
+                key = _addr_bytes(addr)
+                if key is not None:
+                    entries.setdefault(key, {})
+    except Exception:
+        pass
+
+    try:
+        with open(public_path, "r") as f:
+            data = json.load(f)
+        if isinstance(data, list):
+            for addr in data:
+                key = _addr_bytes(addr)
+                if key is not None:
+                    entries.setdefault(key, {})
+    except Exception:
+        pass
+
+    return entries
+
+
+def _carry_over(entries: Dict[bytes, Dict[str, object]], old_path: str) -> None:
+    """Metadata the previous snapshot had (e.g. filled from chain) and the JSON lacks."""
+    try:
+        old = RegistrySnapshot(old_path)
+    except Exception:
+        return
+    try:
+        for k, meta in entries.items():
+            if meta.get("decimals") is not None and meta.get("symbol") is not None:
+                continue
+            prev = old.get("0x" + k.hex())
+            if prev is None:
+                continue
+            for field in ("decimals", "symbol"):
+                if meta.get(field) is None:
+                    meta[field] = prev[field]
+    finally:
+        old.close()
+
+
+def _fill_from_chain(w3, entries: Dict[bytes, Dict[str, object]]) -> None:
+    """decimals/symbol never change, so fetch the missing ones once at compile time."""
+    from multicall import aggregate3, decimals_call, symbol_call, decode_uint, decode_symbol
+
+    keys = [k for k, m in entries.items() if m.get("decimals") is None or m.get("symbol") is None]
+    if not keys:
+        return
+    calls = []
+    for k in keys:
+        addr = "0x" + k.hex()
+        calls.append(decimals_call(addr))
+        calls.append(symbol_call(addr))
+    results = aggregate3(w3, calls)
+    for i, k in enumerate(keys):
+        meta = entries[k]
+        if meta.get("decimals") is None:
+            meta["decimals"] = decode_uint(results[2 * i])
+        if meta.get("symbol") is None:
+            meta["symbol"] = decode_symbol(results[2 * i + 1])
+
+
+def compile_snapshot(out_path: str = SNAPSHOT_FILE, verified_path: str = VERIFIED_FILE,
+                     public_path: str = PUBLIC_REGISTRY_FILE, w3=None) -> int:
+    """
+    Merges the JSON registries into one snapshot file (atomic replace).
+    With `w3`, missing decimals/symbols are filled in via multicall.
+    Returns the number of tokens written.
+    """
+    entries = _collect_sources(verified_path, public_path)
+    _carry_over(entries, out_path)
+    if w3 is not None:
+        try:
+            _fill_from_chain(w3, entries)
+        except Exception as e:
+            print("Snapshot: on-chain metadata fill skipped:", e)
+
+    keys = sorted(entries)
+    count = len(keys)
+
+    decimals = bytearray()
+    offsets = [0]
+    blob = bytearray()
+    for k in keys:
+        meta = entries[k]
+        try:
+            d = int(meta.get("decimals"))
+        except (TypeError, ValueError):
+            d = UNKNOWN_DECIMALS
+        decimals.append(d if 0 <= d < UNKNOWN_DECIMALS else UNKNOWN_DECIMALS)
+        sym = meta.get("symbol")
+        if sym is not None:
+            blob += str(sym).encode("utf-8")
+        offsets.append(len(blob))
+
+    dec_off = HEADER.size + count * ADDR_LEN
+    symoff_off = dec_off + count
+    blob_off = symoff_off + (count + 1) * 4
+
+    tmp = f"{out_path}.{os.getpid()}.tmp"  # several workers may compile at once
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, count, dec_off, symoff_off, blob_off, len(blob)))
+        f.write(b"".join(keys))
+        f.write(bytes(decimals))
+        f.write(struct.pack(f"<{count + 1}I", *offsets))
+        f.write(bytes(blob))
+    os.replace(tmp, out_path)
+
+    print(f"Saved {count} tokens to {out_path}")
+    return count
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv(dotenv_path=".env", override=True)
+
+    w3 = None
+    rpc = os.getenv("RPC_URL") or os.getenv("MONAD_RPC_URL")
+    if rpc:
+        from web3 import Web3
+
+        w3 = Web3(Web3.HTTPProvider(rpc, request_kwargs={"timeout": 20}))
+        if not w3.is_connected():
+            print("RPC not connected, compiling without on-chain metadata")
+            w3 = None
+
+    compile_snapshot(w3=w3)
@@ -0,0 +1,281 @@
+"""
+Event-driven scheduler for the agent (replaces the fixed-sleep loops of
+agent.py's __main__ and agent_runner.py).
+
+Cleaning runs when dust actually arrives: one eth_getLogs per
+SCHED_POLL_SECONDS, over the new blocks only, for Transfer(to=wallet). The
+tokens those logs mention are queued and cleaned with a targeted scan of just
+those tokens. Nothing new means no scan at all.
+  debounce   a burst of transfers becomes one run: fire SCHED_DEBOUNCE_SECONDS
+             after the last one, but no later than SCHED_DEBOUNCE_MAX_SECONDS
+             after the first
+  max rate   at most one cleaning run per SCHED_CLEAN_MIN_INTERVAL_SECONDS
+  sweep      a full registry scan every SCHED_SWEEP_SECONDS (and at start),
+             for anything logs can't show (e.g. a token that became liquid)
+
+Social jobs (heartbeat, promotion, comment and DM replies, bet simulation)
+each run on their own cadence. Every fire time gets 0..SCHED_JITTER_SECONDS
+of random jitter so restarts and several agents don't line up.
+
+Jobs run in two lanes, one worker thread each: "chain" (cleaning) and
+"social" (everything that talks to Moltbook). A Moltbook 429 backoff only
+holds up the social lane.
+
+The log cursor is kept in SCHED_STATE_FILE, so transfers that land while the
+agent is down are picked up on restart (up to SCHED_MAX_LOG_RANGE blocks
+back; a longer gap falls back to a sweep). Logs are read SCHED_LOG_CHUNK
+blocks per request and the cursor moves after each chunk that came back, so
+a refused or failed request is retried from there on the next poll.
+
+    python scheduler.py
+"""
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set
+
+from web3 import Web3
+
+from token_discovery import TRANSFER_TOPIC
+
+SCHED_STATE_FILE = os.getenv("SCHED_STATE_FILE", "scheduler_state.json")
+SCHED_POLL_SECONDS = float(os.getenv("SCHED_POLL_SECONDS", "2"))
+SCHED_DEBOUNCE_SECONDS = float(os.getenv("SCHED_DEBOUNCE_SECONDS", "15"))
+SCHED_DEBOUNCE_MAX_SECONDS = float(os.getenv("SCHED_DEBOUNCE_MAX_SECONDS", "60"))
+SCHED_CLEAN_MIN_INTERVAL_SECONDS = float(os.getenv("SCHED_CLEAN_MIN_INTERVAL_SECONDS", "120"))
+SCHED_SWEEP_SECONDS = float(os.getenv("SCHED_SWEEP_SECONDS", str(6 * 3600)))
+SCHED_JITTER_SECONDS = float(os.getenv("SCHED_JITTER_SECONDS", "20"))
+SCHED_MAX_LOG_RANGE = int(os.getenv("SCHED_MAX_LOG_RANGE", "5000"))
+SCHED_LOG_CHUNK = int(os.getenv("SCHED_LOG_CHUNK", "100"))  # blocks per eth_getLogs (RPC range limits)
+
+# social cadences (seconds; 0 = off)
+SCHED_HEARTBEAT_SECONDS = float(os.getenv("SCHED_HEARTBEAT_SECONDS", "1800"))
+SCHED_PROMOTION_SECONDS = float(os.getenv("SCHED_PROMOTION_SECONDS", "3600"))
+SCHED_REPLIES_SECONDS = float(os.getenv("SCHED_REPLIES_SECONDS", "900"))
+SCHED_DMS_SECONDS = float(os.getenv("SCHED_DMS_SECONDS", "900"))
+SCHED_BETS_SECONDS = float(os.getenv("SCHED_BETS_SECONDS", "3600"))
+
+
+def _jitter() -> float:
+    return random.uniform(0, SCHED_JITTER_SECONDS)
+
+
+def _load_state() -> dict:
+    try:
+        with open(SCHED_STATE_FILE, "r") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _save_state(state: dict) -> None:
+    tmp = f"{SCHED_STATE_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, SCHED_STATE_FILE)
+
+
+# -----------------------
+# Inbound transfers
+# -----------------------
+
+class TransferWatcher:
+    """Incremental Transfer(to=wallet) log reader; poll() returns token contracts seen since the last call."""
+
+    def __init__(self, w3, wallet: str):
+        self.w3 = w3
+        self.topic_to = "0x" + Web3.to_checksum_address(wallet).lower()[2:].rjust(64, "0")
+        self.cursor: Optional[int] = _load_state().get("last_block")
+        self.gap = False  # set when blocks were skipped; the caller should sweep
+
+    def poll(self) -> Set[str]:
+        latest = int(self.w3.eth.block_number)
+        if self.cursor is None:
+            self.cursor = latest
+            self._persist()
+            return set()
+        if latest <= self.cursor:
+            return set()
+        start = self.cursor + 1
+        if latest - start + 1 > SCHED_MAX_LOG_RANGE:
+            print(f"[scheduler] {latest - start + 1} blocks behind; reading the last {SCHED_MAX_LOG_RANGE} and sweeping")
+            start = latest - SCHED_MAX_LOG_RANGE + 1
+            self.gap = True
+        tokens: Set[str] = set()
+        chunk = max(1, SCHED_LOG_CHUNK)
+        while start <= latest:
+            end = min(start + chunk - 1, latest)
+            try:
+                logs = self.w3.eth.get_logs({
+                    "fromBlock": start,
+                    "toBlock": end,
+                    "topics": [TRANSFER_TOPIC, None, self.topic_to],
+                })
+            except Exception as e:
+                print(f"[scheduler] get_logs {start}-{end} failed (retrying from there next poll): {e}")
+                break
+            tokens |= {Web3.to_checksum_address(log["address"]) for log in logs if log.get("address")}
+            self.cursor = end
+            self._persist()
+            start = end + 1
+        return tokens
+
+    def _persist(self) -> None:
+        state = _load_state()
+        state["last_block"] = self.cursor
+        _save_state(state)
+
+
+# -----------------------
+# Jobs / lanes
+# -----------------------
+
+class Job:
+    def __init__(self, name: str, fn: Callable[[], None], every: float):
+        self.name = name
+        self.fn = fn
+        self.every = every
+        self.due = time.time() + _jitter()
+        self.runs = 0
+
+    def reschedule(self) -> None:
+        self.due = time.time() + self.every + _jitter()
+
+
+class Scheduler:
+    def __init__(self, w3, wallet: str, clean: Callable[[Optional[List[str]]], list],
+                 social: List[Job], after_clean: Optional[Callable[[list], None]] = None):
+        self.watcher = TransferWatcher(w3, wallet)
+        self.clean = clean
+        self.after_clean = after_clean
+        self.social = [j for j in social if j.every > 0]
+        self.lanes: Dict[str, ThreadPoolExecutor] = {
+            "chain": ThreadPoolExecutor(max_workers=1, thread_name_prefix="sched-chain"),
+            "social": ThreadPoolExecutor(max_workers=1, thread_name_prefix="sched-social"),
+        }
+        self.busy: Dict[str, object] = {}  # lane -> Future of the job running in it
+        self.pending: Set[str] = set()
+        self.first_event = 0.0
+        self.last_event = 0.0
+        self.event_jitter = 0.0
+        self.last_clean = 0.0
+        self.sweep_due = time.time()  # sweep once at start
+        self.post_queue: List[list] = []  # sold symbols waiting for the social lane
+        self._post_lock = threading.Lock()
+
+    # -----------------------
+    # Cleaning trigger
+    # -----------------------
+
+    def _clean_due_at(self) -> Optional[float]:
+        if not self.pending:
+            return None
+        settle = min(self.last_event + SCHED_DEBOUNCE_SECONDS, self.first_event + SCHED_DEBOUNCE_MAX_SECONDS)
+        return max(settle, self.last_clean + SCHED_CLEAN_MIN_INTERVAL_SECONDS) + self.event_jitter
+
+    def _on_tokens(self, tokens: Set[str]) -> None:
+        now = time.time()
+        if not self.pending:
+            self.first_event = now
+            self.event_jitter = _jitter()
+        new = tokens - self.pending
+        self.pending |= tokens
+        self.last_event = now
+        if new:
+            print(f"[scheduler] inbound transfer: {len(new)} new token(s), {len(self.pending)} queued")
+
+    def _run_clean(self, tokens: Optional[List[str]]) -> None:
+        sold = self.clean(tokens)
+        if sold and self.after_clean is not None:
+            with self._post_lock:
+                self.post_queue.append(sold)
+
+    def _start(self, lane: str, name: str, fn: Callable[[], None]) -> None:
+        def run():
+            t0 = time.time()
+            try:
+                fn()
+            except Exception as e:
+                print(f"[scheduler] {name} failed:", e)
+            print(f"[scheduler] {name} done in {time.time() - t0:.1f}s")
+        self.busy[lane] = self.lanes[lane].submit(run)
+
+    def _idle(self, lane: str) -> bool:
+        fut = self.busy.get(lane)
+        return fut is None or fut.done()
+
+    # -----------------------
+    # Loop
+    # -----------------------
+
+    def tick(self) -> None:
+        try:
+            tokens = self.watcher.poll()
+        except Exception as e:
+            print("[scheduler] log poll failed:", e)
+            tokens = set()
+        if tokens:
+            self._on_tokens(tokens)
+        if self.watcher.gap:
+            self.watcher.gap = False
+            self.sweep_due = time.time()
+
+        now = time.time()
+        if self._idle("chain") and now >= self.last_clean + SCHED_CLEAN_MIN_INTERVAL_SECONDS:
+            if now >= self.sweep_due:
+                self.pending.clear()  # the sweep covers them
+                self.last_clean = now
+                self.sweep_due = now + SCHED_SWEEP_SECONDS + _jitter()
+                self._start("chain", "sweep", lambda: self._run_clean(None))
+            else:
+                due = self._clean_due_at()
+                if due is not None and now >= due:
+                    batch = sorted(self.pending)
+                    self.pending.clear()
+                    self.last_clean = now
+                    self._start("chain", f"clean({len(batch)})", lambda: self._run_clean(batch))
+
+        if self._idle("social"):
+            with self._post_lock:
+                sold = [s for batch in self.post_queue for s in batch]
+                self.post_queue.clear()
+            if sold:
+                self._start("social", "sell_updates", lambda: self.after_clean(sold))
+                return
+            overdue = [j for j in self.social if now >= j.due]
+            if overdue:
+                job = min(overdue, key=lambda j: j.due)
+                job.runs += 1
+                job.reschedule()
+                self._start("social", job.name, job.fn)
+
+    def run_forever(self) -> None:
+        print(f"[scheduler] watching inbound transfers every {SCHED_POLL_SECONDS}s; "
+              f"social jobs: {', '.join(f'{j.name}/{int(j.every)}s' for j in self.social) or 'none'}")
+        while True:
+            self.tick()
+            time.sleep(SCHED_POLL_SECONDS)
+
+
+def build_agent_scheduler() -> Scheduler:
+    """The scheduler wired to agent.py's jobs."""
+    import agent
+
+    def after_clean(sold):
+        agent.sell_updates(sold, run_count=agent.next_run_count())
+
+    social = [
+        Job("heartbeat", agent.moltbook_heartbeat, SCHED_HEARTBEAT_SECONDS),
+        Job("promotion", agent.promotion_post, SCHED_PROMOTION_SECONDS),
+        Job("comment_replies", agent.comment_replies, SCHED_REPLIES_SECONDS),
+        Job("dm_replies", agent.dm_replies, SCHED_DMS_SECONDS),
+        Job("bets", agent.bet_simulation, SCHED_BETS_SECONDS),
+    ]
+    return Scheduler(agent.w3, agent.address, agent.clean_dust, social, after_clean)
+
+
+if __name__ == "__main__":
+    build_agent_scheduler().run_forever()
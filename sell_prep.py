@@ -0,0 +1,365 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from web3 import Web3
+
+import metrics
+import shared_cache
+from calldata import encode_approve, encode_sell
+from multicall import (
+    MULTICALL_BATCH_SIZE,
+    aggregate3_async,
+    allowance_call,
+    balance_of_call,
+    block_number_call,
+    decimals_call,
+    symbol_call,
+    lens_sell_quote_call,
+    decode_uint,
+    decode_symbol,
+    decode_amount_out,
+)
+
+PREPARE_BATCH_MAX_TOKENS = int(os.getenv("PREPARE_BATCH_MAX_TOKENS", "100"))
+CHAIN_ID = int(os.getenv("CHAIN_ID", "143"))  # Monad mainnet
+BUNDLE_ATOMIC_REQUIRED = os.getenv("BUNDLE_ATOMIC_REQUIRED", "false").lower() == "true"
+
+
+def _known_routers() -> List[str]:
+    """
+    Routers whose allowance we read up-front (the Lens picks one per token).
+    NADFUN_ROUTERS=0xCurveRouter,0xDexRouter  (falls back to NADFUN_ROUTER_ADDRESS)
+    """
+    raw = os.getenv("NADFUN_ROUTERS", "") or os.getenv("NADFUN_ROUTER_ADDRESS", "")
+    out = []
+    for r in raw.split(","):
+        r = r.strip()
+        if r.startswith("0x") and len(r) == 42:
+            out.append(Web3.to_checksum_address(r))
+    return out
+
+
+def _encode_sell_pair(token_cs: str, wallet_cs: str, router_cs: str, amount_in: int, min_out: int, deadline: int):
+    """approve(router, amount_in) + router.sell((amount_in, min_out, token, wallet, deadline)) calldata."""
+    approve_data = encode_approve(router_cs, amount_in)
+    sell_data = encode_sell(amount_in, min_out, token_cs, wallet_cs, deadline)
+    return approve_data, sell_data
+
+
+# -----------------------
+# Batched reads
+# -----------------------
+
+def _cached_meta(tokens: List[str]) -> Dict[str, dict]:
+    """decimals/symbol never change, so any worker's earlier read is good (shared cache)."""
+    hits = shared_cache.get_many(f"meta:{t.lower()}" for t in tokens)
+    return {t: hits[f"meta:{t.lower()}"] for t in tokens if f"meta:{t.lower()}" in hits}
+
+
+async def _read_state(aw3, wallet_cs: str, tokens: List[str]) -> Tuple[int, Dict[str, dict]]:
+    """
+    Round 1: balanceOf, allowance (per known router), plus decimals and symbol
+    for tokens not in the shared cache, and the block number. One eth_call
+    unless that is more than MULTICALL_BATCH_SIZE calls; then the first batch
+    tells us the block and the rest go out concurrently, pinned to it.
+    Returns (block, {token: {"balance", "decimals", "symbol", "allowances"}}).
+    """
+    routers = _known_routers()
+    meta = await asyncio.to_thread(_cached_meta, tokens)  # SQLite stays off the event loop
+
+    calls = [block_number_call()]
+    layout = []  # per token: (start index, reads metadata?)
+    for t in tokens:
+        layout.append((len(calls), t not in meta))
+        calls.append(balance_of_call(t, wallet_cs))
+        calls += [allowance_call(t, wallet_cs, r) for r in routers]
+        if t not in meta:
+            calls += [decimals_call(t), symbol_call(t)]
+
+    # everything from the same block, so balances, allowances and quotes agree
+    # (balance + metadata share the batches, so they share one stage timer)
+    with metrics.stage("balance"):
+        first = calls[:MULTICALL_BATCH_SIZE]
+        res = await aggregate3_async(aw3, first)
+        block = decode_uint(res[0])
+        if len(calls) > len(first):
+            res += await aggregate3_async(aw3, calls[len(first):], block_identifier=block)
+
+    state: Dict[str, dict] = {}
+    fresh_meta = []
+    for t, (start, reads_meta) in zip(tokens, layout):
+        allowances = res[start + 1:start + 1 + len(routers)]
+        if reads_meta:
+            dec = decode_uint(res[start + 1 + len(routers)])
+            sym = decode_symbol(res[start + 2 + len(routers)])
+            if dec is not None and dec <= 255 and sym is not None:
+                fresh_meta.append((f"meta:{t.lower()}", {"decimals": dec, "symbol": sym},
+                                   shared_cache.META_TTL_SECONDS, None))
+        else:
+            dec, sym = meta[t]["decimals"], meta[t]["symbol"]
+        state[t] = {
+            "balance": decode_uint(res[start]) or 0,
+            "decimals": dec if dec is not None and dec <= 255 else 18,
+            "symbol": sym or "UNKNOWN",
+            "allowances": {r: decode_uint(a) for r, a in zip(routers, allowances)},
+        }
+    if fresh_meta:
+        shared_cache.write_behind(shared_cache.set_many, fresh_meta)
+    return block, state
+
+
+async def _quote_all(aw3, lens_cs: str, amounts: List[Tuple[str, int]], block: int) -> List[Optional[Tuple[str, int]]]:
+    """
+    Round 2: Lens sell quotes for (token, amount) pairs, pinned to `block`.
+    A quote for the same (token, amount) at the same block from any worker is
+    reused; only the misses go to the chain (no round trip at all if none).
+    """
+    keys = [f"quote:{lens_cs.lower()}:{t.lower()}:{amt}" for t, amt in amounts]
+    cached = await asyncio.to_thread(shared_cache.get_many, keys)
+
+    out: List[Optional[Tuple[str, int]]] = [None] * len(amounts)
+    todo = []
+    for i, k in enumerate(keys):
+        hit = cached.get(k)
+        if hit is not None and hit[0] == block:
+            out[i] = (hit[1], int(hit[2])) if hit[1] else None
+        else:
+            todo.append(i)
+    if not todo:
+        return out
+
+    with metrics.stage("quote"):
+        res = await aggregate3_async(
+            aw3, [lens_sell_quote_call(lens_cs, *amounts[i]) for i in todo], block_identifier=block,
+        )
+    fresh = []
+    for i, r in zip(todo, res):
+        out[i] = decode_amount_out(r)
+        router, mon_out = out[i] or (None, 0)
+        fresh.append((keys[i], [block, router, str(mon_out)], shared_cache.QUOTE_TTL_SECONDS, block))
+    shared_cache.write_behind(shared_cache.set_many, fresh)
+    return out
+
+
+def _build_item(wallet: str, wallet_cs: str, token_cs: str, st: dict, quote: Tuple[str, int],
+                block: int, slippage_bps: int, deadline: int) -> Dict[str, Any]:
+    """Calldata is built locally from values already read; no RPC here."""
+    bal = st["balance"]
+    decimals = st["decimals"]
+    router_cs, mon_out = quote
+    min_out = mon_out * (10_000 - slippage_bps) // 10_000
+    approve_data, sell_data = _encode_sell_pair(token_cs, wallet_cs, router_cs, bal, min_out, deadline)
+
+    allowance = st["allowances"].get(router_cs)
+    return {
+        "source": "prepare_sell_calldata_via_lens",
+        "wallet": wallet,
+        "token": token_cs,
+        "symbol": st["symbol"],
+        "decimals": decimals,
+        "amount_raw": str(bal),
+        "amount_display": float(bal) / (10 ** decimals),
+        "router": router_cs,
+        "quote_mon_out_raw": str(mon_out),
+        "min_out_raw": str(min_out),
+        "block": block,
+        # None = router not in NADFUN_ROUTERS, so we couldn't pre-read it
+        "allowance_raw": None if allowance is None else str(allowance),
+        "approve_needed": allowance is None or allowance < bal,
+        "approve": {"to": token_cs, "data": approve_data, "value": "0x0"},
+        "sell": {"to": router_cs, "data": sell_data, "value": "0x0"},
+        "notes": [],
+    }
+
+
+def _sell_config():
+    slippage_bps = int(os.getenv("SLIPPAGE_BPS", "200"))  # 2%
+    deadline_seconds = int(os.getenv("SELL_DEADLINE_SECONDS", "300"))  # 5 min
+    return slippage_bps, int(time.time()) + deadline_seconds
+
+
+# -----------------------
+# Single token (/prepare-sell)
+# -----------------------
+
+async def prepare_sell_single_pass_async(aw3, wallet: str, token: str) -> Dict[str, Any]:
+    """
+    /prepare-sell in (at most) two RPC round trips:
+      1) balance + allowances + block number (+ decimals/symbol if not cached), one multicall
+      2) Lens quote for the full balance at that same block (skipped on a shared-cache hit)
+    """
+    def _error(source, notes, **extra):
+        out = {
+            "source": source,
+            "wallet": wallet,
+            "token": token,
+            "notes": notes,
+            "approve": {"to": token, "data": "0x", "value": "0x0"},
+            "sell": {"to": "", "data": "0x", "value": "0x0"},
+        }
+        out.update(extra)
+        return out
+
+    lens_addr = os.getenv("NADFUN_LENS")
+    if not lens_addr:
+        return _error("error_missing_lens", ["NADFUN_LENS is not set in .env / Render env vars"])
+
+    wallet_cs = Web3.to_checksum_address(wallet)
+    token_cs = Web3.to_checksum_address(token)
+
+    block, state = await _read_state(aw3, wallet_cs, [token_cs])
+    st = state[token_cs]
+
+    if st["balance"] <= 0:
+        return _error(
+            "error_zero_balance", ["Token balance is 0, nothing to sell"],
+            symbol=st["symbol"], decimals=st["decimals"], amount_raw="0", amount_display=0,
+        )
+
+    (quote,) = await _quote_all(aw3, Web3.to_checksum_address(lens_addr), [(token_cs, st["balance"])], block)
+    if not quote or quote[1] <= 0:
+        return _error(
+            "error_no_mon_output", ["No MON output from quote"],
+            symbol=st["symbol"], decimals=st["decimals"], amount_raw=str(st["balance"]),
+            amount_display=float(st["balance"]) / (10 ** st["decimals"]),
+        )
+
+    slippage_bps, deadline = _sell_config()
+    item = _build_item(wallet, wallet_cs, token_cs, st, quote, block, slippage_bps, deadline)
+    item["token"] = token
+    return item
+
+
+# -----------------------
+# Many tokens (/prepare-sell-batch)
+# -----------------------
+
+async def prepare_sells_batch_async(aw3, wallet: str, tokens: List[str]) -> Dict[str, Any]:
+    """
+    approve/sell calldata for many tokens at once, same two rounds as the
+    single-token path. Items are ordered by MON out (best first).
+    """
+    lens_addr = os.getenv("NADFUN_LENS")
+    if not lens_addr:
+        return {
+            "source": "error_missing_lens",
+            "wallet": wallet,
+            "count": 0,
+            "items": [],
+            "skipped": [],
+            "notes": ["NADFUN_LENS is not set in .env / Render env vars"],
+        }
+
+    wallet_cs = Web3.to_checksum_address(wallet)
+    lens_cs = Web3.to_checksum_address(lens_addr)
+
+    notes: List[str] = []
+    skipped: List[Dict[str, str]] = []
+
+    # de-dupe, keep caller order
+    seen = set()
+    token_list: List[str] = []
+    for t in tokens:
+        try:
+            cs = Web3.to_checksum_address(t)
+        except Exception:
+            skipped.append({"token": str(t), "reason": "invalid_address"})
+            continue
+        if cs not in seen:
+            seen.add(cs)
+            token_list.append(cs)
+
+    if len(token_list) > PREPARE_BATCH_MAX_TOKENS:
+        notes.append(f"Truncated to PREPARE_BATCH_MAX_TOKENS={PREPARE_BATCH_MAX_TOKENS}")
+        token_list = token_list[:PREPARE_BATCH_MAX_TOKENS]
+
+    if not token_list:
+        return {"source": "prepare_sell_batch", "wallet": wallet, "block": None, "count": 0,
+                "items": [], "skipped": skipped, "notes": notes}
+
+    block, state = await _read_state(aw3, wallet_cs, token_list)
+
+    held = []
+    for t in token_list:
+        if state[t]["balance"] <= 0:
+            skipped.append({"token": t, "reason": "zero_balance"})
+        else:
+            held.append(t)
+
+    quotes = await _quote_all(aw3, lens_cs, [(t, state[t]["balance"]) for t in held], block)
+
+    slippage_bps, deadline = _sell_config()
+    items = []
+    for t, quote in zip(held, quotes):
+        if not quote or quote[1] <= 0:
+            skipped.append({"token": t, "reason": "no_mon_output"})
+            continue
+        items.append(_build_item(wallet, wallet_cs, t, state[t], quote, block, slippage_bps, deadline))
+
+    items.sort(key=lambda x: int(x["quote_mon_out_raw"]), reverse=True)
+
+    return {
+        "source": "prepare_sell_batch",
+        "wallet": wallet,
+        "block": block,
+        "count": len(items),
+        "items": items,
+        "skipped": skipped,
+        "notes": notes,
+    }
+
+
+# -----------------------
+# One wallet prompt (/prepare-sell-batch, format="wallet_sendCalls")
+# -----------------------
+
+def build_send_calls_bundle(batch: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turns a prepare_sells_batch_async result into a single EIP-5792
+    wallet_sendCalls request: [approve?, sell] per token, best quote first.
+    Every quote and min_out in it comes from the same block (batch["block"]).
+    The approve is left out when the wallet's allowance already covers the sell.
+    """
+    calls = []
+    items = []
+    for it in batch.get("items", []):
+        if it["approve_needed"]:
+            calls.append(it["approve"])
+        calls.append(it["sell"])
+        items.append({
+            "token": it["token"],
+            "symbol": it["symbol"],
+            "amount_raw": it["amount_raw"],
+            "router": it["router"],
+            "quote_mon_out_raw": it["quote_mon_out_raw"],
+            "min_out_raw": it["min_out_raw"],
+            "approve_included": it["approve_needed"],
+        })
+
+    out = {
+        "source": "prepare_sell_bundle" if batch.get("source") == "prepare_sell_batch" else batch.get("source"),
+        "wallet": batch.get("wallet"),
+        "block": batch.get("block"),
+        "count": len(items),
+        "items": items,
+        "skipped": batch.get("skipped", []),
+        "notes": list(batch.get("notes", [])),
+        "wallet_sendCalls": None,
+    }
+    if not calls:
+        return out
+
+    # atomicRequired=false lets wallets without atomic batching run the calls
+    # in order; each sell still only needs its own approve before it
+    out["wallet_sendCalls"] = {
+        "version": "2.0.0",
+        "chainId": hex(CHAIN_ID),
+        "from": Web3.to_checksum_address(batch["wallet"]),
+        "atomicRequired": BUNDLE_ATOMIC_REQUIRED,
+        "calls": calls,
+    }
+    out["notes"].append(f"{len(calls)} calls, min_out at {_sell_config()[0]} bps slippage, "
+                        f"quotes from block {batch.get('block')}")
+    return out
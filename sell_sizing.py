@@ -0,0 +1,141 @@
+"""
+Sell sizing from the Lens price curve (replaces the fixed SWAP_FRACTION).
+
+For each token the Lens getAmountOut is sampled at a ladder of sizes
+(SELL_LADDER, fractions of the balance), all tokens in one Multicall (tokens
+still on their bonding curve are quoted locally by curve_model). The
+samples give a piecewise-linear proceeds curve out(a); its slope per segment
+is the marginal price, and the first segment stands in for the spot price p0.
+
+The chosen size maximizes proceeds net of gas,  out(a) - gas,  subject to the
+slippage budget: the average price may not fall more than
+SELL_IMPACT_BUDGET_BPS below p0. Proceeds grow with size, so that is the
+largest size inside the budget; when the budget runs out between two rungs
+the boundary is solved on the linear segment. A size whose proceeds don't
+cover gas is not sold at all.
+
+Curves from AMMs / bonding curves are concave, so the chord between two rungs
+under-estimates out(a): an interpolated quote is a safe floor for
+amount_out_min. Pure integer math over ~8 points per token; no numpy needed.
+"""
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from curve_model import quote_sells
+
+SELL_SIZING_ENABLED = os.getenv("SELL_SIZING_ENABLED", "true").lower() == "true"
+SELL_LADDER = tuple(sorted(float(x) for x in os.getenv("SELL_LADDER", "0.02,0.05,0.1,0.2,0.35,0.5,0.75,1").split(",")))
+SELL_IMPACT_BUDGET_BPS = int(os.getenv("SELL_IMPACT_BUDGET_BPS", "500"))
+
+Point = Tuple[int, int]  # (amount_in, mon_out)
+
+
+def _impact_bps(p0_num: int, p0_den: int, a: int, out: int) -> int:
+    """How far the average price out/a sits below p0 = p0_num/p0_den, in bps."""
+    if a <= 0:
+        return 0
+    return max(0, 10_000 - out * p0_den * 10_000 // (a * p0_num))
+
+
+def best_size(points: Sequence[Point], gas_cost_wei: int, budget_bps: int = SELL_IMPACT_BUDGET_BPS) -> Optional[dict]:
+    """
+    points: ladder samples (amount_in, mon_out), any order. Returns
+    {"amount_in", "mon_out", "impact_bps", "net_wei", "marginal"} or None when
+    no size inside the budget covers gas.
+    """
+    pts = sorted((int(a), int(o)) for a, o in points if a > 0 and o > 0)
+    if not pts:
+        return None
+    p0_num, p0_den = pts[0][1], pts[0][0]  # smallest rung ~ spot price
+
+    # marginal price per segment (MON wei per token unit), for reporting / diagnostics
+    marginal = []
+    prev_a, prev_o = 0, 0
+    for a, o in pts:
+        marginal.append((o - prev_o) / (a - prev_a) if a > prev_a else 0.0)
+        prev_a, prev_o = a, o
+
+    best = None
+    prev = (0, 0)
+    for a, o in pts:
+        if _impact_bps(p0_num, p0_den, a, o) <= budget_bps:
+            best = (a, o)
+            prev = (a, o)
+            continue
+        # budget runs out on the segment prev -> (a, o): solve for the boundary
+        pa, po = prev
+        lo, hi = pa, a
+        while hi - lo > max(1, a // 10_000):
+            mid = (lo + hi) // 2
+            mo = po + (o - po) * (mid - pa) // (a - pa)
+            if _impact_bps(p0_num, p0_den, mid, mo) <= budget_bps:
+                lo = mid
+            else:
+                hi = mid
+        if lo > pa:
+            best = (lo, po + (o - po) * (lo - pa) // (a - pa))
+        break
+
+    if best is None or best[1] <= gas_cost_wei:
+        return None
+    a, o = best
+    return {
+        "amount_in": a,
+        "mon_out": o,
+        "impact_bps": _impact_bps(p0_num, p0_den, a, o),
+        "net_wei": o - gas_cost_wei,
+        "marginal": marginal,
+    }
+
+
+def ladder(balance: int) -> List[int]:
+    # fractions as bps so large balances stay exact
+    return sorted({max(1, balance * round(f * 10_000) // 10_000) for f in SELL_LADDER if f > 0})
+
+
+def size_sells(w3, lens: str, holdings: Sequence[Tuple[str, int]], gas_cost_wei: int) -> Dict[str, Optional[dict]]:
+    """
+    holdings: [(token, balance)]. One Multicall for every ladder of every token
+    (curve tokens are priced from their curve state instead, see curve_model).
+    Returns {token: best_size(...) + {"router"}} (None = not worth selling).
+    """
+    index = [(token, amt) for token, balance in holdings for amt in ladder(int(balance))]
+    quotes = quote_sells(w3, lens, index)
+
+    samples: Dict[str, List[Tuple[int, int, str]]] = {t: [] for t, _ in holdings}
+    for (token, amt), q in zip(index, quotes):
+        if q is not None and q[1] > 0:
+            samples[token].append((amt, q[1], q[0]))
+
+    out: Dict[str, Optional[dict]] = {}
+    for token, rows in samples.items():
+        size = best_size([(a, o) for a, o, _ in rows], gas_cost_wei)
+        if size is not None:
+            # router the Lens picked at the nearest sampled size at or below the choice
+            size["router"] = max((r for r in rows if r[0] <= size["amount_in"]), key=lambda r: r[0])[2]
+        out[token] = size
+    return out
+
+
+if __name__ == "__main__":
+    # Self-check on a constant-product curve: out = R_mon * a / (R_tok + a)
+    def cp(a, r_tok=10 ** 24, r_mon=10 ** 21):
+        return r_mon * a // (r_tok + a)
+
+    def pts(balance):
+        return [(a, cp(a)) for a in ladder(balance)]
+
+    # tiny holding vs. reserves: no impact, sell it all
+    small = best_size(pts(10 ** 20), gas_cost_wei=10 ** 15)
+    assert small["amount_in"] == 10 ** 20 and small["impact_bps"] < 5
+
+    # large holding: stop where the average price is ~5% under spot
+    big = best_size(pts(10 ** 24), gas_cost_wei=10 ** 15, budget_bps=500)
+    assert 0 < big["amount_in"] < 10 ** 24
+    assert 480 <= big["impact_bps"] <= 500, big["impact_bps"]
+    assert big["mon_out"] <= cp(big["amount_in"])  # chord stays under a concave curve
+
+    # proceeds below gas: don't sell
+    assert best_size(pts(10 ** 12), gas_cost_wei=10 ** 15) is None
+    assert best_size([], gas_cost_wei=0) is None
+    print("sell_sizing: ok", {k: v for k, v in big.items() if k != "marginal"})
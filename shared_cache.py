@@ -0,0 +1,343 @@
+"""
+Cache shared by every uvicorn worker (and the agent / warmer processes on the
+same host): one SQLite file in WAL mode, plus a small per-process L1 in front.
+
+  get(key) / get_many(keys)            -> value (JSON-able) or None
+  set(key, value, ttl, version)        -> True if stored
+  set_many([(key, value, ttl, version)])
+  incr(key, n) / counters(prefix)      -> shared counters (no TTL)
+  write_behind(fn, *args)              -> queue a set_many / incr_many (async callers)
+
+Writes are set-if-newer: an entry is only replaced by one with a higher
+`version` (block number for chain reads, time.time() by default), unless the
+stored one has already expired. The table is bounded by
+SHARED_CACHE_MAX_ENTRIES; expired rows go first, then the oldest writes.
+
+All of these block (a write may wait up to 2s on the SQLite lock), so code
+running on an event loop reads through asyncio.to_thread and queues writes
+with write_behind, which applies them in order on one background thread.
+
+Every call swallows SQLite errors and behaves like a miss: the cache must
+never take a request down with it.
+
+Key prefixes in use:
+  meta:<token>                  {"decimals", "symbol"}   (immutable, long TTL)
+  quote:<lens>:<token>:<amount> [block, router, mon_out] (version = block)
+  warm:<token>, warm:status     cache_warmer.py
+  holds:<token>                 counter, cache_warmer.py
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import metrics
+
+SHARED_CACHE_FILE = os.getenv("SHARED_CACHE_FILE", "shared_cache.db")
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "200000"))
+SHARED_CACHE_L1_SIZE = int(os.getenv("SHARED_CACHE_L1_SIZE", "4096"))
+SHARED_CACHE_L1_SECONDS = float(os.getenv("SHARED_CACHE_L1_SECONDS", "2"))  # bounds cross-worker staleness
+DEFAULT_TTL_SECONDS = float(os.getenv("SHARED_CACHE_DEFAULT_TTL_SECONDS", "300"))
+META_TTL_SECONDS = float(os.getenv("SHARED_CACHE_META_TTL_SECONDS", str(7 * 24 * 3600)))
+QUOTE_TTL_SECONDS = float(os.getenv("SHARED_CACHE_QUOTE_TTL_SECONDS", "30"))
+
+_EVICT_EVERY = 500  # sets between eviction sweeps
+
+_local = threading.local()
+_l1: "OrderedDict[str, Tuple[Any, float]]" = OrderedDict()
+_l1_lock = threading.Lock()
+_sets_since_evict = 0
+_writer: Optional[ThreadPoolExecutor] = None
+_writer_lock = threading.Lock()
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key        TEXT PRIMARY KEY,
+    value      TEXT NOT NULL,
+    version    REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    written_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_expires ON cache(expires_at);
+CREATE INDEX IF NOT EXISTS cache_written ON cache(written_at);
+CREATE TABLE IF NOT EXISTS counters (
+    key TEXT PRIMARY KEY,
+    n   INTEGER NOT NULL
+);
+"""
+
+_UPSERT = """
+INSERT INTO cache (key, value, version, expires_at, written_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(key) DO UPDATE SET
+    value = excluded.value, version = excluded.version,
+    expires_at = excluded.expires_at, written_at = excluded.written_at
+WHERE excluded.version > cache.version OR cache.expires_at <= excluded.written_at
+"""
+
+
+def _conn() -> Optional[sqlite3.Connection]:
+    """One connection per thread (sqlite3 connections aren't shareable across threads)."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == SHARED_CACHE_FILE:
+        return conn
+    try:
+        conn = sqlite3.connect(SHARED_CACHE_FILE, timeout=2.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA)
+    except sqlite3.Error as e:
+        print("Shared cache unavailable:", e)
+        return None
+    _local.conn = conn
+    _local.path = SHARED_CACHE_FILE
+    return conn
+
+
+# -----------------------
+# L1
+# -----------------------
+
+def _l1_get(key: str, now: float):
+    with _l1_lock:
+        hit = _l1.get(key)
+        if hit is None:
+            return None
+        if hit[1] <= now:
+            del _l1[key]
+            return None
+        _l1.move_to_end(key)
+        return hit
+
+
+def _l1_put(key: str, value: Any, expires_at: float, now: float) -> None:
+    with _l1_lock:
+        _l1[key] = (value, min(expires_at, now + SHARED_CACHE_L1_SECONDS))
+        _l1.move_to_end(key)
+        while len(_l1) > SHARED_CACHE_L1_SIZE:
+            _l1.popitem(last=False)
+
+
+def clear_l1() -> None:
+    with _l1_lock:
+        _l1.clear()
+
+
+# -----------------------
+# Reads
+# -----------------------
+
+def get_many(keys: Iterable[str]) -> Dict[str, Any]:
+    """Present, unexpired keys only."""
+    now = time.time()
+    out: Dict[str, Any] = {}
+    missing: List[str] = []
+    for k in dict.fromkeys(keys):
+        hit = _l1_get(k, now)
+        if hit is not None:
+            out[k] = hit[0]
+        else:
+            missing.append(k)
+    metrics.CACHE_REQUESTS.inc("shared_l1", "hit", n=len(out))
+    metrics.CACHE_REQUESTS.inc("shared_l1", "miss", n=len(missing))
+    if not missing:
+        return out
+
+    conn = _conn()
+    found = 0
+    if conn is not None:
+        try:
+            for i in range(0, len(missing), 500):  # SQLite parameter limit
+                chunk = missing[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT key, value, expires_at FROM cache WHERE key IN ({','.join('?' * len(chunk))}) AND expires_at > ?",
+                    (*chunk, now),
+                ).fetchall()
+                for k, raw, expires_at in rows:
+                    value = json.loads(raw)
+                    out[k] = value
+                    _l1_put(k, value, expires_at, now)
+                    found += 1
+        except (sqlite3.Error, ValueError):
+            pass
+    metrics.CACHE_REQUESTS.inc("shared", "hit", n=found)
+    metrics.CACHE_REQUESTS.inc("shared", "miss", n=len(missing) - found)
+    return out
+
+
+def get(key: str, default: Any = None) -> Any:
+    return get_many([key]).get(key, default)
+
+
+# -----------------------
+# Writes
+# -----------------------
+
+def set_many(items: Iterable[Tuple[str, Any, Optional[float], Optional[float]]]) -> int:
+    """items: (key, value, ttl_seconds or None, version or None). Returns rows stored."""
+    global _sets_since_evict
+    now = time.time()
+    rows = []
+    for key, value, ttl, version in items:
+        expires_at = now + (DEFAULT_TTL_SECONDS if ttl is None else ttl)
+        rows.append((key, json.dumps(value, separators=(",", ":")), now if version is None else float(version),
+                     expires_at, now))
+    if not rows:
+        return 0
+
+    conn = _conn()
+    if conn is None:
+        return 0
+    try:
+        before = conn.total_changes
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(_UPSERT, rows)
+        stored = conn.total_changes - before
+    except sqlite3.Error:
+        return 0
+
+    # drop local copies; the next read picks up whichever write won
+    with _l1_lock:
+        for key, *_ in rows:
+            _l1.pop(key, None)
+
+    _sets_since_evict += len(rows)
+    if _sets_since_evict >= _EVICT_EVERY:
+        _sets_since_evict = 0
+        evict()
+    return stored
+
+
+def set(key: str, value: Any, ttl: Optional[float] = None, version: Optional[float] = None) -> bool:
+    return set_many([(key, value, ttl, version)]) > 0
+
+
+def evict() -> None:
+    """Drop expired rows, then the oldest writes beyond SHARED_CACHE_MAX_ENTRIES."""
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+            (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            extra = count - SHARED_CACHE_MAX_ENTRIES
+            if extra > 0:
+                conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY written_at LIMIT ?)", (extra,)
+                )
+    except sqlite3.Error:
+        pass
+
+
+# -----------------------
+# Counters
+# -----------------------
+
+def incr_many(keys: Iterable[str], n: int = 1) -> None:
+    conn = _conn()
+    if conn is None:
+        return
+    try:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT INTO counters (key, n) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET n = n + excluded.n",
+                [(k, n) for k in keys],
+            )
+    except sqlite3.Error:
+        pass
+
+
+def incr(key: str, n: int = 1) -> None:
+    incr_many([key], n)
+
+
+def counters(prefix: str) -> Dict[str, int]:
+    """All counters under `prefix`, keyed by the rest of the key."""
+    conn = _conn()
+    if conn is None:
+        return {}
+    try:
+        rows = conn.execute(
+            "SELECT key, n FROM counters WHERE key >= ? AND key < ?", (prefix, prefix + "\uffff")
+        ).fetchall()
+    except sqlite3.Error:
+        return {}
+    return {k[len(prefix):]: n for k, n in rows}
+
+
+# -----------------------
+# Write-behind (event-loop callers)
+# -----------------------
+
+def _report_write(fut) -> None:
+    if fut.exception() is not None:
+        print("Shared cache write failed:", fut.exception())
+
+
+def write_behind(fn, *args) -> None:
+    """
+    Runs fn(*args) (set_many, incr_many, ...) on the cache writer thread and
+    returns at once. Pass lists, not generators or objects you keep changing.
+    """
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache-writer")
+    _writer.submit(fn, *args).add_done_callback(_report_write)
+
+
+def flush_writes(timeout: float = 5.0) -> None:
+    """Waits for queued write_behind calls (tests, shutdown)."""
+    if _writer is not None:
+        _writer.submit(lambda: None).result(timeout=timeout)
+
+
+if __name__ == "__main__":
+    # Quick self-check against a throwaway file
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+
+    SHARED_CACHE_FILE = os.path.join(tempfile.mkdtemp(), "cache.db")
+
+    assert set("k", {"a": 1}, ttl=60, version=10)
+    assert get("k") == {"a": 1}
+    assert not set("k", {"a": 0}, ttl=60, version=9)  # older version loses
+    clear_l1()
+    assert get("k") == {"a": 1}
+    assert set("k", {"a": 2}, ttl=60, version=11)
+    assert get("k") == {"a": 2}
+    set("gone", 1, ttl=-1)
+    assert get("gone") is None
+    assert set("gone", 2, ttl=60, version=0)  # expired rows can be overwritten by anything
+
+    SHARED_CACHE_MAX_ENTRIES = 100
+    set_many((f"e{i}", i, 60, None) for i in range(300))
+    evict()
+    (n,) = _conn().execute("SELECT COUNT(*) FROM cache").fetchone()
+    assert n == 100, n
+
+    # counters from several processes
+    def _bump(path):
+        global SHARED_CACHE_FILE
+        SHARED_CACHE_FILE = path
+        for _ in range(50):
+            incr("holds:0xabc")
+        return True
+
+    with ProcessPoolExecutor(4) as ex:
+        list(ex.map(_bump, [SHARED_CACHE_FILE] * 4))
+    assert counters("holds:") == {"0xabc": 200}, counters("holds:")
+
+    write_behind(set_many, [(f"w{i}", i, 60, None) for i in range(3)])
+    write_behind(incr_many, [f"holds:0x{i}" for i in range(3)])
+    flush_writes()
+    assert get_many(["w0", "w1", "w2"]) == {"w0": 0, "w1": 1, "w2": 2}
+    assert counters("holds:0x")["1"] == 1
+    print("shared_cache: ok")
@@ -9,7 +9,20 @@ from erc20_abi import ERC20_ABI
 from token_discovery import discover_token_contracts_incremental
 from liquidity_checker import can_swap_simulation
 from stage2_public_clean import _quote_token_to_mon  # reuse your working quote helper
-from swap_executor import execute_safe_swap
+from nonce_manager import get_nonce_manager
+import swap_journal
+import preflight
+import sell_sizing
+from receipt_tracker import get_receipt_tracker
+from swap_executor import (
+    LENS, SAFE_MODE, SELL_CONFIRM_TIMEOUT_SECONDS, SELL_GAS_LIMIT, fee_quote, forget_gas, plan_swap, record_sell_receipt, submit_plan,
+)
+
+# Pipelined cleaning: how many of our txs may be unconfirmed at once, and how
+# many new ones we broadcast per block (keeps one run from flooding the mempool)
+MAX_INFLIGHT_TXS = int(os.getenv("MAX_INFLIGHT_TXS", "16"))
+MAX_TXS_PER_BLOCK = int(os.getenv("MAX_TXS_PER_BLOCK", "8"))
+PIPELINE_POLL_SECONDS = float(os.getenv("PIPELINE_POLL_SECONDS", "0.5"))
 
 
 def _to_checksum(addr: str) -> str:
@@ -118,32 +131,192 @@ def scan_wallet_dust(w3: Web3, wallet: str) -> Dict[str, Any]:
     return report
 
 
-def run_stage2_cleaning(w3: Web3, account, wallet: str) -> Dict[str, Any]:
+def run_stage2_cleaning(w3: Web3, account, wallet: str, on_result=None) -> Dict[str, Any]:
     """
     - Scans wallet
-    - Executes swaps for dust tokens (bounded by MAX_SWAPS_PER_RUN)
+    - Sizes every sell from Lens ladder quotes in one multicall (sell_sizing.py)
+    - Plans a sell for each dust token (bounded by MAX_SWAPS_PER_RUN)
+    - Simulates all planned sells in one batch (preflight.py) and drops predicted reverts
+    - Pipelines the rest: approve/sell pairs go out on consecutive nonces, at most
+      MAX_TXS_PER_BLOCK new txs per block and MAX_INFLIGHT_TXS unconfirmed,
+      while receipts are tracked for everything in flight
+    - Reports each token as it confirms (rep["swaps"], and on_result(outcome) if given)
     """
     rep = scan_wallet_dust(w3, wallet)
+    rep["swaps"] = []
 
-    swaps_done = 0
-    for t in rep.get("dust", []):
-        if swaps_done >= int(os.getenv("MAX_SWAPS_PER_RUN", "2")):
-            break
+    def _report(outcome):
+        rep["swaps"].append(outcome)
+        if on_result is not None:
+            on_result(outcome)
 
-        try:
-            # execute_safe_swap expects token dict; we provide raw_balance + mon_value
-            execute_safe_swap(w3, account, t)
-            swaps_done += 1
+    max_swaps = int(os.getenv("MAX_SWAPS_PER_RUN", "25"))
+    dust = rep.get("dust", [])[:max_swaps]
 
-            # cooldown between swaps
-            time.sleep(int(os.getenv("SWAP_COOLDOWN_SEC", "10")))
+    # one multicall: Lens ladder quotes for every token, sized against the slippage budget
+    if sell_sizing.SELL_SIZING_ENABLED and dust:
+        try:
+            held = [t for t in dust if int(t.get("raw_balance") or 0) > 0]
+            sizes = sell_sizing.size_sells(
+                w3, LENS, [(_to_checksum(t["contract"]), int(t["raw_balance"])) for t in held],
+                fee_quote(w3) * SELL_GAS_LIMIT,
+            )
+            for t in held:
+                t["sell_size"] = sizes.get(_to_checksum(t["contract"]))
         except Exception as e:
-            rep.setdefault("notes", []).append(f"Swap failed {t.get('symbol')}: {e}")
+            rep.setdefault("notes", []).append(f"Sell sizing failed: {e}")
 
-    rep["swaps_done"] = swaps_done
+    plans = []
+    for t in dust:
+        try:
+            plan = plan_swap(w3, account, t)
+        except Exception as e:
+            rep.setdefault("notes", []).append(f"Plan failed {t.get('symbol')}: {e}")
+            continue
+        if plan is None:
+            continue
+        if SAFE_MODE:
+            print(f"SAFE MODE: would SELL {plan['symbol']} -> MON | amount_in={plan['amount_in']} | expected MON out={plan['mon_out']} | min_out={plan['amount_out_min']}")
+            _report({"symbol": plan["symbol"], "contract": plan["contract"], "status": "safe_mode"})
+            continue
+        plans.append(plan)
+
+    if plans:
+        # one batched simulation for every planned sell; predicted reverts never get broadcast
+        plans, dropped = preflight.check(w3, account, plans, LENS)
+        for plan, reason in dropped:
+            _report({"symbol": plan["symbol"], "contract": plan["contract"], "status": "preflight_dropped",
+                     "error": reason})
+    if plans:
+        _run_pipeline(w3, account, plans, _report)
+
+    rep["swaps_done"] = sum(1 for o in rep["swaps"] if o["status"] == "confirmed")
     return rep
 
 
+def _run_pipeline(w3: Web3, account, plans: List[Dict[str, Any]], report) -> None:
+    nm = get_nonce_manager(w3, account.address)
+    tracker = get_receipt_tracker(w3)
+    bumped = set()  # nonces already replaced this run
+    queue = list(plans)
+    inflight: List[Dict[str, Any]] = []  # {"plan", "sent", "receipt" (future), "since", "bumped"}
+    block = None
+    sent_this_block = 0
+    gas_price = None
+
+    while queue or inflight:
+        # one block poll per loop; on a new block the tracker fetches every in-flight receipt in one batch
+        try:
+            current = tracker.poll()
+        except Exception as e:
+            print(f"Block poll failed: {e}")
+            time.sleep(PIPELINE_POLL_SECONDS)
+            continue
+        if current != block:
+            block, sent_this_block = current, 0
+            try:
+                gas_price = fee_quote(w3, max_age=0)  # one fee quote per block
+            except Exception as e:
+                print(f"Fee quote failed (keeping the last one): {e}")
+
+        # submit while there is room in this block and in the pipeline
+        while queue and gas_price is not None:
+            txs = 2 if queue[0]["approve_needed"] else 1
+            in_air = sum(f["sent"]["txs"] for f in inflight)
+            if in_air + txs > MAX_INFLIGHT_TXS or sent_this_block + txs > MAX_TXS_PER_BLOCK:
+                break
+            plan = queue.pop(0)
+            try:
+                sent = submit_plan(w3, account, plan, nm, gas_price)
+            except Exception as e:
+                forget_gas(plan["router"], plan["token"])
+                report({"symbol": plan["symbol"], "contract": plan["contract"], "status": "failed",
+                        "error": f"{type(e).__name__}: {e}"})
+                continue
+            sent_this_block += sent["txs"]
+            inflight.append({"plan": plan, "sent": sent, "receipt": tracker.track(sent["sell_hash"]),
+                             "since": time.time(), "bumped": False})
+
+        still, stuck = [], []
+        for f in inflight:
+            plan, sent = f["plan"], f["sent"]
+            try:
+                if not f["receipt"].done():
+                    if time.time() - f["since"] > SELL_CONFIRM_TIMEOUT_SECONDS:
+                        if f["bumped"]:
+                            tracker.forget(sent["sell_hash"])
+                            swap_journal.unknown(plan["token"], Web3.to_hex(sent["sell_hash"]), "timeout after bump")
+                            report({"symbol": plan["symbol"], "contract": plan["contract"], "status": "timeout",
+                                    "tx": Web3.to_hex(sent["sell_hash"])})
+                            continue
+                        stuck.append(f)
+                    still.append(f)
+                    continue
+                receipt = f["receipt"].result()
+                record_sell_receipt(account, plan, sent, receipt)
+                ok = receipt.status == 1
+                print(f"SELL {'confirmed' if ok else 'reverted'} for {plan['symbol']}. block={receipt.blockNumber}")
+                report({"symbol": plan["symbol"], "contract": plan["contract"],
+                        "status": "confirmed" if ok else "reverted",
+                        "tx": Web3.to_hex(sent["sell_hash"]), "block": receipt.blockNumber,
+                        "latency_seconds": round(time.time() - f["since"], 2)})
+            except Exception as e:
+                # one bad flight (a journal write, ...) must not abandon the rest
+                tracker.forget(sent["sell_hash"])
+                report({"symbol": plan["symbol"], "contract": plan["contract"], "status": "failed",
+                        "tx": Web3.to_hex(sent["sell_hash"]), "error": f"{type(e).__name__}: {e}"})
+        if stuck:
+            still = _bump_stuck(nm, tracker, account, stuck, still, bumped, report)
+        inflight = still
+
+        if queue or inflight:
+            time.sleep(PIPELINE_POLL_SECONDS)
+
+
+def _bump_stuck(nm, tracker, account, stuck: List[Dict[str, Any]], inflight: List[Dict[str, Any]],
+                bumped: set, report):
+    """
+    Replaces every unconfirmed nonce up to the highest timed-out sell that
+    hasn't been replaced this run yet (`bumped`), each once -- a replace
+    compounds the gas price -- then points every in-flight sell whose nonce
+    was replaced at its new hash. Returns the flights still in the air.
+    """
+    top = max(f["sent"]["sell_nonce"] for f in stuck)
+    try:
+        nonces = [n for n in nm.unconfirmed() if n <= top and n not in bumped]
+    except Exception as e:
+        print(f"Bump skipped, could not read unconfirmed nonces: {e}")
+        return inflight
+    replaced = set()
+    for n in nonces:
+        bumped.add(n)  # tried once; a failed replace usually means it already mined
+        try:
+            nm.replace(account, n)
+            replaced.add(n)
+        except Exception as e:
+            print(f"Replacing nonce {n} failed (it may have just mined): {e}")
+
+    still = []
+    for f in inflight:
+        plan, sent = f["plan"], f["sent"]
+        if sent["sell_nonce"] not in replaced:
+            if any(f is s for s in stuck):
+                f["since"], f["bumped"] = time.time(), True  # give it one more timeout, then "timeout"
+            still.append(f)
+            continue
+        try:
+            tracker.forget(sent["sell_hash"])
+            sent["sell_hash"] = nm.hash_of(sent["sell_nonce"]) or sent["sell_hash"]
+            swap_journal.sent(plan["token"], Web3.to_hex(sent["sell_hash"]), sent["sell_nonce"], sender=account.address)
+            f["receipt"] = tracker.track(sent["sell_hash"])
+            f["since"], f["bumped"] = time.time(), True
+            still.append(f)
+        except Exception as e:
+            report({"symbol": plan["symbol"], "contract": plan["contract"], "status": "failed",
+                    "tx": Web3.to_hex(sent["sell_hash"]), "error": f"{type(e).__name__}: {e}"})
+    return still
+
+
 if __name__ == "__main__":
     load_dotenv(dotenv_path=".env", override=True)
     rpc = os.getenv("RPC_URL", "")
@@ -0,0 +1,109 @@
+"""
+Cold-start profile for api_server, with budgets. Exits non-zero when a
+budget is blown, so it can gate a deploy (there is no pytest suite here):
+
+    python startup_profile.py
+
+Measures, each in a fresh interpreter:
+  1) `import api_server` via -X importtime: total + the slowest modules
+  2) uvicorn start (against stub_chain.py) until /health answers, incl. the lifespan warm-up
+  3) the first /analyze and /prepare-sell after that
+
+Budgets (env, defaults sized for a Render starter instance):
+  STARTUP_IMPORT_BUDGET_MS         import api_server            (default 800)
+  STARTUP_READY_BUDGET_SECONDS     process start -> /health OK   (default 8)
+  STARTUP_FIRST_REQUEST_BUDGET_MS  first /analyze, /prepare-sell (default 1500)
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Tuple
+
+import httpx
+
+STARTUP_IMPORT_BUDGET_MS = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "800"))
+STARTUP_READY_BUDGET_SECONDS = float(os.getenv("STARTUP_READY_BUDGET_SECONDS", "8"))
+STARTUP_FIRST_REQUEST_BUDGET_MS = float(os.getenv("STARTUP_FIRST_REQUEST_BUDGET_MS", "1500"))
+TOP_N = 15
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_profile(module: str = "api_server") -> Tuple[float, List[Tuple[float, float, str]]]:
+    """(total ms, [(cumulative ms, self ms, module)] slowest first)"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=HERE, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cum_us) / 1000, int(self_us) / 1000, name.rstrip()))
+    total = next((cum for cum, _, name in rows if name.strip() == module), 0.0)
+    rows.sort(reverse=True)
+    return total, rows
+
+
+def cold_start() -> Tuple[float, float, float]:
+    """(seconds to /health, first /analyze ms, first /prepare-sell ms)"""
+    from loadtest import start_server, start_stub_chain
+
+    stub = proc = None
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            stub, rpc_url = start_stub_chain()
+            t0 = time.perf_counter()
+            proc, base = start_server(rpc_url, workdir)
+            ready = time.perf_counter() - t0
+
+            wallet = "0x" + "00" * 20
+            t1 = time.perf_counter()
+            httpx.post(base + "/analyze", json={"wallet": wallet}, timeout=30).raise_for_status()
+            analyze_ms = (time.perf_counter() - t1) * 1000
+
+            t2 = time.perf_counter()
+            httpx.post(base + "/prepare-sell", json={"wallet": wallet, "token": "0x" + "11" * 20},
+                       timeout=30).raise_for_status()
+            prepare_ms = (time.perf_counter() - t2) * 1000
+            return ready, analyze_ms, prepare_ms
+        finally:
+            for p in (proc, stub):
+                if p is not None:
+                    p.terminate()
+                    p.wait(timeout=10)
+
+
+def main() -> int:
+    failures = []
+
+    total_ms, rows = import_profile()
+    print(f"import api_server: {total_ms:.0f} ms (budget {STARTUP_IMPORT_BUDGET_MS:.0f} ms)")
+    print(f"  {'cumulative ms':>14}{'self ms':>10}  module")
+    for cum, own, name in rows[:TOP_N]:
+        print(f"  {cum:>14.1f}{own:>10.1f}  {name}")
+    if total_ms > STARTUP_IMPORT_BUDGET_MS:
+        failures.append(f"import {total_ms:.0f} ms > {STARTUP_IMPORT_BUDGET_MS:.0f} ms")
+
+    ready, analyze_ms, prepare_ms = cold_start()
+    print(f"\nready (/health) after {ready:.2f}s (budget {STARTUP_READY_BUDGET_SECONDS:g}s)")
+    print(f"first /analyze {analyze_ms:.0f} ms, first /prepare-sell {prepare_ms:.0f} ms "
+          f"(budget {STARTUP_FIRST_REQUEST_BUDGET_MS:.0f} ms each)")
+    if ready > STARTUP_READY_BUDGET_SECONDS:
+        failures.append(f"ready {ready:.2f}s > {STARTUP_READY_BUDGET_SECONDS:g}s")
+    for name, ms in (("/analyze", analyze_ms), ("/prepare-sell", prepare_ms)):
+        if ms > STARTUP_FIRST_REQUEST_BUDGET_MS:
+            failures.append(f"first {name} {ms:.0f} ms > {STARTUP_FIRST_REQUEST_BUDGET_MS:.0f} ms")
+
+    if failures:
+        print("\nSTARTUP BUDGET EXCEEDED: " + "; ".join(failures))
+        return 1
+    print("\nstartup budgets OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
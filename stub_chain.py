@@ -0,0 +1,377 @@
+"""
+Local stand-in for the Monad RPC, for load tests and offline runs.
+
+Speaks just enough JSON-RPC for api_server / the scanners: eth_chainId,
+eth_blockNumber, eth_call (plain calls and Multicall3.aggregate3), eth_getBalance,
+eth_gasPrice. For the executor it also takes signed transactions
+(eth_sendRawTransaction, eth_getTransactionCount, eth_estimateGas,
+eth_getTransactionReceipt, eth_getBlockReceipts, eth_getTransactionByHash):
+each sender's txs are mined in nonce order, one block after they arrive,
+always with status 1. eth_getLogs returns the Transfer logs added with
+inject_transfer() (for the scheduler). Contract answers are deterministic:
+
+  balanceOf(wallet)  ~10% of (token, wallet) pairs hold a small balance
+  decimals()         18
+  symbol()           "T" + first 4 hex chars of the token
+  allowance()        0 until an approve from that owner is mined; eth_call state
+                     overrides of the OpenZeppelin allowance slot (slot 1) apply
+  Lens.getAmountOut  curve tokens: (STUB_ROUTER, stub_curve_out) from the curve
+                     below; ~30% of tokens are "graduated": (STUB_DEX_ROUTER,
+                     amountIn / 10). Either way a typical holding quotes above
+                     the gas of a sell
+  curves(token)      Nad.fun-style curve state (price ~0.1 MON, 1% sell fee);
+  isGraduated(token) any address works as the curve
+  router.sell()      eth_call only (receipts are always status 1): reverts on a
+                     short allowance or balance, amountOutMin above the Lens
+                     quote, or for ~5% of tokens ("paused")
+
+Any address works as the Lens. GET / returns request counters as JSON.
+
+    python stub_chain.py            # 127.0.0.1:8545
+    STUB_RPC_LATENCY_MS=40 python stub_chain.py
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+import rlp
+from eth_abi import decode, encode
+from eth_account import Account
+from eth_utils import keccak
+
+MULTICALL3 = "0xca11bde05977b3631167028862be2a173976ca11"
+STUB_ROUTER = "0x" + "7a" * 20
+STUB_DEX_ROUTER = "0x" + "7b" * 20
+STUB_CHAIN_ID = 143
+STUB_BLOCK_SECONDS = float(os.getenv("STUB_BLOCK_SECONDS", "0.4"))
+STUB_RPC_LATENCY_MS = float(os.getenv("STUB_RPC_LATENCY_MS", "0"))
+STUB_ALLOWANCE_SLOT = 1  # OpenZeppelin ERC20: _balances at 0, _allowances at 1
+
+_GENESIS = time.time() - 1_000_000
+
+
+def _h(*parts: str) -> int:
+    return int.from_bytes(hashlib.sha256("|".join(parts).encode()).digest()[:8], "big")
+
+
+def stub_balance(token: str, wallet: str) -> int:
+    """What balanceOf returns; the load test uses it to pick tokens a wallet holds."""
+    v = _h(token.lower(), wallet.lower()) % 1000
+    return 0 if v < 900 else v * 10 ** 15
+
+
+def stub_block() -> int:
+    return int((time.time() - _GENESIS) / STUB_BLOCK_SECONDS)
+
+
+def stub_paused(token: str) -> bool:
+    return _h(token.lower(), "paused") % 20 == 0
+
+
+def stub_graduated(token: str) -> bool:
+    return _h(token.lower(), "graduated") % 10 < 3
+
+
+def stub_curve_state(token: str) -> list:
+    """curves(token): realMon, realToken, virtualMon, virtualToken, k, target, initVirtualMon, initVirtualToken."""
+    v_mon, v_tok = 10 ** 29, 10 ** 30
+    return [10 ** 24, 8 * 10 ** 29, v_mon, v_tok, v_mon * v_tok, 2 * 10 ** 29, v_mon, v_tok]
+
+
+def stub_quote(token: str, amount_in: int):
+    """What the Lens answers for a sell: (router, MON out)."""
+    if stub_graduated(token):
+        return STUB_DEX_ROUTER, amount_in // 10
+    real_mon, _, v_mon, v_tok, k = stub_curve_state(token)[:5]
+    gross = min(real_mon, v_mon - -(-k // (v_tok + amount_in)))
+    return STUB_ROUTER, gross - (gross + 99) // 100
+
+
+def allowance_storage_key(owner: str, spender: str, slot: int = STUB_ALLOWANCE_SLOT) -> str:
+    """Storage key of _allowances[owner][spender] in a Solidity mapping at `slot`."""
+    inner = keccak(encode(["address", "uint256"], [owner, slot]))
+    return "0x" + keccak(encode(["address", "bytes32"], [spender, inner])).hex()
+
+
+class StubChain:
+    def __init__(self, latency_ms: float = STUB_RPC_LATENCY_MS):
+        self.latency = latency_ms / 1000
+        self._lock = threading.Lock()
+        self._stats: Dict[str, int] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._mined_nonce: Dict[str, int] = {}      # sender -> next nonce to mine
+        self._mempool: Dict[str, Dict[int, tuple]] = {}  # sender -> nonce -> (hash, block seen)
+        self._receipts: Dict[str, dict] = {}
+        self._approvals: Dict[tuple, int] = {}  # (token, owner, spender) -> amount, once mined
+        self._logs: list = []  # injected Transfer logs
+
+    # -----------------------
+    # Contract answers
+    # -----------------------
+
+    def _allowance(self, token: str, owner: str, spender: str, overrides: Optional[dict]) -> int:
+        diff = {a.lower(): d for a, d in (overrides or {}).items()}.get(token) or {}
+        slots = diff.get("stateDiff") or diff.get("state") or {}
+        key = allowance_storage_key(owner, spender)
+        for k, v in slots.items():
+            if k.lower() == key:
+                return int(v, 16)
+        with self._lock:
+            return self._approvals.get((token, owner.lower(), spender.lower()), 0)
+
+    def _sell(self, router: str, sender: Optional[str], args: bytes, overrides: Optional[dict]):
+        ((amount_in, min_out, token, to, _deadline),) = decode(["(uint256,uint256,address,address,uint256)"], args)
+        token = token.lower()
+        if stub_paused(token):
+            return False, b"paused"
+        if sender is None or stub_balance(token, sender) < amount_in:
+            return False, b"balance"
+        if self._allowance(token, sender, router, overrides) < amount_in:
+            return False, b"allowance"
+        if min_out > stub_quote(token, amount_in)[1]:
+            return False, b"slippage"
+        return True, b""
+
+    def _sub_call(self, to: str, data: bytes, sender: Optional[str] = None, overrides: Optional[dict] = None):
+        sel, args = data[:4].hex(), data[4:]
+        if sel == "70a08231":  # balanceOf
+            (wallet,) = decode(["address"], args)
+            return True, encode(["uint256"], [stub_balance(to, wallet)])
+        if sel == "313ce567":  # decimals
+            return True, encode(["uint8"], [18])
+        if sel == "95d89b41":  # symbol
+            return True, encode(["string"], ["T" + to[2:6].upper()])
+        if sel == "dd62ed3e":  # allowance
+            owner, spender = decode(["address", "address"], args)
+            return True, encode(["uint256"], [self._allowance(to, owner, spender, overrides)])
+        if sel == "5de3085d":  # router.sell
+            return self._sell(to, sender, args, overrides)
+        if sel == "f2d65617":  # Lens.getAmountOut
+            token, amount_in, _ = decode(["address", "uint256", "bool"], args)
+            return True, encode(["address", "uint256"], list(stub_quote(token, amount_in)))
+        if sel == "2cc3dc6e":  # curves(token)
+            (token,) = decode(["address"], args)
+            return True, encode(["uint256"] * 8, stub_curve_state(token))
+        if sel == "68a4c8b7":  # isGraduated(token)
+            (token,) = decode(["address"], args)
+            return True, encode(["bool"], [stub_graduated(token)])
+        if sel == "42cbb15c":  # Multicall3.getBlockNumber
+            return True, encode(["uint256"], [stub_block()])
+        return False, b""
+
+    def _eth_call(self, tx: dict, overrides: Optional[dict] = None) -> str:
+        to = tx["to"].lower()
+        data = bytes.fromhex((tx.get("data") or tx.get("input") or "0x")[2:])
+        if to == MULTICALL3 and data[:4].hex() == "82ad56cb":
+            (calls,) = decode(["(address,bool,bytes)[]"], data[4:])
+            self._count("multicall_subcalls", len(calls))
+            results = [self._sub_call(t.lower(), d) for t, _, d in calls]
+            return "0x" + encode(["(bool,bytes)[]"], [results]).hex()
+        self._count("plain_calls")
+        sender = tx.get("from")
+        ok, out = self._sub_call(to, data, sender.lower() if sender else None, overrides)
+        if not ok:
+            raise ValueError("execution reverted" + (f": {out.decode()}" if out else ""))
+        return "0x" + out.hex()
+
+    # -----------------------
+    # Transactions
+    # -----------------------
+
+    def _mine(self) -> None:
+        """Include every contiguous pending nonce that arrived before the current block."""
+        now = stub_block()
+        for sender, pool in self._mempool.items():
+            n = self._mined_nonce.get(sender, 0)
+            while n in pool and pool[n][1] < now:
+                tx_hash, seen, approval = pool.pop(n)
+                if approval is not None:
+                    self._approvals[approval[0]] = approval[1]
+                self._receipts[tx_hash] = {
+                    "transactionHash": tx_hash, "blockNumber": hex(seen + 1), "blockHash": "0x" + "00" * 32,
+                    "transactionIndex": "0x0", "from": sender, "to": None, "status": "0x1",
+                    "gasUsed": hex(21_000), "cumulativeGasUsed": hex(21_000), "effectiveGasPrice": hex(50 * 10 ** 9),
+                    "logs": [], "logsBloom": "0x" + "00" * 256, "contractAddress": None, "type": "0x0",
+                }
+                n += 1
+            self._mined_nonce[sender] = n
+
+    def _send_raw(self, raw_hex: str) -> str:
+        raw = bytes.fromhex(raw_hex[2:])
+        sender = Account.recover_transaction(raw).lower()
+        fields = rlp.decode(raw[1:]) if raw[0] < 0x7f else rlp.decode(raw)
+        nonce = int.from_bytes(fields[1] if raw[0] < 0x7f else fields[0], "big")
+        to, data = (fields[5], fields[7]) if raw[0] < 0x7f else (fields[3], fields[5])
+        approval = None
+        if data[:4].hex() == "095ea7b3":
+            spender, amount = decode(["address", "uint256"], data[4:])
+            approval = (("0x" + to.hex(), sender, spender.lower()), amount)
+        tx_hash = "0x" + keccak(raw).hex()
+        with self._lock:
+            self._mine()
+            if nonce < self._mined_nonce.get(sender, 0):
+                raise ValueError("nonce too low")
+            pool = self._mempool.setdefault(sender, {})
+            if nonce in pool and pool[nonce][0] == tx_hash:
+                raise ValueError("already known")
+            pool[nonce] = (tx_hash, stub_block(), approval)  # same nonce = replacement
+        return tx_hash
+
+    def _tx_count(self, addr: str, tag: str) -> str:
+        addr = addr.lower()
+        with self._lock:
+            self._mine()
+            n = self._mined_nonce.get(addr, 0)
+            if tag == "pending":
+                pool = self._mempool.get(addr, {})
+                while n in pool:
+                    n += 1
+        return hex(n)
+
+    def _pending_tx(self, tx_hash: str):
+        tx_hash = tx_hash.lower()
+        with self._lock:
+            self._mine()
+            for sender, pool in self._mempool.items():
+                for nonce, (h, *_) in pool.items():
+                    if h == tx_hash:
+                        return {"hash": h, "from": sender, "nonce": hex(nonce), "blockNumber": None,
+                                "blockHash": None, "transactionIndex": None}
+        return None
+
+    def inject_transfer(self, token: str, to: str, amount: int = 10 ** 18) -> None:
+        """A Transfer(0x0 -> `to`) of `token`, mined in the next block."""
+        pad = lambda a: "0x" + a.lower()[2:].rjust(64, "0")
+        with self._lock:
+            self._logs.append({
+                "address": token.lower(), "blockNumber": hex(stub_block() + 1), "logIndex": hex(len(self._logs)),
+                "topics": ["0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef",
+                           pad("0x" + "00" * 20), pad(to)],
+                "data": "0x" + amount.to_bytes(32, "big").hex(), "transactionHash": "0x" + "00" * 32,
+                "blockHash": "0x" + "00" * 32, "transactionIndex": "0x0", "removed": False,
+            })
+
+    def _get_logs(self, flt: dict):
+        lo, hi = int(flt.get("fromBlock", "0x0"), 16), int(flt.get("toBlock", hex(stub_block())), 16)
+        topics = flt.get("topics") or []
+        with self._lock:
+            return [l for l in self._logs if lo <= int(l["blockNumber"], 16) <= hi
+                    and all(t is None or t.lower() == l["topics"][i] for i, t in enumerate(topics))]
+
+    def _receipt(self, tx_hash: str):
+        with self._lock:
+            self._mine()
+            return self._receipts.get(tx_hash.lower())
+
+    def _block_receipts(self, block_hex: str):
+        with self._lock:
+            self._mine()
+            return [r for r in self._receipts.values() if r["blockNumber"] == hex(int(block_hex, 16))]
+
+    # -----------------------
+    # JSON-RPC
+    # -----------------------
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] = self._stats.get(key, 0) + n
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def handle(self, req: dict) -> dict:
+        method = req.get("method")
+        params = req.get("params") or []
+        self._count("requests")
+        self._count(f"method:{method}")
+        try:
+            if method == "eth_chainId":
+                result = hex(STUB_CHAIN_ID)
+            elif method == "web3_clientVersion":  # w3.is_connected()
+                result = "stub_chain/1.0"
+            elif method == "net_version":
+                result = str(STUB_CHAIN_ID)
+            elif method == "eth_blockNumber":
+                result = hex(stub_block())
+            elif method == "eth_call":
+                result = self._eth_call(params[0], params[2] if len(params) > 2 else None)
+            elif method == "eth_getBalance":
+                result = hex(10 ** 18)
+            elif method == "eth_gasPrice":
+                result = hex(50 * 10 ** 9)
+            elif method == "eth_getTransactionCount":
+                result = self._tx_count(params[0], params[1] if len(params) > 1 else "latest")
+            elif method == "eth_estimateGas":
+                result = hex(60_000)
+            elif method == "eth_sendRawTransaction":
+                result = self._send_raw(params[0])
+            elif method == "eth_getTransactionByHash":
+                result = self._pending_tx(params[0])  # mempool only; mined txs aren't kept
+            elif method == "eth_getTransactionReceipt":
+                result = self._receipt(params[0])
+            elif method == "eth_getLogs":
+                result = self._get_logs(params[0])
+            elif method == "eth_getBlockReceipts":
+                result = self._block_receipts(params[0])  # our txs only
+            else:
+                return {"jsonrpc": "2.0", "id": req.get("id"),
+                        "error": {"code": -32601, "message": f"method not supported by stub: {method}"}}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": req.get("id"), "error": {"code": 3, "message": str(e)}}
+        return {"jsonrpc": "2.0", "id": req.get("id"), "result": result}
+
+    def _handler(self):
+        chain = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like a real RPC
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._reply(chain.stats())
+
+            def do_POST(self):
+                req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if chain.latency:
+                    time.sleep(chain.latency)
+                self._reply([chain.handle(r) for r in req] if isinstance(req, list) else chain.handle(req))
+
+        return Handler
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serves in a daemon thread; returns the RPC URL (port 0 = pick a free one)."""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="stub-chain", daemon=True).start()
+        return f"http://{host}:{self._server.server_address[1]}"
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+if __name__ == "__main__":
+    chain = StubChain()
+    url = chain.start(port=int(os.getenv("STUB_PORT", "8545")))
+    print(f"Stub chain on {url} (latency {STUB_RPC_LATENCY_MS}ms, block every {STUB_BLOCK_SECONDS}s)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        chain.stop()
@@ -5,93 +5,163 @@ from dotenv import load_dotenv
 from lens_abi import LENS_ABI
 from erc20_abi import ERC20_ABI
 from nadfun_router_abi import NADFUN_ROUTER_ABI
+from nonce_manager import get_nonce_manager
+import allowance_cache
+import swap_journal
+import preflight
+import sell_sizing
+from receipt_tracker import get_receipt_tracker
+import shared_cache
 
-import json
-
-SELL_STATE_FILE = "sell_state.json"
 SELL_COOLDOWN = int(os.getenv("SELL_COOLDOWN_SECONDS", 600))
 
 load_dotenv()
 
 LENS = os.getenv("NADFUN_LENS")
 SAFE_MODE = os.getenv("SAFE_MODE", "true").lower() == "true"
-SWAP_FRACTION = float(os.getenv("SWAP_FRACTION", 0.10))
+SWAP_FRACTION = float(os.getenv("SWAP_FRACTION", 0.10))  # only with SELL_SIZING_ENABLED=false
 MIN_SWAP_USD = float(os.getenv("MIN_SWAP_USD", 0.01))
 SLIPPAGE_BPS = int(os.getenv("SLIPPAGE_BPS", 300))  # 300 = 3%
+# Sell gas can't be estimated while its approve is still pending (it would revert),
+# so it goes out with this fixed limit. Monad charges the full gas limit: keep it tight.
+SELL_GAS_LIMIT = int(os.getenv("SELL_GAS_LIMIT", 350_000))
+SELL_CONFIRM_TIMEOUT_SECONDS = int(os.getenv("SELL_CONFIRM_TIMEOUT_SECONDS", 120))
+# Fee quote reused across the tokens of one cleaning batch
+FEE_QUOTE_TTL_SECONDS = float(os.getenv("FEE_QUOTE_TTL_SECONDS", 10))
+# Gas limits are estimated once per (router, token, call) and padded by this margin
+GAS_ESTIMATE_MARGIN = float(os.getenv("GAS_ESTIMATE_MARGIN", 1.2))
+GAS_ESTIMATE_TTL_SECONDS = float(os.getenv("GAS_ESTIMATE_TTL_SECONDS", 24 * 3600))
 
 
-def execute_safe_swap(w3, account, token):
-    """
-    Sell dust token -> MON using Nad.fun Lens to choose router.
-    SAFE_MODE=True: preview only (NO TX).
-    SAFE_MODE=False: sends approve + sell TX.
-    """
-    now = int(time.time())
+# -----------------------
+# Fee / gas-estimate cache
+# -----------------------
 
-    # Always define symbol early (so cooldown prints work)
-    symbol = token.get("symbol", "?")
+_fee = {}        # endpoint -> (gas_price, fetched_at)
+_chain_ids = {}  # endpoint -> chain id
 
-    # Load sell state
-    try:
-        with open(SELL_STATE_FILE, "r") as f:
-            sell_state = json.load(f)
-    except Exception:
-        sell_state = {}
 
-    last_sold = sell_state.get(token["contract"], 0)
-    if now - last_sold < SELL_COOLDOWN:
-        print(f"Skipping {symbol} — cooldown active")
-        return
+def _endpoint(w3):
+    return getattr(w3.provider, "endpoint_uri", None) or id(w3.provider)
 
-    try:
-        # --- Stage 2 support: prefer MON-based value + raw balance ---
-        raw_bal = token.get("raw_balance", None)
-        mon_value = token.get("mon_value", None)
 
-        if raw_bal is not None and mon_value is not None:
-            # Minimum swap guard (prevents spam swaps)
-            MIN_SWAP_MON = float(os.getenv("MIN_SWAP_MON", "0.02"))
-            mon_value = float(mon_value)
+def fee_quote(w3, max_age=None):
+    """gas_price, fetched at most once per FEE_QUOTE_TTL_SECONDS (max_age=0 forces a fresh one)."""
+    max_age = FEE_QUOTE_TTL_SECONDS if max_age is None else max_age
+    key = _endpoint(w3)
+    hit = _fee.get(key)
+    if hit is not None and time.time() - hit[1] < max_age:
+        return hit[0]
+    price = int(w3.eth.gas_price)
+    _fee[key] = (price, time.time())
+    return price
 
-            if mon_value < MIN_SWAP_MON:
-                print(f"Skipping {symbol} — too small ({mon_value:.6f} MON)")
-                return
 
-            # amount_in MUST be raw balance (base units)
-            amount_in = int(raw_bal)
+def chain_id(w3):
+    key = _endpoint(w3)
+    if key not in _chain_ids:
+        _chain_ids[key] = int(w3.eth.chain_id)
+    return _chain_ids[key]
 
-        else:
-            # --- Legacy USD-based fallback ---
-            MIN_SWAP_USD = float(os.getenv("MIN_SWAP_USD", "0.10"))
-            usd_value = float(token.get("usd_value", 0) or 0)
 
-            if usd_value < MIN_SWAP_USD:
-                print(f"Skipping {symbol} — too small (${usd_value})")
-                return
+def _gas_key(kind, router, token):
+    return f"gas:{kind}:{router}:{token}".lower()
 
-            decimals = int(token.get("decimals", 18))
-            amount = float(token.get("amount", 0) or 0)
-            amount_in = int(amount * (10 ** decimals))
 
-        if amount_in <= 0:
-            print(f"Skipping {symbol} — zero balance")
-            return
+def cached_gas(kind, router, token):
+    return shared_cache.get(_gas_key(kind, router, token))
 
-        token_ca = Web3.to_checksum_address(token["contract"])
 
-        # Skip native MON pseudo-address
-        if token_ca.lower() == "0x0000000000000000000000000000000000000000":
-            return
+def gas_limit(kind, router, token, fn, tx_fields):
+    """Padded gas limit for `fn`; estimated only when (router, token, kind) isn't cached."""
+    limit = cached_gas(kind, router, token)
+    if limit is None:
+        limit = int(fn.estimate_gas(tx_fields) * GAS_ESTIMATE_MARGIN)
+        shared_cache.set(_gas_key(kind, router, token), limit, ttl=GAS_ESTIMATE_TTL_SECONDS)
+    return int(limit)
 
-        # Build contracts
-        lens = w3.eth.contract(address=Web3.to_checksum_address(LENS), abi=LENS_ABI)
-        erc = w3.eth.contract(address=token_ca, abi=ERC20_ABI)
-        # If Stage2 gave us raw_balance, keep it. Otherwise calculate from balance/decimals.
-        if amount_in <= 0:
-            bal = erc.functions.balanceOf(account.address).call()
-            amount_in = int(bal)
 
-        current_balance = erc.functions.balanceOf(account.address).call()
+def forget_gas(router, token):
+    """After a failure: the next send for this token re-estimates."""
+    for kind in ("approve", "sell"):
+        shared_cache.set(_gas_key(kind, router, token), None, ttl=0)
+
+
+def plan_swap(w3, account, token):
+    """
+    Everything up to (not including) sending: cooldown and size guards, live
+    balance, Lens quote and allowance. Returns a plan dict, or None to skip.
+    """
+    # Always define symbol early (so cooldown prints work)
+    symbol = token.get("symbol", "?")
+
+    # Cooldown / in-flight guard from the swap journal
+    swap_journal.recover(w3)
+    blocked = swap_journal.blocked(token["contract"], SELL_COOLDOWN)
+    if blocked == "cooldown":
+        print(f"Skipping {symbol} — cooldown active")
+        return None
+    if blocked == "in_flight":
+        print(f"Skipping {symbol} — previous sell still in flight")
+        return None
+
+    # --- Stage 2 support: prefer MON-based value + raw balance ---
+    raw_bal = token.get("raw_balance", None)
+    mon_value = token.get("mon_value", None)
+
+    if raw_bal is not None and mon_value is not None:
+        # Minimum swap guard (prevents spam swaps)
+        MIN_SWAP_MON = float(os.getenv("MIN_SWAP_MON", "0.02"))
+        mon_value = float(mon_value)
+
+        if mon_value < MIN_SWAP_MON:
+            print(f"Skipping {symbol} — too small ({mon_value:.6f} MON)")
+            return None
+
+        # amount_in MUST be raw balance (base units)
+        amount_in = int(raw_bal)
+
+    else:
+        # --- Legacy USD-based fallback ---
+        MIN_SWAP_USD = float(os.getenv("MIN_SWAP_USD", "0.10"))
+        usd_value = float(token.get("usd_value", 0) or 0)
+
+        if usd_value < MIN_SWAP_USD:
+            print(f"Skipping {symbol} — too small (${usd_value})")
+            return None
+
+        decimals = int(token.get("decimals", 18))
+        amount = float(token.get("amount", 0) or 0)
+        amount_in = int(amount * (10 ** decimals))
+
+    if amount_in <= 0:
+        print(f"Skipping {symbol} — zero balance")
+        return None
+
+    token_ca = Web3.to_checksum_address(token["contract"])
+
+    # Skip native MON pseudo-address
+    if token_ca.lower() == "0x0000000000000000000000000000000000000000":
+        return None
+
+    # Build contracts
+    lens = w3.eth.contract(address=Web3.to_checksum_address(LENS), abi=LENS_ABI)
+    erc = w3.eth.contract(address=token_ca, abi=ERC20_ABI)
+
+    current_balance = erc.functions.balanceOf(account.address).call()
+
+    if sell_sizing.SELL_SIZING_ENABLED:
+        # size from the Lens price curve (run_stage2_cleaning pre-sizes every token in one multicall)
+        size = token.get("sell_size")
+        if "sell_size" not in token or (size is not None and size["amount_in"] > current_balance):
+            gas_cost = fee_quote(w3) * SELL_GAS_LIMIT
+            size = sell_sizing.size_sells(w3, LENS, [(token_ca, current_balance)], gas_cost)[token_ca]
+        if size is None:
+            print(f"Skipping {symbol} — no size inside the slippage budget covers gas")
+            return None
+        amount_in, router_addr, mon_out = int(size["amount_in"]), size["router"], int(size["mon_out"])
+        print(f"Sizing {symbol}: {amount_in}/{current_balance} (impact {size['impact_bps']} bps)")
+    else:
         amount_in = int(current_balance * SWAP_FRACTION)
 
         # Safety cap: never exceed current balance
@@ -100,69 +170,166 @@ def execute_safe_swap(w3, account, token):
 
         if amount_in <= 0:
             print(f"Skipping {symbol} — zero amount")
-            return
+            return None
 
         # Quote SELL token -> MON (isBuy=False)
         router_addr, mon_out = lens.functions.getAmountOut(token_ca, amount_in, False).call()
         mon_out = int(mon_out)
 
-        if mon_out <= 0:
-            print(f"Skipping {symbol} — no MON output")
-            return
+    if mon_out <= 0:
+        print(f"Skipping {symbol} — no MON output")
+        return None
+
+    router_cs = Web3.to_checksum_address(router_addr)
+    # a cached allowance that covers the sell saves both the read and the approve
+    if allowance_cache.covers(account.address, token_ca, router_cs, amount_in):
+        approve_needed = False
+    else:
+        allowance = erc.functions.allowance(account.address, router_cs).call()
+        allowance_cache.observe(account.address, token_ca, router_cs, allowance)
+        approve_needed = allowance < amount_in
+
+    return {
+        "symbol": symbol,
+        "contract": token["contract"],
+        "token": token_ca,
+        "router": router_cs,
+        "amount_in": amount_in,
+        "mon_out": mon_out,
+        "amount_out_min": mon_out * (10_000 - SLIPPAGE_BPS) // 10_000,
+        "deadline": int(time.time()) + 300,  # 5 minutes
+        "approve_needed": approve_needed,
+        "approve_amount": allowance_cache.approve_amount(router_cs, amount_in) if approve_needed else 0,
+    }
+
+
+def submit_plan(w3, account, plan, nm, gas_price):
+    """
+    Sends approve (if needed) and sell on consecutive nonces without waiting
+    for either. Returns {"approve_hash", "sell_hash", "sell_nonce", "txs"}.
+    Pass the receipt to record_sell_receipt() once the sell is mined.
+    """
+    # journal first: after a crash, a planned record keeps the token from being sold twice,
+    # and the sell's hash is journaled before it is broadcast
+    swap_journal.planned(plan["token"], plan["amount_in"], plan["router"])
+    signed = {}
+
+    def journal_sent(nonce, tx_hash):
+        signed["hash"] = Web3.to_hex(tx_hash)
+        swap_journal.sent(plan["token"], signed["hash"], nonce, sender=account.address)
+
+    try:
+        approve_hash, sell_nonce, sell_hash = _send_pair(w3, account, plan, nm, gas_price, journal_sent)
+    except Exception as e:
+        if "hash" in signed:
+            # may or may not have reached the mempool: recover() finds out
+            swap_journal.unknown(plan["token"], signed["hash"], f"{type(e).__name__}: {e}")
+        else:
+            swap_journal.failed(plan["token"], f"{type(e).__name__}: {e}")
+        raise
+    return {
+        "approve_hash": approve_hash,
+        "sell_hash": sell_hash,
+        "sell_nonce": sell_nonce,
+        "txs": 2 if approve_hash is not None else 1,
+    }
+
+
+def _send_pair(w3, account, plan, nm, gas_price, on_sell_signed=None):
+    symbol = plan["symbol"]
+    erc = w3.eth.contract(address=plan["token"], abi=ERC20_ABI)
+    router = w3.eth.contract(address=plan["router"], abi=NADFUN_ROUTER_ABI)
+
+    # every field given up front: build_transaction makes no RPC calls
+    fields = {"from": account.address, "gasPrice": gas_price, "chainId": chain_id(w3)}
+
+    approve_hash = None
+    if plan["approve_needed"]:
+        approve_fn = erc.functions.approve(router.address, plan["approve_amount"])
+        gas = gas_limit("approve", router.address, plan["token"], approve_fn, {"from": account.address})
+        _, approve_hash = nm.send(account, approve_fn.build_transaction(dict(fields, gas=gas)))
+        print(f"Approve sent for {symbol} ({allowance_cache.mode_for(router.address)}): {approve_hash.hex()}")
+
+    params = (plan["amount_in"], plan["amount_out_min"], plan["token"], account.address, plan["deadline"])
+    sell_fn = router.functions.sell(params)
+    if approve_hash is not None:
+        # can't estimate behind a pending approve: a cached estimate, else the fixed limit
+        gas = cached_gas("sell", router.address, plan["token"]) or SELL_GAS_LIMIT
+    else:
+        gas = gas_limit("sell", router.address, plan["token"], sell_fn, {"from": account.address})
+
+    sell_nonce, sell_hash = nm.send(account, sell_fn.build_transaction(dict(fields, gas=gas)), on_signed=on_sell_signed)
+    print(f"SELL sent for {symbol}: {sell_hash.hex()}")
+    return approve_hash, sell_nonce, sell_hash
+
+
+def record_sell_receipt(account, plan, sent, receipt):
+    """Journals a mined sell and moves the allowance cache on with it (and the approve before it)."""
+    swap_journal.mined(plan["token"], Web3.to_hex(sent["sell_hash"]), receipt.blockNumber, receipt.status == 1)
+    if receipt.status == 1:
+        approved = plan["approve_amount"] if sent["approve_hash"] is not None else None
+        allowance_cache.on_sell_confirmed(account.address, plan["token"], plan["router"], plan["amount_in"], approved)
+    else:
+        allowance_cache.on_sell_failed(account.address, plan["token"], plan["router"])
+        forget_gas(plan["router"], plan["token"])
 
-        amount_out_min = mon_out * (10_000 - SLIPPAGE_BPS) // 10_000
-        deadline = int(time.time()) + 300  # 5 minutes
+
+def execute_safe_swap(w3, account, token):
+    """
+    Sell dust token -> MON using Nad.fun Lens to choose router.
+    SAFE_MODE=True: preview only (NO TX).
+    SAFE_MODE=False: sends approve + sell TX.
+    """
+    try:
+        plan = plan_swap(w3, account, token)
+        if plan is None:
+            return
 
         if SAFE_MODE:
-            print(f"SAFE MODE: would SELL {symbol} -> MON | amount_in={amount_in} | expected MON out={mon_out} | min_out={amount_out_min}")
+            print(f"SAFE MODE: would SELL {plan['symbol']} -> MON | amount_in={plan['amount_in']} | expected MON out={plan['mon_out']} | min_out={plan['amount_out_min']}")
             return
 
         # ---------- REAL TX MODE ----------
-        router = w3.eth.contract(address=Web3.to_checksum_address(router_addr), abi=NADFUN_ROUTER_ABI)
-
-        # 1) Approve if needed
-        allowance = erc.functions.allowance(account.address, router.address).call()
-        nonce = w3.eth.get_transaction_count(account.address)
-
-        if allowance < amount_in:
-            approve_tx = erc.functions.approve(router.address, amount_in).build_transaction({
-                "from": account.address,
-                "nonce": nonce,
-                "gasPrice": w3.eth.gas_price,
-            })
-            # estimate gas
-            approve_tx["gas"] = w3.eth.estimate_gas(approve_tx)
-
-            signed = account.sign_transaction(approve_tx)
-            tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-            print(f"Approve sent for {symbol}: {tx_hash.hex()}")
-
-            w3.eth.wait_for_transaction_receipt(tx_hash)
-            nonce += 1
-
-        # 2) Sell
-        params = (amount_in, amount_out_min, token_ca, account.address, deadline)
-
-        sell_tx = router.functions.sell(params).build_transaction({
-            "from": account.address,
-            "nonce": nonce,
-            "gasPrice": w3.eth.gas_price,
-        })
-        sell_tx["gas"] = w3.eth.estimate_gas(sell_tx)
-
-        signed2 = account.sign_transaction(sell_tx)
-        sell_hash = w3.eth.send_raw_transaction(signed2.raw_transaction)
-        print(f"SELL sent for {symbol}: {sell_hash.hex()}")
-
-        receipt = w3.eth.wait_for_transaction_receipt(sell_hash)
+        # simulate first: a predicted revert costs one eth_call instead of gas + a confirmation wait
+        kept, _ = preflight.check(w3, account, [plan], LENS)
+        if not kept:
+            return False
+
+        # approve + sell back to back, then one confirmation wait for the pair
+        nm = get_nonce_manager(w3, account.address)
+        try:
+            sent = submit_plan(w3, account, plan, nm, fee_quote(w3))
+        except Exception:
+            forget_gas(plan["router"], plan["token"])
+            raise
+        symbol = plan["symbol"]
+        sell_nonce, sell_hash = sent["sell_nonce"], sent["sell_hash"]
+
+        # bump whatever is stuck once if it times out
+        tracker = get_receipt_tracker(w3)
+        try:
+            receipt = tracker.wait(sell_hash, SELL_CONFIRM_TIMEOUT_SECONDS)
+        except TimeoutError:
+            for n in nm.unconfirmed():
+                if n <= sell_nonce:
+                    nm.replace(account, n)
+            tracker.forget(sell_hash)
+            sell_hash = sent["sell_hash"] = nm.hash_of(sell_nonce) or sell_hash
+            swap_journal.sent(plan["token"], Web3.to_hex(sell_hash), sell_nonce, sender=account.address)
+            try:
+                receipt = tracker.wait(sell_hash, SELL_CONFIRM_TIMEOUT_SECONDS)
+            except TimeoutError:
+                tracker.forget(sell_hash)
+                swap_journal.unknown(plan["token"], Web3.to_hex(sell_hash), "timeout after bump")
+                raise
+        record_sell_receipt(account, plan, sent, receipt)
+
+        if receipt.status != 1:
+            print(f"SELL reverted for {symbol}. block={receipt.blockNumber}")
+            return False
         print(f"SELL confirmed for {symbol}. block={receipt.blockNumber}")
         return True
-        sell_state[token["contract"]] = now
-        with open(SELL_STATE_FILE, "w") as f:
-            json.dump(sell_state, f, indent=2)
-
 
     except Exception as e:
         print(f"Sell failed for {token.get('symbol','?')}: {e}")
         return False
-
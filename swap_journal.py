@@ -0,0 +1,277 @@
+"""
+Append-only swap journal (replaces sell_state.json).
+
+Every sell moves through planned -> sent -> mined | failed | unknown, and each step is
+one JSON line appended (and fsynced) to SWAP_JOURNAL_FILE. The latest record
+per token is kept in memory, rebuilt from the file on first use, and the
+cooldown / in-flight checks read only that index.
+
+Crash safety:
+  - "planned" is written before anything is signed, "sent" (hash, nonce,
+    sender) once the sell is signed but before it is broadcast. So a planned
+    record with no hash means the sell never left this process.
+  - A sell we gave up waiting for is journaled "unknown" (hash kept).
+  - planned / sent / unknown block the token ("in_flight") until recover(w3)
+    settles them, however old they are: a receipt -> mined; no receipt and
+    the nonce used by another tx, or the tx gone from the mempool -> failed.
+    A hashless planned record left by an earlier process -> failed. recover()
+    runs at most every SWAP_JOURNAL_RECHECK_SECONDS.
+
+One writer process at a time (same rule as the nonce manager). A torn last
+line from a crash is cut off on load. The file is compacted to one line per
+token on load once it passes SWAP_JOURNAL_COMPACT_LINES.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+SWAP_JOURNAL_FILE = os.getenv("SWAP_JOURNAL_FILE", "swap_journal.jsonl")
+SWAP_JOURNAL_FSYNC = os.getenv("SWAP_JOURNAL_FSYNC", "true").lower() == "true"
+SWAP_JOURNAL_COMPACT_LINES = int(os.getenv("SWAP_JOURNAL_COMPACT_LINES", "5000"))
+SWAP_JOURNAL_RECHECK_SECONDS = float(os.getenv("SWAP_JOURNAL_RECHECK_SECONDS", "120"))
+
+_OPEN = ("planned", "sent", "unknown")  # outcome not known yet
+
+_lock = threading.Lock()
+_index: Optional[Dict[str, dict]] = None  # token -> latest record (+ "last_sold")
+_last_recover = 0.0
+_RUN_ID = f"{os.getpid()}-{time.time():.0f}"  # tells this process's planned records from a crashed run's
+
+
+# -----------------------
+# File
+# -----------------------
+
+def _apply(index: Dict[str, dict], rec: dict) -> None:
+    token = rec["token"]
+    prev = index.get(token, {})
+    entry = dict(rec)
+    entry["last_sold"] = rec.get("last_sold", prev.get("last_sold", 0))
+    if rec["state"] == "mined" and rec.get("ok"):
+        entry["last_sold"] = rec["ts"]
+    if rec["state"] != "planned":
+        for k in ("hash", "nonce", "from"):
+            if k not in rec and k in prev:
+                entry[k] = prev[k]
+    index[token] = entry
+
+
+def _load() -> Dict[str, dict]:
+    global _index
+    if _index is not None:
+        return _index
+    index: Dict[str, dict] = {}
+    lines = 0
+    good = 0  # bytes up to the last complete line
+    try:
+        with open(SWAP_JOURNAL_FILE, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write from a crash
+                lines += 1
+                good += len(line)
+                try:
+                    _apply(index, json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+        if good < os.path.getsize(SWAP_JOURNAL_FILE):
+            os.truncate(SWAP_JOURNAL_FILE, good)  # so the next append starts on a fresh line
+    except FileNotFoundError:
+        pass
+    _index = index
+    if lines > SWAP_JOURNAL_COMPACT_LINES:
+        _compact()
+    return _index
+
+
+def _compact() -> None:
+    tmp = f"{SWAP_JOURNAL_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        for entry in _index.values():
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, SWAP_JOURNAL_FILE)
+
+
+def _append(token: str, state: str, **fields) -> dict:
+    rec = {"ts": int(time.time()), "token": token.lower(), "state": state}
+    rec.update({k: v for k, v in fields.items() if v is not None})
+    with _lock:
+        index = _load()
+        with open(SWAP_JOURNAL_FILE, "a") as f:
+            f.write(json.dumps(rec, separators=(",", ":")) + "\n")
+            f.flush()
+            if SWAP_JOURNAL_FSYNC:
+                os.fsync(f.fileno())
+        _apply(index, rec)
+    return rec
+
+
+# -----------------------
+# Transitions
+# -----------------------
+
+def planned(token: str, amount_in: int, router: str) -> None:
+    _append(token, "planned", amount_in=str(amount_in), router=router, run=_RUN_ID)
+
+
+def sent(token: str, tx_hash: str, nonce: int, sender: Optional[str] = None) -> None:
+    """Write it before broadcasting: then every sell that may be out there has a hash to check."""
+    _append(token, "sent", hash=tx_hash, nonce=nonce, **{"from": sender})
+
+
+def mined(token: str, tx_hash: str, block: int, ok: bool) -> None:
+    _append(token, "mined", hash=tx_hash, block=block, ok=bool(ok))
+
+
+def failed(token: str, error: str) -> None:
+    _append(token, "failed", error=str(error)[:200])
+
+
+def unknown(token: str, tx_hash: Optional[str], error: str) -> None:
+    """We stopped waiting (timeout); recover() settles it later."""
+    _append(token, "unknown", hash=tx_hash, error=str(error)[:200])
+
+
+# -----------------------
+# Checks
+# -----------------------
+
+def entry(token: str) -> Optional[dict]:
+    with _lock:
+        e = _load().get(token.lower())
+    return dict(e) if e else None
+
+
+def blocked(token: str, cooldown: int) -> Optional[str]:
+    """"cooldown" / "in_flight" if this token must not be sold now, else None."""
+    e = entry(token)
+    if e is None:
+        return None
+    now = int(time.time())
+    if e["state"] in _OPEN:
+        return "in_flight"  # until recover() knows what happened, whatever its age
+    if now - e.get("last_sold", 0) < cooldown:
+        return "cooldown"
+    return None
+
+
+def recover(w3) -> None:
+    """
+    Settle planned / sent / unknown records (this run's or an earlier one's)
+    from the chain. Cheap to call often: runs at most every SWAP_JOURNAL_RECHECK_SECONDS.
+    """
+    global _last_recover
+    now = time.time()
+    with _lock:
+        if now - _last_recover < SWAP_JOURNAL_RECHECK_SECONDS:
+            return
+        _last_recover = now
+        pending = [dict(e) for e in _load().values() if e["state"] in _OPEN]
+    from web3.exceptions import TransactionNotFound
+
+    for e in pending:
+        if not e.get("hash"):
+            if e["state"] == "planned" and e.get("run") != _RUN_ID:
+                failed(e["token"], "never signed (earlier run stopped first)")
+            continue  # ours and still being sent
+        try:
+            receipt = w3.eth.get_transaction_receipt(e["hash"])
+        except TransactionNotFound:
+            receipt = None
+        except Exception as ex:
+            print(f"Journal recovery: could not check {e['hash']} ({ex})")
+            continue
+        if receipt is not None:
+            mined(e["token"], e["hash"], receipt.blockNumber, receipt.status == 1)
+            continue
+        if e.get("from") and e.get("nonce") is not None:
+            try:
+                if w3.eth.get_transaction_count(e["from"], "latest") > int(e["nonce"]):
+                    failed(e["token"], "nonce used by another tx")
+                    continue
+            except Exception as ex:
+                print(f"Journal recovery: could not check nonce {e['nonce']} ({ex})")
+                continue
+        try:
+            w3.eth.get_transaction(e["hash"])  # still in the mempool: leave it in flight
+        except TransactionNotFound:
+            failed(e["token"], "dropped")
+        except Exception as ex:
+            print(f"Journal recovery: could not check {e['hash']} ({ex})")
+
+
+if __name__ == "__main__":
+    # Self-check against a throwaway file
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as d:
+        SWAP_JOURNAL_FILE = os.path.join(d, "swap_journal.jsonl")
+        a, b = "0x" + "aa" * 20, "0x" + "bb" * 20
+
+        assert blocked(a, 600) is None
+        planned(a, 10, "0xr")
+        assert blocked(a, 600) == "in_flight"
+        sent(a, "0xh1", 7)
+        mined(a, "0xh1", 100, True)
+        assert blocked(a, 600) == "cooldown" and blocked(a, 0) is None
+
+        planned(b, 5, "0xr")
+        sent(b, "0xh2", 8)
+        with open(SWAP_JOURNAL_FILE, "a") as f:
+            f.write('{"ts": 1, "tok')  # crash mid-write
+
+        _index = None  # restart: rebuilt from the file
+        assert blocked(a, 600) == "cooldown"
+        assert blocked(b, 600) == "in_flight" and entry(b)["hash"] == "0xh2"
+        failed(b, "reverted")
+        assert blocked(b, 600) is None
+
+        # a timed-out sell stays blocked, however old, until recover() settles it
+        sent(b, "0xh3", 9, sender="0xme")
+        unknown(b, None, "timeout")
+        assert blocked(b, 600) == "in_flight" and entry(b)["hash"] == "0xh3"
+        assert blocked(b, 0) == "in_flight" and entry(b)["nonce"] == 9
+
+        SWAP_JOURNAL_COMPACT_LINES = 2
+        _index = None
+        assert entry(a)["state"] == "mined" and entry(a)["last_sold"] > 0
+        with open(SWAP_JOURNAL_FILE) as f:
+            assert len(f.readlines()) == 2
+        _index = None
+        assert blocked(a, 600) == "cooldown" and entry(b)["state"] == "unknown"
+
+        class _Eth:  # the timed-out sell did land
+            def get_transaction_receipt(self, h):
+                return type("R", (), {"blockNumber": 101, "status": 1})()
+
+        recover(type("W3", (), {"eth": _Eth()})())
+        assert entry(b)["state"] == "mined" and blocked(b, 600) == "cooldown"
+
+        from web3.exceptions import TransactionNotFound
+
+        class _Eth2:  # no receipt; nonces up to 11 are used
+            def get_transaction_receipt(self, h):
+                raise TransactionNotFound(h)
+
+            def get_transaction_count(self, addr, block):
+                return 12
+
+            def get_transaction(self, h):
+                return {}  # still in the mempool
+
+        c, d2 = "0x" + "cc" * 20, "0x" + "dd" * 20
+        sent(a, "0xh4", 11, sender="0xme")      # replaced: its nonce went to another tx
+        sent(c, "0xh5", 12, sender="0xme")      # still pending
+        planned(d2, 1, "0xr")
+        with open(SWAP_JOURNAL_FILE, "a") as f:  # hashless planned from a crashed run
+            f.write(json.dumps({"ts": 1, "token": "0x" + "ee" * 20, "state": "planned", "run": "1-1"}) + "\n")
+        _index = None
+        SWAP_JOURNAL_RECHECK_SECONDS = 0
+        recover(type("W3", (), {"eth": _Eth2()})())
+        assert entry(a)["state"] == "failed" and blocked(c, 0) == "in_flight" and blocked(d2, 0) == "in_flight"
+        assert entry("0x" + "ee" * 20)["state"] == "failed"
+    print("swap_journal: ok")
@@ -0,0 +1,183 @@
+"""
+Independent task groups for one agent run.
+
+Each group is one worker thread, so tasks in a group run in order and groups
+run side by side: on-chain work in "chain", Moltbook calls in "social",
+local simulations in "sim". A Moltbook 429 backoff (the SDK sleeps
+retry_after_minutes * 60) then only holds up the social group.
+
+Every task has its own timeout, counted from when it starts. A task that
+runs past it is reported as "timeout" and the tasks still queued behind it
+in the same group are cancelled. Python threads can't be killed, so the
+stuck call keeps its worker; the next run skips that group ("skipped")
+until the call returns. Exceptions stay inside their task ("error").
+
+A task can wait on others (after=...). It then gets {name: result} of the
+tasks that finished, and starts once all of them are settled, whatever the
+outcome.
+
+    report = run_tasks([Task("clean", "chain", clean_dust, 600), ...])
+    report["tasks"]["clean"] -> {"group", "status", "seconds", "queued_seconds", "error"}
+"""
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+RUN_POLL_SECONDS = 0.05
+
+_executors: Dict[str, ThreadPoolExecutor] = {}
+_inflight: Dict[str, List[Future]] = {}  # group -> tasks submitted to it and not done (any run)
+_lock = threading.Lock()
+
+_SETTLED = ("ok", "error", "timeout", "cancelled", "skipped")
+
+
+class Task:
+    def __init__(self, name: str, group: str, fn: Callable[..., Any], timeout: float, after: Sequence[str] = ()):
+        self.name = name
+        self.group = group
+        self.fn = fn
+        self.timeout = timeout
+        self.after = tuple(after)
+
+
+def _executor(group: str) -> ThreadPoolExecutor:
+    with _lock:
+        ex = _executors.get(group)
+        if ex is None:
+            ex = _executors[group] = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"agent-{group}")
+        return ex
+
+
+def _group_busy(group: str) -> bool:
+    with _lock:
+        live = _inflight[group] = [f for f in _inflight.get(group, []) if not f.done()]
+    return bool(live)
+
+
+def run_tasks(tasks: List[Task]) -> Dict[str, Any]:
+    """Runs `tasks` in their groups; returns {"total_seconds", "tasks": {name: record}}."""
+    t0 = time.monotonic()
+    recs: Dict[str, dict] = {
+        t.name: {"group": t.group, "status": "waiting", "seconds": None, "queued_seconds": None, "error": None}
+        for t in tasks
+    }
+    results: Dict[str, Any] = {}
+    futures: Dict[str, Future] = {}
+    marks: Dict[str, dict] = {t.name: {} for t in tasks}
+
+    busy_at_start = {t.group for t in tasks if _group_busy(t.group)}
+
+    def submit(t: Task) -> None:
+        mark = marks[t.name]
+        mark["queued"] = time.monotonic()
+
+        def run():
+            mark["started"] = time.monotonic()
+            try:
+                if t.after:
+                    return t.fn({n: results[n] for n in t.after if n in results})
+                return t.fn()
+            finally:
+                mark["finished"] = time.monotonic()
+
+        fut = futures[t.name] = _executor(t.group).submit(run)
+        with _lock:
+            _inflight.setdefault(t.group, []).append(fut)
+        recs[t.name]["status"] = "queued"
+
+    def settle(name: str, status: str, error: Optional[str] = None) -> None:
+        rec, mark = recs[name], marks[name]
+        rec["status"] = status
+        rec["error"] = error
+        if "started" in mark:
+            rec["seconds"] = round(mark.get("finished", time.monotonic()) - mark["started"], 3)
+            rec["queued_seconds"] = round(mark["started"] - mark["queued"], 3)
+
+    for t in tasks:
+        if t.group in busy_at_start:
+            settle(t.name, "skipped", "group still busy with a task from an earlier run")
+
+    while True:
+        pending = [t for t in tasks if recs[t.name]["status"] not in _SETTLED]
+        if not pending:
+            break
+        now = time.monotonic()
+        for t in pending:
+            rec = recs[t.name]
+            if rec["status"] in _SETTLED:
+                continue  # cancelled earlier in this pass
+            if rec["status"] == "waiting":
+                if all(recs[n]["status"] in _SETTLED for n in t.after if n in recs):
+                    if _group_busy(t.group) and t.group not in {x.group for x in pending if x.name in futures}:
+                        settle(t.name, "skipped", "group still busy with a timed-out task")
+                    else:
+                        submit(t)
+                continue
+            fut = futures[t.name]
+            if fut.done():
+                if fut.cancelled():
+                    settle(t.name, "cancelled")
+                elif fut.exception() is not None:
+                    settle(t.name, "error", f"{type(fut.exception()).__name__}: {fut.exception()}")
+                else:
+                    results[t.name] = fut.result()
+                    settle(t.name, "ok")
+                continue
+            started = marks[t.name].get("started")
+            if started is not None and now - started > t.timeout:
+                settle(t.name, "timeout", f"still running after {t.timeout:g}s")
+                for other in tasks:
+                    if other.group == t.group and other.name in futures and recs[other.name]["status"] == "queued":
+                        if futures[other.name].cancel():
+                            settle(other.name, "cancelled", f"queued behind {t.name}, which timed out")
+        time.sleep(RUN_POLL_SECONDS)
+
+    return {"total_seconds": round(time.monotonic() - t0, 3), "tasks": recs}
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = [f"[tasks] run took {report['total_seconds']:.2f}s"]
+    for name, r in report["tasks"].items():
+        secs = "-" if r["seconds"] is None else f"{r['seconds']:.2f}s"
+        wait = f" (queued {r['queued_seconds']:.2f}s)" if r["queued_seconds"] else ""
+        err = f"  {r['error']}" if r["error"] else ""
+        lines.append(f"  {name:<16} {r['group']:<7} {r['status']:<9} {secs}{wait}{err}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    # Self-check: a stuck social call must not delay chain work
+    def slow():
+        time.sleep(1.0)
+
+    def boom():
+        raise RuntimeError("429")
+
+    report = run_tasks([
+        Task("heartbeat", "social", slow, timeout=0.3),
+        Task("promotion", "social", lambda: "posted", timeout=1),
+        Task("clean", "chain", lambda: ["A"], timeout=1),
+        Task("bets", "sim", boom, timeout=1),
+        Task("updates", "social", lambda r: r, timeout=1, after=("clean", "bets")),
+    ])
+    print(format_report(report))
+    st = {n: r["status"] for n, r in report["tasks"].items()}
+    assert st == {"heartbeat": "timeout", "promotion": "cancelled", "clean": "ok", "bets": "error",
+                  "updates": "cancelled"}, st
+    assert report["total_seconds"] < 0.8
+    assert report["tasks"]["clean"]["seconds"] < 0.2
+
+    # social group still stuck: next run skips it, the rest runs
+    report = run_tasks([Task("heartbeat", "social", slow, 1), Task("clean", "chain", lambda: [], 1)])
+    assert report["tasks"]["heartbeat"]["status"] == "skipped" and report["tasks"]["clean"]["status"] == "ok"
+
+    time.sleep(1.0)  # stuck call returns; the group is usable again
+    got = {}
+    report = run_tasks([
+        Task("clean", "chain", lambda: ["A"], 1),
+        Task("updates", "social", lambda r: got.update(r), 1, after=("clean",)),
+    ])
+    assert report["tasks"]["updates"]["status"] == "ok" and got == {"clean": ["A"]}
+    print("task_groups: ok")
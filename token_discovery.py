@@ -1,7 +1,8 @@
 import json
 from web3 import Web3
 
-TRANSFER_TOPIC = Web3.keccak(text="Transfer(address,address,uint256)").hex()
+# keccak("Transfer(address,address,uint256)"), precomputed (0x-prefixed, as eth_getLogs expects)
+TRANSFER_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
 
 REGISTRY_FILE = "known_tokens.json"
 STATE_FILE = "scan_state.json"
@@ -1,8 +1,13 @@
+import glob
+import hashlib
 import json
 import os
-from typing import List, Set
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Set
 
-from monadscan_discovery import discover_token_contracts_monadscan
+from monadscan_discovery import DiscoveryError, discover_token_contracts_monadscan
 from dotenv import load_dotenv
 from web3 import Web3
 
@@ -10,6 +15,13 @@ from token_discovery import discover_token_contracts_incremental
 
 REGISTRY_FILE = "public_registry.json"
 
+# Sharded builder (large seed lists)
+SHARD_DIR = os.getenv("UNIVERSE_SHARD_DIR", "universe_shards")
+CHECKPOINT_EVERY = int(os.getenv("UNIVERSE_CHECKPOINT_EVERY", "25"))  # wallets between shard checkpoints
+DISCOVERY_MAX_PAGES = int(os.getenv("UNIVERSE_MAX_PAGES", "10"))
+DISCOVERY_RETRIES = int(os.getenv("UNIVERSE_DISCOVERY_RETRIES", "2"))  # per wallet, after the first try
+DISCOVERY_RETRY_SECONDS = float(os.getenv("UNIVERSE_DISCOVERY_RETRY_SECONDS", "5"))  # doubles per retry
+
 
 def _load_registry() -> Set[str]:
     if os.path.exists(REGISTRY_FILE):
@@ -23,10 +35,16 @@ def _load_registry() -> Set[str]:
     return set()
 
 
+def _write_json_atomic(path: str, data) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
 def _save_registry(addrs: Set[str]) -> None:
     arr = sorted(list(addrs))
-    with open(REGISTRY_FILE, "w") as f:
-        json.dump(arr, f, indent=2)
+    _write_json_atomic(REGISTRY_FILE, arr)
     print(f"Saved {len(arr)} tokens to {REGISTRY_FILE}")
 
 
@@ -65,9 +83,181 @@ def build_universe(seed_wallets: List[str]) -> None:
     _save_registry(registry)
 
 
+# -----------------------
+# Sharded / resumable builder
+# -----------------------
+
+def shard_of(wallet: str, shard_count: int) -> int:
+    """Stable wallet -> shard mapping (same answer on every machine)."""
+    digest = hashlib.sha256(wallet.strip().lower().encode()).digest()
+    return int.from_bytes(digest[:8], "big") % max(1, shard_count)
+
+
+def iter_seed_wallets(source: str) -> Iterator[str]:
+    """
+    Yields seed wallets from a file (one per line, or CSV with the wallet first)
+    or from stdin when source is "-". Blank lines and # comments are skipped.
+    """
+    f = sys.stdin if source == "-" else open(source, "r")
+    try:
+        for line in f:
+            w = line.split(",")[0].strip()
+            if w.startswith("0x") and len(w) == 42:
+                yield w
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _shard_path(shard_index: int, shard_count: int) -> str:
+    return os.path.join(SHARD_DIR, f"shard_{shard_index:04d}_of_{shard_count:04d}.json")
+
+
+def _load_checkpoint(path: str) -> Dict[str, list]:
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return {"done": list(data.get("done", [])), "tokens": list(data.get("tokens", []))}
+    except Exception:
+        pass
+    return {"done": [], "tokens": []}
+
+
+def _discover_wallet(wallet: str) -> Optional[List[str]]:
+    """Token contracts for one seed wallet, retrying 429s/errors; None if every try failed."""
+    for attempt in range(DISCOVERY_RETRIES + 1):
+        try:
+            return discover_token_contracts_monadscan(wallet, max_pages=DISCOVERY_MAX_PAGES, page_size=200,
+                                                      raise_on_error=True)
+        except DiscoveryError as e:
+            err = e
+        if attempt < DISCOVERY_RETRIES:
+            time.sleep(DISCOVERY_RETRY_SECONDS * (2 ** attempt))
+    print(f"Discovery failed for {wallet} ({err}); left pending for the next run")
+    return None
+
+
+def build_shard(seed_source: str, shard_index: int, shard_count: int) -> int:
+    """
+    Processes only the seed wallets that hash into `shard_index`.
+    Progress is checkpointed to SHARD_DIR every CHECKPOINT_EVERY wallets,
+    so a crashed/killed shard resumes where it stopped. A wallet only counts
+    as done once discovery answered for it; failed ones are retried next run.
+    Returns the number of tokens this shard has found so far.
+    """
+    load_dotenv(".env", override=True)
+    os.makedirs(SHARD_DIR, exist_ok=True)
+
+    path = _shard_path(shard_index, shard_count)
+    ckpt = _load_checkpoint(path)
+    done: Set[str] = set(ckpt["done"])
+    tokens: Set[str] = set(ckpt["tokens"])
+
+    def _checkpoint():
+        _write_json_atomic(path, {
+            "shard_index": shard_index,
+            "shard_count": shard_count,
+            "done": sorted(done),
+            "tokens": sorted(tokens),
+        })
+
+    since_checkpoint = 0
+    pending = 0
+    for wallet in iter_seed_wallets(seed_source):
+        wallet_lc = wallet.lower()
+        if shard_of(wallet_lc, shard_count) != shard_index or wallet_lc in done:
+            continue
+
+        candidates = _discover_wallet(wallet)
+        if candidates is None:
+            pending += 1
+            continue
+        for c in candidates:
+            if isinstance(c, str) and c.startswith("0x") and len(c) == 42:
+                tokens.add(Web3.to_checksum_address(c))
+
+        done.add(wallet_lc)
+        since_checkpoint += 1
+        if since_checkpoint >= CHECKPOINT_EVERY:
+            _checkpoint()
+            since_checkpoint = 0
+
+    _checkpoint()
+    print(f"[shard {shard_index}/{shard_count}] wallets={len(done)} pending={pending} tokens={len(tokens)}")
+    return len(tokens)
+
+
+def merge_shards(shard_count: Optional[int] = None) -> int:
+    """
+    Unions every shard checkpoint in SHARD_DIR into public_registry.json.
+    Addresses are de-duplicated case-insensitively and saved checksummed.
+    Returns how many tokens were new to the registry.
+    """
+    pattern = f"shard_*_of_{shard_count:04d}.json" if shard_count else "shard_*_of_*.json"
+    seen = {a.lower(): a for a in _load_registry()}
+    before = len(seen)
+
+    for path in sorted(glob.glob(os.path.join(SHARD_DIR, pattern))):
+        for addr in _load_checkpoint(path)["tokens"]:
+            if isinstance(addr, str) and addr.startswith("0x") and len(addr) == 42:
+                seen.setdefault(addr.lower(), Web3.to_checksum_address(addr))
+
+    added = len(seen) - before
+    print("Added after merge:", added)
+    _save_registry(set(seen.values()))
+    return added
+
+
+def build_universe_sharded(seed_source: str, shard_count: int, workers: int) -> None:
+    """
+    Spreads seed wallets over `shard_count` shards run on a local process pool,
+    then merges the shard outputs into the registry.
+    For several machines, run build_shard() per machine instead and merge once.
+    """
+    if seed_source == "-":
+        # every worker re-reads the seed list, so spool stdin to a file first
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        spooled = os.path.join(SHARD_DIR, "seeds.txt")
+        with open(spooled, "w") as f:
+            for w in iter_seed_wallets("-"):
+                f.write(w + "\n")
+        seed_source = spooled
+
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(build_shard, seed_source, i, shard_count): i for i in range(shard_count)}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                # the shard keeps its checkpoint; re-running resumes it
+                print(f"[shard {futures[fut]}/{shard_count}] failed:", e)
+
+    merge_shards(shard_count)
+
+
 if __name__ == "__main__":
     load_dotenv(".env", override=True)
 
+    # Sharded mode: SEED_WALLETS_FILE=path (or "-" for stdin)
+    #   UNIVERSE_SHARDS=N          number of shards (keep it fixed across runs/machines)
+    #   UNIVERSE_WORKERS=N         local process pool size
+    #   UNIVERSE_SHARD_INDEX=i     run just one shard (multi-machine), no merge
+    #   UNIVERSE_MERGE_ONLY=true   only merge existing shard checkpoints
+    seed_file = os.getenv("SEED_WALLETS_FILE", "").strip()
+    if seed_file:
+        shard_count = int(os.getenv("UNIVERSE_SHARDS", "16"))
+        shard_index = os.getenv("UNIVERSE_SHARD_INDEX", "").strip()
+
+        if os.getenv("UNIVERSE_MERGE_ONLY", "false").lower() == "true":
+            merge_shards(shard_count)
+        elif shard_index:
+            build_shard(seed_file, int(shard_index), shard_count)
+        else:
+            workers = int(os.getenv("UNIVERSE_WORKERS", str(os.cpu_count() or 4)))
+            build_universe_sharded(seed_file, shard_count, workers)
+        raise SystemExit(0)
+
     # ✅ Put your seed wallets here (you can add more later)
     seeds = [
         os.getenv("PUBLIC_WALLET", ""),  # your agent wallet from .env